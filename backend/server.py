@@ -1,15 +1,47 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 import os
 import logging
 import json
+import csv
+import gzip
+import io
+import base64
+import bisect
+import sqlite3
 import asyncio
+import threading
+import time
 from pathlib import Path
+from collections import OrderedDict
+from contextlib import contextmanager
+from types import MappingProxyType
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal, Union, get_args, get_origin
 import uuid
-from datetime import datetime
+import sys
+from array import array
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import orjson
+except ImportError:  # the json module does the same, only slower
+    orjson = None
+try:
+    import msgpack
+except ImportError:  # only needed for STORAGE_FORMAT=msgpack
+    msgpack = None
+import functools
+import hashlib
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
 
 
 ROOT_DIR = Path(__file__).parent
@@ -23,57 +55,2996 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # JSON file storage paths
-DATA_DIR = ROOT_DIR.parent / 'data' / 'json'
+DATA_DIR = Path(os.environ.get('DATA_DIR', ROOT_DIR.parent / 'data' / 'json'))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 EXERCISES_FILE = DATA_DIR / 'exercises.json'
 SPLITS_FILE = DATA_DIR / 'splits.json'
 SESSIONS_FILE = DATA_DIR / 'sessions.json'
 
+# Storage engine: "json" keeps each collection in a JSON file under DATA_DIR,
+# "sqlite" keeps them all in SQLITE_PATH (existing JSON data is migrated on start).
+STORAGE_ENGINE = os.environ.get('STORAGE_ENGINE', 'json')
+SQLITE_PATH = Path(os.environ.get('SQLITE_PATH', DATA_DIR.parent / 'sculptor.db'))
+
+# Session changes are appended to a journal by default; set SESSIONS_STORAGE=file
+# to rewrite sessions.json on every change instead.
+SESSIONS_STORAGE = os.environ.get('SESSIONS_STORAGE', 'journal')
+
+# Set SESSIONS_PARTITIONING=month to keep sessions in one file per month under
+# DATA_DIR/sessions/, past months gzip-compressed and only read when a query
+# reaches back to them (json engine only; sessions.json is split on first start).
+SESSIONS_PARTITIONING = os.environ.get('SESSIONS_PARTITIONING', 'none')
+
+# The journal is folded back into sessions.json once it holds this many records
+# or bytes, or has not been written to for this many seconds.
+COMPACT_MAX_RECORDS = int(os.environ.get('COMPACT_MAX_RECORDS', '1000'))
+COMPACT_MAX_BYTES = int(os.environ.get('COMPACT_MAX_BYTES', str(8 * 1024 * 1024)))
+COMPACT_IDLE_SECONDS = float(os.environ.get('COMPACT_IDLE_SECONDS', '300'))
+COMPACT_CHECK_INTERVAL = float(os.environ.get('COMPACT_CHECK_INTERVAL', '5'))
+
+# How often the collection files are checked for edits made from outside the
+# server (or, with sqlite, by other processes); ETags follow them after that.
+STORAGE_POLL_INTERVAL = float(os.environ.get('STORAGE_POLL_INTERVAL', '1'))
+
+# Set STORAGE_MULTIPROCESS=1 when running several server processes over the same
+# data directory (e.g. uvicorn --workers N); needs fcntl, so not on Windows.
+STORAGE_MULTIPROCESS = os.environ.get('STORAGE_MULTIPROCESS', '').lower() in ('1', 'true', 'yes')
+
+# Size of the thread pool that runs blocking storage work for the async routes
+STORAGE_IO_THREADS = int(os.environ.get('STORAGE_IO_THREADS', '4'))
+
+# Group commit: with a window above 0, record updates (exercise completions and
+# resets) arriving within GROUP_COMMIT_WINDOW_MS of each other are written
+# together, or as soon as GROUP_COMMIT_MAX_OPS of them are waiting, and each is
+# answered once that write is on disk.
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get('GROUP_COMMIT_WINDOW_MS', '0'))
+GROUP_COMMIT_MAX_OPS = int(os.environ.get('GROUP_COMMIT_MAX_OPS', '64'))
+
+# Extra split templates (a JSON object of templates keyed by id) served next to
+# the predefined ones by /api/templates; read once at startup.
+TEMPLATES_FILE = Path(os.environ.get('TEMPLATES_FILE', DATA_DIR / 'templates.json'))
+
+# Memory for serialized GET responses kept by the response cache (0 disables it)
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+# How the cache holds loaded sessions: "packed" (tuples and array-backed set
+# columns, several times smaller) or "dicts" (as parsed, no conversion on reads).
+SESSIONS_CACHE_FORMAT = os.environ.get('SESSIONS_CACHE_FORMAT', 'packed')
+
+# How many recent writes /api/changes can replay; clients further behind refetch
+CHANGE_FEED_MAX_ENTRIES = int(os.environ.get('CHANGE_FEED_MAX_ENTRIES', '10000'))
+
+# Live session progress (/api/sessions/{id}/events): events a subscriber may fall
+# behind before it is dropped, and how often an idle stream sends a keepalive.
+SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', '64'))
+SSE_KEEPALIVE_SECONDS = float(os.environ.get('SSE_KEEPALIVE_SECONDS', '15'))
+
+# Encoding of the collection files: "json" (indented), "compact-json" or "msgpack".
+# Files in any of them are read whatever the setting; a collection switches
+# over on its next full rewrite.
+STORAGE_FORMAT = os.environ.get('STORAGE_FORMAT', 'json')
+STORAGE_FORMATS = ('json', 'compact-json', 'msgpack')
+
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse if orjson is not None else JSONResponse)
+
+# Create a router with the /api prefix
+api_router = APIRouter(prefix="/api")
+
+def _to_storable(value):
+    """Convert a value to the shape it has after a round trip through the JSON files.
+
+    Cached collections must look exactly like freshly parsed ones, otherwise
+    e.g. sorting a mix of ``datetime`` and ``str`` timestamps blows up.
+    """
+    if isinstance(value, dict):
+        return {key: _to_storable(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_to_storable(item) for item in value]
+    if isinstance(value, datetime):
+        return str(value)
+    return value
+
+def _json_dumps(value, indent: bool = False) -> bytes:
+    """Encode ``value`` as UTF-8 JSON, datetimes as ``str()`` like the stored timestamps."""
+    if orjson is not None:
+        option = orjson.OPT_PASSTHROUGH_DATETIME | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(value, default=str, option=option)
+    return json.dumps(value, indent=2 if indent else None, separators=None if indent else (',', ':'),
+                      ensure_ascii=False, default=str).encode('utf-8')
+
+def _json_loads(raw):
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+def _encode_collection(data: list, storage_format: str) -> bytes:
+    if storage_format == 'msgpack':
+        return msgpack.packb(data, default=str, use_bin_type=True)
+    return _json_dumps(data, indent=storage_format == 'json')
+
+def _decode_collection(raw: bytes) -> list:
+    """Decode a collection file in any of the STORAGE_FORMATS, gzip-compressed or not.
+
+    JSON text starts with ``[`` or whitespace, a msgpack array with a
+    fixarray (0x90-0x9f) or array 16/32 (0xdc/0xdd) header, gzip with 1f 8b.
+    """
+    if raw[:2] == b'\x1f\x8b':
+        raw = gzip.decompress(raw)
+    if raw and (0x90 <= raw[0] <= 0x9f or raw[0] in (0xdc, 0xdd)):
+        if msgpack is None:
+            raise RuntimeError("Reading msgpack collection files needs the msgpack package")
+        return msgpack.unpackb(raw, raw=False)
+    return _json_loads(raw)
+
+def _write_synced(file_path: Path, content: bytes):
+    """Write ``content`` to ``file_path`` and fsync it before returning."""
+    with open(file_path, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+
+# Distinct key orders of packed records, each kept once
+_KEY_ORDERS: Dict[tuple, tuple] = {}
+_SET_KEYS = ('set_number', 'weight', 'reps')
+
+def _key_order(record: dict) -> tuple:
+    keys = tuple(record)
+    return _KEY_ORDERS.setdefault(keys, keys)
+
+def _is_packable_set(workout_set) -> bool:
+    return (type(workout_set) is dict and tuple(workout_set) == _SET_KEYS
+            and type(workout_set['set_number']) is int and type(workout_set['weight']) is float
+            and type(workout_set['reps']) is int)
+
+class _PackedSession:
+    """A session as the collection cache holds it for ``packed_files``.
+
+    Field names are stored once per distinct key order and the values in a
+    tuple; each exercise is a tuple of its key order and values, with its id
+    and name interned since they repeat across sessions. The sets of all
+    exercises go into two session-wide columns, weights in an ``array('d')``
+    and set numbers and reps interleaved in an ``array('H')`` (``'q'`` when
+    out of its range); an exercise keeps only its set count. ``pack`` leaves
+    records it cannot represent exactly as they are, so ``unpack`` always
+    gives back the dict a record was made from.
+    """
+    __slots__ = ('keys', 'values', 'weights', 'counts')
+
+    def __init__(self, keys: tuple, values: tuple, weights: array, counts: array):
+        self.keys = keys
+        self.values = values
+        self.weights = weights
+        self.counts = counts
+
+    @classmethod
+    def pack(cls, record):
+        exercises = record.get('exercises') if type(record) is dict else None
+        if type(exercises) is not list or not all(type(exercise) is dict for exercise in exercises):
+            return record
+        weights, counts, packed = [], [], []
+        for exercise in exercises:
+            values = [_key_order(exercise)]
+            for key, value in exercise.items():
+                if key == 'sets' and type(value) is list and all(map(_is_packable_set, value)):
+                    for workout_set in value:
+                        weights.append(workout_set['weight'])
+                        counts += (workout_set['set_number'], workout_set['reps'])
+                    value = len(value)
+                elif key == 'sets' and type(value) is int:
+                    return record
+                elif type(value) is str:
+                    value = sys.intern(value)
+                values.append(value)
+            packed.append(tuple(values))
+        for typecode in ('H', 'q'):
+            try:
+                counts_column = array(typecode, counts)
+                break
+            except OverflowError:
+                continue
+        else:
+            return record
+        values = tuple(tuple(packed) if key == 'exercises' else value for key, value in record.items())
+        return cls(_key_order(record), values, array('d', weights), counts_column)
+
+    def get(self, key: str, default=None):
+        if key not in self.keys:
+            return default
+        if key == 'exercises':
+            return self.unpack()['exercises']
+        return self.values[self.keys.index(key)]
+
+    def unpack(self) -> dict:
+        weights, counts = self.weights, self.counts
+        position = 0
+        record = {}
+        for key, value in zip(self.keys, self.values):
+            if key == 'exercises':
+                exercises = []
+                for packed in value:
+                    exercise = {}
+                    for field, field_value in zip(packed[0], packed[1:]):
+                        if field == 'sets' and type(field_value) is int:
+                            end = position + field_value
+                            field_value = [{"set_number": counts[2 * i], "weight": weights[i],
+                                            "reps": counts[2 * i + 1]} for i in range(position, end)]
+                            position = end
+                        exercise[field] = field_value
+                    exercises.append(exercise)
+                value = exercises
+            record[key] = value
+        return record
+
+def _unpacked(records: list) -> list:
+    return [record.unpack() if type(record) is _PackedSession else record for record in records]
+
+class _CachedCollection:
+    """Parsed contents of one collection, its indexes and the on-disk state it was read at.
+
+    ``by_id`` and ``positions`` map record ids to the records and their list
+    positions. Every declared secondary index maps a field value to the ids
+    of the records having it, in the order they got that value. Every
+    sorted index is an ascending list of ``(value, id)`` keys, see ``range``.
+    ``journal_offset`` is how many bytes of the journal are reflected in
+    ``data``; ``generation`` is the shared generation number in multi-process
+    mode. With ``packed`` the records are held as ``_PackedSession``; the
+    lookups (``record``, ``range``, ``find``) hand them out unpacked.
+    """
+    __slots__ = ('data', 'signature', 'journal_records', 'journal_offset', 'generation',
+                 'by_id', 'positions', 'indexes', 'sorted_indexes', 'packed')
+
+    def __init__(self, data: list, signature: tuple, indexed_fields=(), journal_records: int = 0,
+                 journal_offset: int = 0, generation: Optional[int] = None, sorted_fields=(),
+                 packed: bool = False):
+        self.packed = packed
+        if packed:
+            data = [_PackedSession.pack(record) for record in data]
+        self.data = data
+        self.signature = signature
+        self.journal_records = journal_records
+        self.journal_offset = journal_offset
+        self.generation = generation
+        self.by_id: Dict[str, dict] = {}
+        self.positions: Dict[str, int] = {}
+        self.indexes: Dict[str, Dict[Any, Dict[str, None]]] = {field: {} for field in indexed_fields}
+        self.sorted_indexes: Dict[str, List[tuple]] = {}
+        for position, record in enumerate(data):
+            self.by_id[record.get('id')] = record
+            self.positions[record.get('id')] = position
+            self._index(record)
+        self.sorted_indexes = {field: sorted(self._sort_key(field, record) for record in data)
+                               for field in sorted_fields}
+
+    @staticmethod
+    def _sort_key(field: str, record: dict) -> tuple:
+        value = record.get(field)
+        return ('' if value is None else value, record.get('id'))
+
+    def _index(self, record: dict, previous: dict = None):
+        item_id = record.get('id')
+        for field, keys in self.sorted_indexes.items():
+            key = self._sort_key(field, record)
+            if previous is not None:
+                old_key = self._sort_key(field, previous)
+                if old_key == key:
+                    continue
+                del keys[bisect.bisect_left(keys, old_key)]
+            bisect.insort(keys, key)
+        for field, index in self.indexes.items():
+            value = record.get(field)
+            if previous is not None:
+                old_value = previous.get(field)
+                if old_value == value:
+                    continue
+                ids = index[old_value]
+                del ids[item_id]
+                if not ids:
+                    del index[old_value]
+            index.setdefault(value, {})[item_id] = None
+
+    def _unindex(self, record: dict):
+        for field, keys in self.sorted_indexes.items():
+            del keys[bisect.bisect_left(keys, self._sort_key(field, record))]
+        for field, index in self.indexes.items():
+            ids = index[record.get(field)]
+            del ids[record.get('id')]
+            if not ids:
+                del index[record.get(field)]
+
+    def apply(self, op: dict) -> bool:
+        """Apply a journal record in place, keeping the indexes current.
+
+        ``insert`` and ``replace`` are upserts so that replaying is idempotent.
+        Both are O(1); ``delete`` is O(n) as the later positions shift.
+        """
+        item_id = op['id']
+        position = self.positions.get(item_id)
+        if op['op'] == 'delete':
+            if position is None:
+                return False
+            self._unindex(self.data[position])
+            del self.data[position]
+            del self.by_id[item_id]
+            del self.positions[item_id]
+            for moved in range(position, len(self.data)):
+                self.positions[self.data[moved].get('id')] = moved
+            return True
+        record = _PackedSession.pack(op['doc']) if self.packed else op['doc']
+        if position is None:
+            self.positions[item_id] = len(self.data)
+            self.data.append(record)
+            self._index(record)
+        else:
+            self._index(record, previous=self.data[position])
+            self.data[position] = record
+        self.by_id[item_id] = record
+        return True
+
+    def range(self, field: str, start=None, end=None, after: tuple = None,
+              limit: Optional[int] = None, descending: bool = True) -> list:
+        """Records with ``start <= field < end`` in (``field``, id) order, via the sorted index.
+
+        ``after`` is the key of the last record of the previous page. Costs
+        O(log n + returned records).
+        """
+        keys = self.sorted_indexes[field]
+        lo = 0 if start is None else bisect.bisect_left(keys, (start,))
+        hi = len(keys) if end is None else bisect.bisect_left(keys, (end,))
+        if after is not None:
+            if descending:
+                hi = min(hi, bisect.bisect_left(keys, tuple(after)))
+            else:
+                lo = max(lo, bisect.bisect_right(keys, tuple(after)))
+        window = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+        if limit is not None:
+            window = window[:limit]
+        return _unpacked([self.by_id[keys[i][1]] for i in window])
+
+    def find(self, filters: Dict[str, Any]) -> list:
+        """Records matching all ``filters``, narrowed down by the smallest usable index."""
+        buckets = [self.indexes[field].get(value, {}) for field, value in filters.items()
+                   if field in self.indexes]
+        if buckets:
+            candidates = [self.by_id[item_id] for item_id in min(buckets, key=len)]
+        else:
+            candidates = self.data
+        return _unpacked([record for record in candidates
+                          if all(record.get(field) == value for field, value in filters.items())])
+
+    def record(self, item_id: str) -> Optional[dict]:
+        record = self.by_id.get(item_id)
+        return record.unpack() if type(record) is _PackedSession else record
+
+class _ProcessLock:
+    """Reentrant ``fcntl.flock`` on a collection's ``.lock`` file.
+
+    The lock file also holds the collection's generation number, which every
+    writer bumps while holding the exclusive lock. Callers must hold the
+    collection's thread lock, which is what keeps the depth counter safe.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd: Optional[int] = None
+        self._pid: Optional[int] = None
+        self._depth = 0
+        self._exclusive = False
+        self._peek_fd: Optional[int] = None
+        self._peek_pid: Optional[int] = None
+
+    @contextmanager
+    def hold(self, exclusive: bool):
+        if self._depth == 0:
+            if self._pid != os.getpid():
+                # flock locks belong to the open file, so a forked child
+                # needs its own descriptor to exclude its parent
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                self._pid = os.getpid()
+            fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._exclusive = exclusive
+        elif exclusive and not self._exclusive:
+            raise RuntimeError(f"Cannot upgrade the shared lock on {self.path}")
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def generation(self) -> int:
+        raw = os.pread(self._fd, 20, 0)
+        return int(raw) if raw.strip() else 0
+
+    def bump(self) -> int:
+        generation = self.generation() + 1
+        os.pwrite(self._fd, b'%020d' % generation, 0)
+        return generation
+
+    def peek_generation(self) -> int:
+        """The generation number, read without the lock or the thread lock.
+
+        Uses a descriptor of its own, so it never swaps the one holding the lock.
+        """
+        if self._peek_pid != os.getpid():
+            self._peek_fd = os.open(self.path, os.O_RDONLY | os.O_CREAT, 0o644)
+            self._peek_pid = os.getpid()
+        raw = os.pread(self._peek_fd, 20, 0)
+        return int(raw) if raw.strip() else 0
+
+# JSON Database Helper Functions
+class _ChangeLog:
+    """Numbered record-level writes of one collection, in ``<name>.changes.ndjson``.
+
+    The first line names the log with a random id and the sequence number
+    it starts after, every other line is one write: ``{"seq", "op", "id"}``,
+    or just ``{"seq"}`` where the whole collection was replaced. Once the log holds twice ``max_entries`` it is
+    rewritten with the newest ``max_entries`` only. Callers hold the
+    collection's lock, so the log is as safe to share between processes as
+    the collection itself.
+
+    The log is written after the data it describes and never fsynced, so
+    the data's own synced write is the only one. Instead the log keeps the
+    stat signature of every data file as of its last entry (in the header
+    and on ``{"file", "sig"}`` lines). Where the files differ from that (a
+    log that lost its tail in a crash, an outside edit) the log starts over
+    under a new id, which turns every cursor into a reset.
+    """
+
+    def __init__(self, path: Path, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.log_id: Optional[str] = None
+        self.seq = 0
+        # (seq, op), op being {"op", "id"} or None
+        self.entries: List[tuple] = []
+        # File name -> signature, as JSON values
+        self.files: Dict[str, Any] = {}
+        self._stat = None
+        self._valid_bytes = 0
+
+    @staticmethod
+    def _plain(signature):
+        return None if signature is None else _json_loads(_json_dumps(signature))
+
+    def _load(self):
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            self.log_id, self.seq, self.entries, self.files = None, 0, [], {}
+            self._stat, self._valid_bytes = None, 0
+            return
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if signature == self._stat:
+            return
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        log_id, seq, entries, files, valid_bytes = None, 0, [], {}, 0
+        start = 0
+        while True:
+            end = raw.find(b'\n', start)
+            if end < 0:
+                # A line without its newline is the torn tail of an interrupted append
+                break
+            try:
+                line = _json_loads(raw[start:end])
+            except ValueError:
+                break
+            if log_id is None:
+                log_id = line.get('log')
+                if not log_id:
+                    break
+                seq = line.get('seq', 0)
+                files = dict(line.get('files') or {})
+            else:
+                if 'seq' in line:
+                    entries.append((line['seq'], {"op": line['op'], "id": line['id']} if 'op' in line else None))
+                if 'file' in line:
+                    if line['sig'] is None:
+                        files.pop(line['file'], None)
+                    else:
+                        files[line['file']] = line['sig']
+            start = valid_bytes = end + 1
+        self.log_id, self.entries, self.files = log_id, entries, files
+        self.seq = entries[-1][0] if entries else seq
+        self._stat, self._valid_bytes = signature, valid_bytes
+
+    def read(self, since: Optional[int], files: Dict[str, Any]) -> tuple:
+        """``(log id, seq, entries after since)``; entries is None where the log does not reach back to ``since``.
+
+        ``files`` are the current signatures of the data files; a log that
+        does not match them starts over.
+        """
+        self._load()
+        if self.log_id is not None and self.files != {name: self._plain(signature) for name, signature
+                                                      in files.items() if signature is not None}:
+            self._rewrite(uuid.uuid4().hex[:8], [], self.seq, files)
+        if since is None or self.log_id is None:
+            return self.log_id, self.seq, None
+        first = self.entries[0][0] - 1 if self.entries else self.seq
+        if since > self.seq or since < first:
+            return self.log_id, self.seq, None
+        return self.log_id, self.seq, self.entries[since - first:]
+
+    def append(self, ops, name: str, before, after):
+        """Log ``ops``, which changed the data file ``name`` from signature ``before`` to ``after``."""
+        self._load()
+        added = [(self.seq + n, None if op is None else {"op": op['op'], "id": op['id']})
+                 for n, op in enumerate(ops, 1)]
+        before, after = self._plain(before), self._plain(after)
+        files = dict(self.files)
+        if after is None:
+            files.pop(name, None)
+        else:
+            files[name] = after
+        if self.log_id is None:
+            self._rewrite(uuid.uuid4().hex[:8], added, self.seq + len(added), files)
+        elif self.files.get(name) != before:
+            # The log missed changes to the file, so readers have to start over
+            self._rewrite(uuid.uuid4().hex[:8], [], self.seq + len(added), files)
+        elif len(self.entries) + len(added) > 2 * self.max_entries:
+            self._rewrite(self.log_id, (self.entries + added)[-self.max_entries:], self.seq + len(added), files)
+        else:
+            lines = [dict(op or {}, seq=seq) for seq, op in added]
+            if lines:
+                lines[-1].update(file=name, sig=after)
+            else:
+                lines.append({"file": name, "sig": after})
+            with open(self.path, 'ab') as f:
+                if f.tell() > self._valid_bytes:
+                    # Cut off the torn tail of an interrupted append
+                    f.truncate(self._valid_bytes)
+                f.write(b''.join(_json_dumps(line) + b'\n' for line in lines))
+            self._remember(self.log_id, self.entries + added, self.seq + len(added), files)
+
+    def _rewrite(self, log_id: str, entries: list, seq: int, files: Dict[str, Any]):
+        files = {name: self._plain(signature) for name, signature in files.items() if signature is not None}
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(_json_dumps({"log": log_id, "seq": entries[0][0] - 1 if entries else seq,
+                                 "files": files}) + b'\n')
+            f.write(b''.join(_json_dumps(dict(op or {}, seq=number)) + b'\n' for number, op in entries))
+        os.replace(tmp_path, self.path)
+        self._remember(log_id, entries, seq, files)
+
+    def _remember(self, log_id: str, entries: list, seq: int, files: Dict[str, Any]):
+        stat = self.path.stat()
+        self.log_id, self.entries, self.seq, self.files = log_id, entries, seq, files
+        self._stat, self._valid_bytes = (stat.st_mtime_ns, stat.st_size, stat.st_ino), stat.st_size
+
+
+class JSONDatabase:
+    """Storage interface the routes talk to.
+
+    A collection is addressed by the path of its JSON file (``EXERCISES_FILE``
+    and friends) whichever engine stores it, and records are plain
+    JSON-shaped dicts with an ``id``. ``JSONFileDatabase`` keeps collections
+    in those files, ``SQLiteDatabase`` in one SQLite database;
+    ``create_database`` picks one from ``STORAGE_ENGINE``.
+    """
+
+    def __init__(self):
+        # Versions come from one counter, so no two states of a collection
+        # share one; the instance id keeps them apart from earlier runs'.
+        self._instance_id = uuid.uuid4().hex[:8]
+        self._version_counter = itertools.count(1)
+        self._versions: Dict[Path, int] = {}
+        self._listeners = []
+
+    def version(self, file_path: Path) -> str:
+        """Token that changes with every write to the collection.
+
+        It changes only once the write is visible, so a reader that takes the
+        version before reading never pairs an old token with newer data the
+        other way round. Cheap and non-blocking; ETags are made from it.
+        """
+        return f"{self._instance_id}.{self._versions.get(file_path, 0)}"
+
+    def poll(self, file_path: Path):
+        """Notice writes to the collection made behind this instance's back.
+
+        Versions only follow them once this (or a read of the collection)
+        has seen them, which keeps ``version`` free of disk I/O. Blocking.
+        """
+
+    def add_listener(self, listener):
+        """Have ``listener(file_path, op)`` called after every write, in the writing thread.
+
+        ``op`` is the journal-style ``insert``/``replace``/``delete`` record of
+        a record-level write, or None when the whole collection was replaced.
+        Only writes made through this instance are reported; ``version``
+        also covers those of other processes.
+        """
+        self._listeners.append(listener)
+
+    def _changed(self, file_path: Path, op: Optional[dict] = None):
+        self._versions[file_path] = next(self._version_counter)
+        for listener in self._listeners:
+            try:
+                listener(file_path, op)
+            except Exception as e:
+                logger.error(f"Write listener {listener} failed for {file_path.name}: {e}")
+
+    def locked(self, file_path: Path, exclusive: bool = True):
+        """Context manager holding the lock of a collection.
+
+        Calls made inside it join the lock, so a load followed by a save is
+        atomic with respect to other writers.
+        """
+        raise NotImplementedError
+
+    def load_json(self, file_path: Path, default_data: list = None):
+        """All records of a collection, or ``default_data`` if it has none."""
+        raise NotImplementedError
+
+    def save_json(self, file_path: Path, data: list):
+        """Replace the whole collection by ``data``."""
+        raise NotImplementedError
+
+    def get(self, file_path: Path, item_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def find(self, file_path: Path, **filters) -> list:
+        """Records whose fields equal all non-None ``filters``."""
+        raise NotImplementedError
+
+    def page(self, file_path: Path, field: str, start=None, end=None, after: tuple = None,
+             limit: Optional[int] = None, descending: bool = True) -> list:
+        """Records with ``start <= field < end``, ordered by (``field``, id).
+
+        Keyset pagination: ``after`` is the (field, id) key of the last record
+        of the previous page. Newest first by default. Engines override this
+        with an index walk; this fallback sorts the whole collection.
+        """
+        def key(record):
+            value = record.get(field)
+            return ('' if value is None else value, record.get('id'))
+
+        records = sorted(self.load_json(file_path, []), key=key, reverse=descending)
+        result = []
+        for record in records:
+            record_key = key(record)
+            if ((start is not None and record_key[0] < start) or (end is not None and record_key[0] >= end)
+                    or (after is not None and (record_key >= tuple(after) if descending
+                                               else record_key <= tuple(after)))):
+                continue
+            result.append(record)
+            if limit is not None and len(result) == limit:
+                break
+        return result
+
+    def insert(self, file_path: Path, record: dict) -> bool:
+        raise NotImplementedError
+
+    def replace(self, file_path: Path, item_id: str, record: dict) -> bool:
+        """Replace the record with ``item_id``; False if there is none."""
+        raise NotImplementedError
+
+    def delete(self, file_path: Path, item_id: str) -> bool:
+        """Delete the record with ``item_id``; False if there is none."""
+        raise NotImplementedError
+
+    def update(self, file_path: Path, item_id: str, fn):
+        """Atomically replace the record with ``item_id`` by ``fn(record)``.
+
+        Returns the stored new record, or None if there is no such record.
+        Exceptions raised by ``fn`` abort the update and propagate.
+        """
+        raise NotImplementedError
+
+    def update_many(self, file_path: Path, updates: Dict[str, Any]) -> Dict[str, Optional[dict]]:
+        """Apply ``update`` for every ``item_id: fn`` of ``updates`` under one hold of the lock.
+
+        Returns the new records by id, None for missing ids. This default
+        calls ``update`` once per record, so it is all-or-nothing only where
+        ``locked`` is a transaction that rolls back on an exception (SQLite);
+        engines without one override it to store every new record in one
+        write, so that if ``fn`` raises or the write fails none is written.
+        """
+        with self.locked(file_path):
+            return {item_id: self.update(file_path, item_id, fn) for item_id, fn in updates.items()}
+
+    def changes(self, file_path: Path, since: Optional[int] = None) -> tuple:
+        """The change log of a collection: ``(log id, seq, entries)``.
+
+        The log numbers the collection's writes 1, 2, ... and is kept in
+        storage, so it survives restarts and every process sharing the
+        storage sees the same one; a new log gets a new id. ``entries`` are
+        the ``(seq, op)`` after ``since``, op being ``{"op", "id"}`` or None
+        for a whole-collection save, or None if ``since`` is None or not
+        covered by the log. Collections without a log have log id None.
+        """
+        return None, 0, None
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+    @staticmethod
+    def filter_by(data: list, **filters):
+        result = data
+        for key, value in filters.items():
+            if value is not None:
+                result = [item for item in result if item.get(key) == value]
+        return result
+
+class JSONFileDatabase(JSONDatabase):
+    """JSON file storage with a write-through in-memory cache.
+
+    Parsed collections are kept in memory and served from there as long as the
+    stat signature of their files is unchanged; an outside edit is picked up
+    on the next load. ``load_json`` returns a new list, but the record dicts in
+    it are shared with the cache, so handlers must replace records rather than
+    mutate them in place.
+
+    A collection may also have a journal next to it (``<name>.journal.ndjson``)
+    holding one ``insert``/``replace``/``delete`` record per line. The current
+    state is the JSON file with the journal replayed on top. For files listed
+    in ``journaled_files`` the record-level writes (``insert``, ``replace``,
+    ``delete``) append to the journal instead of rewriting the whole file, so
+    they cost O(1) disk I/O however large the collection gets. Journal records
+    always carry the full document, which makes replaying them idempotent.
+    ``compact`` folds a journal back into the JSON file.
+
+    Every operation on a collection holds that collection's lock, so the
+    database can be shared with background threads such as the compactor.
+    Files are never rewritten in place: a new version is written to a temp
+    file, fsynced and renamed over the old one, and journal appends are
+    fsynced before they are acknowledged, so a crash leaves either the old or
+    the new state on disk. ``update`` is the read-modify-write primitive;
+    doing the read and the write under one lock means concurrent updates of
+    the same record are applied one after the other and none is lost.
+
+    ``indexes`` declares secondary indexes per collection (a list of field
+    names); ``get`` looks records up by id in O(1) and ``find`` answers
+    equality filters on an indexed field in O(matches). ``sorted_indexes``
+    declares fields ``page`` can walk in order in O(log n + page size).
+    Writes keep all indexes current in place.
+
+    Collections in ``packed_files`` are cached as ``_PackedSession`` records,
+    several times smaller than the parsed dicts for a long session history;
+    every read converts the records it returns back to dicts, so callers
+    see no difference.
+
+    ``storage_format`` is the encoding collection files are (re)written in,
+    one of STORAGE_FORMATS; files in the other ones are still read. Journal
+    records are always single-line JSON.
+
+    With ``multiprocess`` the collection lock is also an ``fcntl`` lock on
+    ``<name>.lock`` (shared for reads, exclusive for writes), so several
+    server processes can share the data directory. Each write bumps the
+    generation number kept in the lock file, and a cached collection is only
+    used while its generation is current. When only the journal has grown,
+    the cache catches up by replaying the new records instead of reloading.
+
+    Collections in ``change_log_files`` number their writes in a change log
+    (``<name>.changes.ndjson``, see ``changes``) holding the newest
+    ``change_log_entries`` or up to twice as many. Outside edits the cache
+    notices are logged as whole-collection saves.
+    """
+
+    def __init__(self, journaled_files=(), multiprocess: bool = False,
+                 indexes: Dict[Path, List[str]] = None, sorted_indexes: Dict[Path, List[str]] = None,
+                 storage_format: str = 'json', packed_files=(), change_log_files=(),
+                 change_log_entries: int = 10000):
+        if multiprocess and fcntl is None:
+            raise RuntimeError("Multi-process storage needs fcntl, which this platform lacks")
+        if storage_format not in STORAGE_FORMATS:
+            raise ValueError(f"Unknown storage format {storage_format!r} (expected one of {STORAGE_FORMATS})")
+        if storage_format == 'msgpack' and msgpack is None:
+            raise RuntimeError("The msgpack storage format needs the msgpack package")
+        super().__init__()
+        self.storage_format = storage_format
+        self._journaled = set(journaled_files)
+        self._indexes = dict(indexes or {})
+        self._sorted_indexes = dict(sorted_indexes or {})
+        self._packed = set(packed_files)
+        self._multiprocess = multiprocess
+        self._cache: Dict[Path, _CachedCollection] = {}
+        self._locks: Dict[Path, threading.RLock] = {}
+        self._process_locks: Dict[Path, _ProcessLock] = {}
+        self._change_logs = {file_path: _ChangeLog(file_path.with_name(f"{file_path.stem}.changes.ndjson"),
+                                                   change_log_entries)
+                             for file_path in change_log_files}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _lock_for(self, file_path: Path) -> threading.RLock:
+        lock = self._locks.get(file_path)
+        if lock is None:
+            lock = self._locks.setdefault(file_path, threading.RLock())
+        return lock
+
+    @contextmanager
+    def locked(self, file_path: Path, exclusive: bool = True):
+        """Hold the lock of a collection; the methods called inside reuse it."""
+        with self._lock_for(file_path):
+            if not self._multiprocess:
+                yield
+                return
+            process_lock = self._process_locks.get(file_path)
+            if process_lock is None:
+                process_lock = self._process_locks.setdefault(
+                    file_path, _ProcessLock(file_path.with_name(f"{file_path.stem}.lock")))
+            with process_lock.hold(exclusive):
+                yield
+
+    def version(self, file_path: Path) -> str:
+        """In multi-process mode the shared generation number, which survives restarts."""
+        if not self._multiprocess:
+            return super().version(file_path)
+        process_lock = self._process_locks.get(file_path)
+        if process_lock is None:
+            process_lock = self._process_locks.setdefault(
+                file_path, _ProcessLock(file_path.with_name(f"{file_path.stem}.lock")))
+        return f"g{process_lock.peek_generation()}"
+
+    def poll(self, file_path: Path):
+        """Check the files of a cached collection, which re-reads them if they changed."""
+        if file_path in self._cache:
+            self._collection(file_path)
+
+    def _generation(self, file_path: Path, bump: bool = False) -> Optional[int]:
+        if not self._multiprocess:
+            return None
+        process_lock = self._process_locks[file_path]
+        return process_lock.bump() if bump else process_lock.generation()
+
+    def _new_collection(self, file_path: Path, data: list, signature, **state) -> _CachedCollection:
+        return _CachedCollection(data, signature, self._indexes.get(file_path, ()),
+                                 sorted_fields=self._sorted_indexes.get(file_path, ()),
+                                 packed=file_path in self._packed, **state)
+
+    @staticmethod
+    def journal_path(file_path: Path) -> Path:
+        # A compressed collection keeps the journal name of the plain one
+        return file_path.with_name(f"{Path(file_path.name.removesuffix('.gz')).stem}.journal.ndjson")
+
+    def _is_journaled(self, file_path: Path) -> bool:
+        return file_path in self._journaled
+
+    def _change_log(self, file_path: Path) -> Optional[_ChangeLog]:
+        return self._change_logs.get(file_path)
+
+    def _log_changes(self, file_path: Path, ops, before, after):
+        """Number ``ops`` in the change log of ``file_path``, if it has one, once they are written.
+
+        ``before`` and ``after`` are the signatures of the file around the
+        write. Failing to log does not fail the write: the log notices the
+        files no longer match it and starts over.
+        """
+        log = self._change_log(file_path)
+        if log is None:
+            return
+        try:
+            log.append(ops, file_path.name, before, after)
+        except Exception as e:
+            logger.error(f"Error logging changes of {file_path}: {e}")
+
+    def _logged_files(self, file_path: Path) -> Dict[str, Any]:
+        """Signatures of the data files the change log of ``file_path`` describes."""
+        return {file_path.name: self._signature(file_path)}
+
+    def changes(self, file_path: Path, since: Optional[int] = None) -> tuple:
+        log = self._change_log(file_path)
+        if log is None:
+            return super().changes(file_path, since)
+        with self.locked(file_path, exclusive=False):
+            return log.read(since, self._logged_files(file_path))
+
+    def _encode(self, file_path: Path, data: list) -> bytes:
+        """File contents for ``data``; gzip-compressed when the file name ends in ``.gz``."""
+        content = _encode_collection(data, self.storage_format)
+        return gzip.compress(content, compresslevel=6) if file_path.suffix == '.gz' else content
+
+    @staticmethod
+    def _stat(file_path: Path):
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _signature(self, file_path: Path):
+        snapshot = self._stat(file_path)
+        journal = self._stat(self.journal_path(file_path))
+        if snapshot is None and journal is None:
+            return None
+        return (snapshot, journal)
+
+    def _read_journal(self, file_path: Path, offset: int = 0):
+        """Parse the journal records after ``offset``; returns them and the new offset.
+
+        A torn last line, which is what a crash mid-append leaves behind, is not
+        consumed; the next append cuts it off.
+        """
+        journal_path = self.journal_path(file_path)
+        try:
+            with open(journal_path, 'rb') as f:
+                f.seek(offset)
+                raw = f.read()
+        except FileNotFoundError:
+            return [], 0
+        end = raw.rfind(b'\n') + 1
+        ops = []
+        for line in raw[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                ops.append(_json_loads(line))
+            except ValueError:
+                logger.warning(f"Skipping corrupt record in {journal_path}")
+        return ops, offset + end
+
+    def _read(self, file_path: Path, signature: tuple) -> _CachedCollection:
+        data = []
+        if file_path.exists():
+            with open(file_path, 'rb') as f:
+                data = _decode_collection(f.read())
+        ops, offset = self._read_journal(file_path)
+        cached = self._new_collection(file_path, data, signature, journal_records=len(ops),
+                                      journal_offset=offset)
+        for op in ops:
+            cached.apply(op)
+        if ops:
+            logger.info(f"Replayed {len(ops)} journal records for {file_path.name}")
+        return cached
+
+    def _catch_up(self, cached: _CachedCollection, file_path: Path, signature: tuple):
+        """Replay only the journal records appended since ``cached`` was read.
+
+        Returns the replayed records, or None if anything but journal growth happened.
+        """
+        snapshot, journal = signature
+        cached_journal = cached.signature[1]
+        if (cached.signature[0] != snapshot or journal is None
+                or (cached_journal is not None and cached_journal[2] != journal[2])
+                or journal[1] <= cached.journal_offset):
+            return None
+        ops, offset = self._read_journal(file_path, cached.journal_offset)
+        for op in ops:
+            cached.apply(op)
+        cached.signature = signature
+        cached.journal_records += len(ops)
+        cached.journal_offset = offset
+        return ops
+
+    def _collection(self, file_path: Path) -> Optional[_CachedCollection]:
+        with self.locked(file_path, exclusive=False):
+            generation = self._generation(file_path)
+            signature = self._signature(file_path)
+            if signature is None:
+                if self._cache.pop(file_path, None) is not None:
+                    self._changed(file_path)
+                return None
+            cached = self._cache.get(file_path)
+            if cached is not None and cached.signature == signature and cached.generation == generation:
+                self.cache_hits += 1
+                return cached
+            self.cache_misses += 1
+            # The files changed behind the cache (another process, or an outside
+            # edit), so the version has to move on just as for a write made here;
+            # only a first read of a collection this instance never saw is no change
+            changed = cached is not None or file_path in self._versions
+            ops = None
+            try:
+                if cached is not None:
+                    ops = self._catch_up(cached, file_path, signature)
+                if ops is None:
+                    cached = self._read(file_path, signature)
+            except (ValueError, FileNotFoundError):
+                if self._cache.pop(file_path, None) is not None:
+                    self._changed(file_path)
+                return None
+            cached.generation = generation
+            self._cache[file_path] = cached
+            for op in ((None,) if ops is None else ops) if changed else ():
+                self._changed(file_path, op)
+            return cached
+
+    def load_json(self, file_path: Path, default_data: list = None):
+        if default_data is None:
+            default_data = []
+        with self.locked(file_path, exclusive=False):
+            cached = self._collection(file_path)
+            if cached is None:
+                return default_data
+            return _unpacked(cached.data)
+    
+    def get(self, file_path: Path, item_id: str) -> Optional[dict]:
+        with self.locked(file_path, exclusive=False):
+            cached = self._collection(file_path)
+            return cached.record(item_id) if cached is not None else None
+
+    def find(self, file_path: Path, **filters) -> list:
+        """Records matching all non-None ``filters``, in collection order for unindexed ones."""
+        with self.locked(file_path, exclusive=False):
+            cached = self._collection(file_path)
+            if cached is None:
+                return []
+            return cached.find({field: value for field, value in filters.items() if value is not None})
+
+    def page(self, file_path: Path, field: str, start=None, end=None, after: tuple = None,
+             limit: Optional[int] = None, descending: bool = True) -> list:
+        with self.locked(file_path, exclusive=False):
+            cached = self._collection(file_path)
+            if cached is None:
+                return []
+            if field in cached.sorted_indexes:
+                return cached.range(field, start, end, after, limit, descending)
+        return super().page(file_path, field, start, end, after, limit, descending)
+
+    def save_json(self, file_path: Path, data: list):
+        """Rewrite the whole collection, folding away any journal."""
+        return self._save(file_path, _to_storable(data))
+
+    def _save(self, file_path: Path, data: list, ops: list = (None,)) -> bool:
+        with self.locked(file_path):
+            tmp_path = file_path.with_name(f"{file_path.name}.tmp")
+            before = self._signature(file_path)
+            try:
+                _write_synced(tmp_path, self._encode(file_path, data))
+                os.replace(tmp_path, file_path)
+                self.journal_path(file_path).unlink(missing_ok=True)
+            except Exception as e:
+                tmp_path.unlink(missing_ok=True)
+                self._cache.pop(file_path, None)
+                logger.error(f"Error saving to {file_path}: {e}")
+                return False
+            cached = self._cache[file_path] = self._new_collection(
+                file_path, data, self._signature(file_path),
+                generation=self._generation(file_path, bump=True))
+            self._log_changes(file_path, ops, before, cached.signature)
+            for op in ops:
+                self._changed(file_path, op)
+            return True
+
+    def insert(self, file_path: Path, record: dict) -> bool:
+        record = _to_storable(record)
+        return self._write(file_path, {"op": "insert", "id": record['id'], "doc": record})
+
+    def replace(self, file_path: Path, item_id: str, record: dict) -> bool:
+        """Replace the record with ``item_id``; False if there is none."""
+        return self._write(file_path, {"op": "replace", "id": item_id, "doc": _to_storable(record)})
+
+    def delete(self, file_path: Path, item_id: str) -> bool:
+        """Delete the record with ``item_id``; False if there is none."""
+        return self._write(file_path, {"op": "delete", "id": item_id})
+
+    def update(self, file_path: Path, item_id: str, fn):
+        """Atomically replace the record with ``item_id`` by ``fn(record)``.
+
+        Returns the stored new record, or None if there is no such record.
+        Exceptions raised by ``fn`` abort the update and propagate.
+        """
+        with self.locked(file_path):
+            record = self.get(file_path, item_id)
+            if record is None:
+                return None
+            record = _to_storable(fn(record))
+            if not self._write(file_path, {"op": "replace", "id": item_id, "doc": record}):
+                raise IOError(f"Could not write {file_path}")
+            return record
+
+    def update_many(self, file_path: Path, updates: Dict[str, Any]) -> Dict[str, Optional[dict]]:
+        """Apply ``update`` for every ``item_id: fn`` of ``updates`` in one write.
+
+        All of them run under one hold of the lock and are stored together,
+        as one rewrite of the file or one synced journal append: either every
+        new record is written or, if ``fn`` raises or the write fails, none
+        is. Returns the new records by id, None for missing ids.
+        """
+        with self.locked(file_path):
+            records, ops = {}, []
+            for item_id, fn in updates.items():
+                record = self.get(file_path, item_id)
+                if record is not None:
+                    record = _to_storable(fn(record))
+                    ops.append({"op": "replace", "id": item_id, "doc": record})
+                records[item_id] = record
+            if ops and not self._write_many(file_path, ops):
+                raise IOError(f"Could not write {file_path}")
+            return records
+
+    def _write(self, file_path: Path, op: dict) -> bool:
+        return self._write_many(file_path, [op])
+
+    def _write_many(self, file_path: Path, ops: list) -> bool:
+        with self.locked(file_path):
+            cached = self._collection(file_path)
+            # Whether the ids touched by earlier ops of the batch exist after them
+            exists = {}
+            for op in ops:
+                if op['id'] not in exists:
+                    exists[op['id']] = cached is not None and op['id'] in cached.positions
+                if op['op'] != 'insert' and not exists[op['id']]:
+                    return False
+                exists[op['id']] = op['op'] != 'delete'
+
+            if not self._is_journaled(file_path):
+                data = _unpacked(cached.data) if cached is not None else []
+                positions = dict(cached.positions) if cached is not None else {}
+                for op in ops:
+                    if op['op'] == 'insert':
+                        positions[op['id']] = len(data)
+                        data.append(op['doc'])
+                    elif op['op'] == 'replace':
+                        data[positions[op['id']]] = op['doc']
+                    else:
+                        data[positions.pop(op['id'])] = None
+                return self._save(file_path, [record for record in data if record is not None], ops)
+
+            lines = b''.join(_json_dumps(op) + b'\n' for op in ops)
+            before = cached.signature if cached is not None else None
+            try:
+                with open(self.journal_path(file_path), 'ab') as f:
+                    if cached is not None and f.tell() > cached.journal_offset:
+                        # Cut off the torn tail of a crashed append
+                        f.truncate(cached.journal_offset)
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    journal_offset = f.tell()
+            except Exception as e:
+                self._cache.pop(file_path, None)
+                logger.error(f"Error appending to journal of {file_path}: {e}")
+                return False
+            if cached is None:
+                cached = self._cache[file_path] = self._new_collection(file_path, [], None)
+            for op in ops:
+                cached.apply(op)
+            cached.signature = self._signature(file_path)
+            cached.journal_records += len(ops)
+            cached.journal_offset = journal_offset
+            cached.generation = self._generation(file_path, bump=True)
+            self._log_changes(file_path, ops, before, cached.signature)
+            for op in ops:
+                self._changed(file_path, op)
+            return True
+
+    def journal_stats(self, file_path: Path) -> Dict[str, Any]:
+        """Size of the journal of ``file_path`` and time since it was last written."""
+        cached = self._collection(file_path)
+        journal = self._stat(self.journal_path(file_path))
+        return {
+            "records": cached.journal_records if cached is not None else 0,
+            "bytes": journal[1] if journal is not None else 0,
+            "idle_seconds": time.time() - journal[0] / 1e9 if journal is not None else None,
+        }
+
+    def compact(self, file_path: Path) -> bool:
+        """Fold the journal of ``file_path`` into a fresh snapshot of the JSON file.
+
+        The lock is only held to capture the state and to swap the files in;
+        the snapshot is written in between while writers keep appending to the
+        journal. Records appended meanwhile are carried over into the new
+        journal. Both files are replaced by atomic renames, and because replay
+        is idempotent a crash between the two renames loses nothing.
+        """
+        journal_path = self.journal_path(file_path)
+        with self.locked(file_path, exclusive=False):
+            cached = self._collection(file_path)
+            if cached is None or cached.signature[1] is None:
+                return False
+            # Records are replaced, never changed in place, so a copy of the list is a snapshot
+            data = list(cached.data)
+            snapshot = cached.signature[0]
+            journal_inode = cached.signature[1][2]
+            offset = cached.journal_offset
+
+        # Other processes may be compacting too, so the temp names are per process
+        snapshot_tmp = file_path.with_name(f"{file_path.name}.{os.getpid()}.compact.tmp")
+        journal_tmp = journal_path.with_name(f"{journal_path.name}.{os.getpid()}.compact.tmp")
+        try:
+            _write_synced(snapshot_tmp, self._encode(file_path, _unpacked(data)))
+
+            with self.locked(file_path):
+                cached = self._collection(file_path)
+                if (cached is None or cached.signature[0] != snapshot or cached.signature[1] is None
+                        or cached.signature[1][2] != journal_inode or cached.journal_offset < offset):
+                    # Somebody rewrote the collection meanwhile; try again later
+                    snapshot_tmp.unlink(missing_ok=True)
+                    return False
+                with open(journal_path, 'rb') as f:
+                    f.seek(offset)
+                    tail = f.read(cached.journal_offset - offset)
+                if tail:
+                    with open(journal_tmp, 'wb') as f:
+                        f.write(tail)
+                        f.flush()
+                        os.fsync(f.fileno())
+                os.replace(snapshot_tmp, file_path)
+                if tail:
+                    os.replace(journal_tmp, journal_path)
+                else:
+                    journal_path.unlink()
+                before, cached.signature = cached.signature, self._signature(file_path)
+                # Nothing changed, but the log has to follow the files
+                self._log_changes(file_path, [], before, cached.signature)
+                cached.journal_records = tail.count(b'\n')
+                cached.journal_offset = len(tail)
+                cached.generation = self._generation(file_path, bump=True)
+        except Exception as e:
+            snapshot_tmp.unlink(missing_ok=True)
+            journal_tmp.unlink(missing_ok=True)
+            logger.error(f"Error compacting {file_path}: {e}")
+            return False
+        return True
+
+    def cache_stats(self) -> Dict[str, Any]:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hit_ratio": self.cache_hits / lookups if lookups else 0.0,
+            "cached_files": sorted(path.name for path in self._cache),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "engine": "json",
+            "cache": self.cache_stats(),
+            "journals": {path.name: self.journal_stats(path) for path in sorted(self._journaled)},
+        }
+
+
+class PartitionedJSONFileDatabase(JSONFileDatabase):
+    """JSONFileDatabase keeping some collections in one file per month.
+
+    A collection in ``partitioned_files`` (path -> timestamp field) lives in
+    a directory named after it, with one partition per month of that field,
+    e.g. ``sessions/2024-05.json``. To the machinery above each partition is
+    a collection of its own, with its own cache, journal and indexes, set up
+    like the partitioned collection. Once a month is over its partition is
+    closed: rewritten gzip-compressed as ``2024-05.json.gz`` with its journal
+    folded in, and dropped from memory.
+
+    Partitions are read only when needed. ``page`` over the field skips
+    months outside its range and stops once it has ``limit`` records, and
+    ``get`` looks in the newest months first, so recent history and the
+    writes of new sessions only touch the current month; ``load_json`` and
+    ``find`` read them all. Closed partitions stay out of the cache unless
+    paged through or written: full scans and lookups read them uncached, and
+    the ids of each are kept (while its files are unchanged) so ``get`` of an
+    unknown id does not decompress them again. A record is stored in the month of its field and
+    moves when that changes. Writes to a partition are reported to versions
+    and listeners as writes to the collection. Updates touching several
+    months are atomic per month only.
+
+    A collection found as a single file is split into partitions on first
+    use. Not available in multi-process mode.
+    """
+
+    UNDATED = '0000-00'
+
+    def __init__(self, partitioned_files: Dict[Path, str], **options):
+        if options.get('multiprocess'):
+            raise ValueError("Partitioned collections are not supported in multi-process mode")
+        super().__init__(**options)
+        self._partitioned = dict(partitioned_files)
+        self._owners = {self.partition_dir(file_path): file_path for file_path in self._partitioned}
+        # Closed partition -> (signature, ids) as last read uncached
+        self._closed_ids: Dict[Path, tuple] = {}
+
+    @staticmethod
+    def partition_dir(file_path: Path) -> Path:
+        return file_path.with_suffix('')
+
+    def _owner(self, file_path: Path) -> Optional[Path]:
+        return self._owners.get(file_path.parent)
+
+    def _is_journaled(self, file_path: Path) -> bool:
+        return super()._is_journaled(self._owner(file_path) or file_path)
+
+    def _new_collection(self, file_path: Path, data: list, signature, **state) -> _CachedCollection:
+        owner = self._owner(file_path) or file_path
+        return _CachedCollection(data, signature, self._indexes.get(owner, ()),
+                                 sorted_fields=self._sorted_indexes.get(owner, ()),
+                                 packed=owner in self._packed, **state)
+
+    def _changed(self, file_path: Path, op: Optional[dict] = None):
+        super()._changed(self._owner(file_path) or file_path, op)
+
+    def _change_log(self, file_path: Path) -> Optional[_ChangeLog]:
+        return super()._change_log(self._owner(file_path) or file_path)
+
+    def _logged_files(self, file_path: Path) -> Dict[str, Any]:
+        if file_path not in self._partitioned:
+            return super()._logged_files(file_path)
+        return {path.name: self._signature(path) for path in self._partitions(file_path).values()}
+
+    def _month(self, file_path: Path, record: dict) -> str:
+        value = record.get(self._partitioned[file_path])
+        value = value if isinstance(value, str) else str(value or '')
+        if len(value) >= 7 and value[:4].isdigit() and value[4] == '-' and value[5:7].isdigit():
+            return value[:7]
+        return self.UNDATED
+
+    @staticmethod
+    def current_month() -> str:
+        return datetime.utcnow().strftime('%Y-%m')
+
+    @classmethod
+    def _month_bounds(cls, month: str) -> tuple:
+        """The field values a partition holds, ``low <= value < high``."""
+        if month == cls.UNDATED:
+            return '', '0000-01'
+        year, number = int(month[:4]), int(month[5:7])
+        return month, f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+
+    def _partitions(self, file_path: Path) -> Dict[str, Path]:
+        """Partition files by month, oldest first, after splitting a single file found next to them."""
+        if file_path.exists() or self.journal_path(file_path).exists():
+            self._split(file_path)
+        return self._list_partitions(file_path)
+
+    def _list_partitions(self, file_path: Path) -> Dict[str, Path]:
+        """Partition files by month, oldest first; a compressed one wins over a plain leftover."""
+        partitions: Dict[str, Path] = {}
+        directory = self.partition_dir(file_path)
+        try:
+            names = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            return partitions
+        for name in names:
+            month = name.split('.', 1)[0]
+            if name.endswith('.json.gz'):
+                partitions[month] = directory / name
+            elif name.endswith('.json') or name.endswith('.journal.ndjson'):
+                # A month with only a journal so far is a plain partition too
+                partitions.setdefault(month, directory / f"{month}.json")
+        return dict(sorted(partitions.items()))
+
+    def poll(self, file_path: Path):
+        if file_path not in self._partitioned:
+            return super().poll(file_path)
+        # Only partitions in memory can be stale; the others are read fresh
+        for path in [path for path in self._cache if self._owner(path) == file_path]:
+            self._collection(path)
+
+    def _split(self, file_path: Path):
+        """Move a collection kept as a single file into monthly partitions.
+
+        Its records are merged into partitions already there, replacing the
+        records with the same id, wherever they are stored.
+        """
+        with self.locked(file_path):
+            data = super().load_json(file_path, [])
+            # Fold the journal in first, so the single file alone is the whole collection
+            if self.journal_path(file_path).exists() and not super().save_json(file_path, data):
+                raise IOError(f"Could not write {file_path}")
+            months: Dict[str, list] = {}
+            for record in data:
+                months.setdefault(self._month(file_path, record), []).append(record)
+            ids = {record['id'] for record in data}
+            directory = self.partition_dir(file_path)
+            directory.mkdir(parents=True, exist_ok=True)
+            partitions = self._list_partitions(file_path)
+            for month in sorted(set(partitions) | set(months)):
+                path = partitions.get(month, directory / f"{month}.json")
+                stored = super().load_json(path, []) if month in partitions else []
+                incoming = {record['id']: record for record in months.get(month, [])}
+                merged = [incoming.pop(record['id'], record) for record in stored
+                          if record['id'] in incoming or record['id'] not in ids]
+                merged += incoming.values()
+                if month in partitions and merged == stored:
+                    continue
+                if not self._save(path, merged):
+                    raise IOError(f"Could not write partition {month} of {file_path}")
+            before = self._signature(file_path)
+            file_path.unlink(missing_ok=True)
+            self._cache.pop(file_path, None)
+            self._log_changes(file_path, [], before, None)
+            logger.info(f"Split {len(data)} records of {file_path.name} into {len(months)} monthly partitions")
+
+    def _scan(self, path: Path) -> Optional[_CachedCollection]:
+        """A partition to read from; a closed one not in the cache is read without caching it."""
+        if path.suffix != '.gz' or path in self._cache:
+            return self._collection(path)
+        with self.locked(path, exclusive=False):
+            signature = self._signature(path)
+            known = self._closed_ids.get(path)
+            if signature is None:
+                self._closed_ids.pop(path, None)
+                return None
+            try:
+                cached = self._read(path, signature)
+            except (ValueError, FileNotFoundError):
+                return None
+            self._closed_ids[path] = (signature, frozenset(cached.positions))
+            if known is not None and known[0] != signature:
+                self._changed(path)
+            return cached
+
+    def _ids(self, path: Path):
+        """Ids in a partition; for a closed one not in the cache, read only if its files changed."""
+        if path.suffix != '.gz' or path in self._cache:
+            cached = self._collection(path)
+        else:
+            known = self._closed_ids.get(path)
+            if known is not None and known[0] == self._signature(path):
+                return known[1]
+            cached = self._scan(path)
+        return frozenset() if cached is None else cached.positions.keys()
+
+    def _locate(self, file_path: Path, item_id: str) -> Optional[Path]:
+        """The partition holding ``item_id``, looking in the newest months first."""
+        for path in reversed(list(self._partitions(file_path).values())):
+            if item_id in self._ids(path):
+                return path
+        return None
+
+    def _target(self, file_path: Path, record: dict) -> Path:
+        month = self._month(file_path, record)
+        path = self._partitions(file_path).get(month)
+        if path is None:
+            path = self.partition_dir(file_path) / f"{month}.json"
+            path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def close_partitions(self, file_path: Path) -> int:
+        """Compress the partitions of past months that are plain or have a journal.
+
+        Their contents do not change, so versions stay as they are. Returns
+        how many partitions were closed.
+        """
+        closed = 0
+        current = self.current_month()
+        with self.locked(file_path):
+            for month, path in self._partitions(file_path).items():
+                plain = path.with_name(f"{month}.json")
+                compressed = path.with_name(f"{month}.json.gz")
+                journal = self.journal_path(path)
+                if month >= current or (path == compressed and not plain.exists() and not journal.exists()):
+                    continue
+                data = super().load_json(path, [])
+                before = self._signature(path)
+                tmp_path = compressed.with_name(f"{compressed.name}.tmp")
+                try:
+                    _write_synced(tmp_path, self._encode(compressed, data))
+                    os.replace(tmp_path, compressed)
+                except Exception as e:
+                    tmp_path.unlink(missing_ok=True)
+                    logger.error(f"Error closing partition {month} of {file_path}: {e}")
+                    continue
+                # The plain file goes before the journal: records left in the
+                # journal are also in the compressed file, and replay is idempotent
+                plain.unlink(missing_ok=True)
+                journal.unlink(missing_ok=True)
+                self._cache.pop(plain, None)
+                self._cache.pop(compressed, None)
+                signature = self._signature(compressed)
+                self._closed_ids[compressed] = (signature, frozenset(record['id'] for record in data))
+                if path != compressed:
+                    self._log_changes(path, [], before, None)
+                    before = None
+                self._log_changes(compressed, [], before, signature)
+                closed += 1
+        if closed:
+            logger.info(f"Closed {closed} monthly partitions of {file_path.name}")
+        return closed
+
+    def load_json(self, file_path: Path, default_data: list = None):
+        if file_path not in self._partitioned:
+            return super().load_json(file_path, default_data)
+        with self.locked(file_path, exclusive=False):
+            partitions = self._partitions(file_path)
+            if not partitions:
+                return [] if default_data is None else default_data
+            return [record for path in partitions.values()
+                    for cached in [self._scan(path)] if cached is not None
+                    for record in _unpacked(cached.data)]
+
+    def get(self, file_path: Path, item_id: str) -> Optional[dict]:
+        if file_path not in self._partitioned:
+            return super().get(file_path, item_id)
+        with self.locked(file_path, exclusive=False):
+            path = self._locate(file_path, item_id)
+            cached = self._scan(path) if path is not None else None
+            return cached.record(item_id) if cached is not None else None
+
+    def find(self, file_path: Path, **filters) -> list:
+        if file_path not in self._partitioned:
+            return super().find(file_path, **filters)
+        filters = {field: value for field, value in filters.items() if value is not None}
+        with self.locked(file_path, exclusive=False):
+            return [record for path in self._partitions(file_path).values()
+                    for cached in [self._scan(path)] if cached is not None
+                    for record in cached.find(filters)]
+
+    def page(self, file_path: Path, field: str, start=None, end=None, after: tuple = None,
+             limit: Optional[int] = None, descending: bool = True) -> list:
+        if file_path not in self._partitioned:
+            return super().page(file_path, field, start, end, after, limit, descending)
+        if field != self._partitioned[file_path]:
+            return JSONDatabase.page(self, file_path, field, start, end, after, limit, descending)
+        result = []
+        with self.locked(file_path, exclusive=False):
+            partitions = list(self._partitions(file_path).items())
+            for month, path in reversed(partitions) if descending else partitions:
+                low, high = self._month_bounds(month)
+                if ((start is not None and start >= high) or (end is not None and end <= low)
+                        or (after is not None and (after[0] < low if descending else after[0] >= high))):
+                    continue
+                result += super().page(path, field, start, end, after,
+                                       None if limit is None else limit - len(result), descending)
+                if limit is not None and len(result) >= limit:
+                    break
+        return result
+
+    def save_json(self, file_path: Path, data: list):
+        if file_path not in self._partitioned:
+            return super().save_json(file_path, data)
+        data = _to_storable(data)
+        months: Dict[str, list] = {}
+        for record in data:
+            months.setdefault(self._month(file_path, record), []).append(record)
+        with self.locked(file_path):
+            partitions = self._partitions(file_path)
+            saved = True
+            for month, records in months.items():
+                path = partitions.get(month) or self.partition_dir(file_path) / f"{month}.json"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                saved = self._save(path, records) and saved
+            for month, path in partitions.items():
+                if month not in months:
+                    before = self._signature(path)
+                    path.unlink(missing_ok=True)
+                    self.journal_path(path).unlink(missing_ok=True)
+                    self._cache.pop(path, None)
+                    self._log_changes(path, [None], before, None)
+                    self._changed(path)
+            return saved
+
+    def insert(self, file_path: Path, record: dict) -> bool:
+        if file_path not in self._partitioned:
+            return super().insert(file_path, record)
+        record = _to_storable(record)
+        with self.locked(file_path):
+            path = self._target(file_path, record)
+            opened = not path.exists() and not self.journal_path(path).exists()
+            inserted = super().insert(path, record)
+        if inserted and opened:
+            # The first record of a new month closes the months before it
+            self.close_partitions(file_path)
+        return inserted
+
+    def replace(self, file_path: Path, item_id: str, record: dict) -> bool:
+        if file_path not in self._partitioned:
+            return super().replace(file_path, item_id, record)
+        record = _to_storable(record)
+        with self.locked(file_path):
+            path = self._locate(file_path, item_id)
+            if path is None:
+                return False
+            target = self._target(file_path, dict(record, id=item_id))
+            if target == path:
+                return super().replace(path, item_id, record)
+            return super().delete(path, item_id) and super().insert(target, dict(record, id=item_id))
+
+    def delete(self, file_path: Path, item_id: str) -> bool:
+        if file_path not in self._partitioned:
+            return super().delete(file_path, item_id)
+        with self.locked(file_path):
+            path = self._locate(file_path, item_id)
+            return super().delete(path, item_id) if path is not None else False
+
+    def update(self, file_path: Path, item_id: str, fn):
+        if file_path not in self._partitioned:
+            return super().update(file_path, item_id, fn)
+        with self.locked(file_path):
+            record = self.get(file_path, item_id)
+            if record is None:
+                return None
+            record = _to_storable(fn(record))
+            if not self.replace(file_path, item_id, record):
+                raise IOError(f"Could not write {file_path}")
+            return record
+
+    def update_many(self, file_path: Path, updates: Dict[str, Any]) -> Dict[str, Optional[dict]]:
+        if file_path not in self._partitioned:
+            return super().update_many(file_path, updates)
+        with self.locked(file_path):
+            records, ops = {}, {}
+            for item_id, fn in updates.items():
+                path = self._locate(file_path, item_id)
+                record = None
+                if path is not None:
+                    record = dict(_to_storable(fn(super().get(path, item_id))), id=item_id)
+                    target = self._target(file_path, record)
+                    if target == path:
+                        ops.setdefault(path, []).append({"op": "replace", "id": item_id, "doc": record})
+                    else:
+                        ops.setdefault(path, []).append({"op": "delete", "id": item_id})
+                        ops.setdefault(target, []).append({"op": "insert", "id": item_id, "doc": record})
+                records[item_id] = record
+            for path, path_ops in ops.items():
+                if not self._write_many(path, path_ops):
+                    raise IOError(f"Could not write {path}")
+            return records
+
+    def journal_stats(self, file_path: Path) -> Dict[str, Any]:
+        """For a partitioned collection, the journal of the current month."""
+        if file_path not in self._partitioned:
+            return super().journal_stats(file_path)
+        path = self._partitions(file_path).get(self.current_month())
+        if path is None:
+            return {"records": 0, "bytes": 0, "idle_seconds": None}
+        return super().journal_stats(path)
+
+    def compact(self, file_path: Path) -> bool:
+        """For a partitioned collection, close past months and compact the current one."""
+        if file_path not in self._partitioned:
+            return super().compact(file_path)
+        self.close_partitions(file_path)
+        path = self._partitions(file_path).get(self.current_month())
+        return super().compact(path) if path is not None else False
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["partitions"] = {file_path.name: sorted(path.name for path in self._partitions(file_path).values())
+                               for file_path in self._partitioned}
+        return stats
+
+
+class SQLiteDatabase(JSONDatabase):
+    """Storage engine on one SQLite database (stdlib ``sqlite3``, WAL mode).
+
+    The stem of a collection's JSON path names its table. Exercises are a
+    flat table, splits keep their nested days in a JSON column, and sessions
+    are normalised into ``sessions``, ``session_exercises`` and ``sets``.
+    Records come back in insertion order, as from the JSON engine.
+
+    Each thread has its own connection, so readers run concurrently with
+    each other and with the single writer WAL allows. ``locked`` opens a
+    transaction (``BEGIN IMMEDIATE`` for writers) that the calls made inside
+    it join, which makes ``update`` atomic across threads and processes.
+
+    Every write transaction bumps the collection's ``collection_versions``
+    row. ``version`` is made from the newest row this instance has seen, in
+    its own commits or through ``poll``, so all processes agree on it.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS exercises (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            muscle_group TEXT,
+            equipment TEXT,
+            instructions TEXT
+        );
+        CREATE INDEX IF NOT EXISTS exercises_muscle_group ON exercises (muscle_group);
+
+        CREATE TABLE IF NOT EXISTS splits (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            days_per_week INTEGER,
+            days TEXT NOT NULL,
+            created_at TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            split_id TEXT,
+            day_number INTEGER,
+            completed_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS sessions_split_day ON sessions (split_id, day_number);
+        CREATE INDEX IF NOT EXISTS sessions_completed_at ON sessions (completed_at, id);
+
+        CREATE TABLE IF NOT EXISTS session_exercises (
+            session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            exercise_id TEXT NOT NULL,
+            exercise_name TEXT,
+            completed_count INTEGER,
+            target_completions INTEGER,
+            is_archived INTEGER,
+            PRIMARY KEY (session_id, position)
+        );
+        CREATE INDEX IF NOT EXISTS session_exercises_exercise ON session_exercises (exercise_id);
+
+        CREATE TABLE IF NOT EXISTS sets (
+            session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+            exercise_position INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            set_number INTEGER,
+            weight REAL,
+            reps INTEGER,
+            PRIMARY KEY (session_id, exercise_position, position)
+        );
+
+        CREATE TABLE IF NOT EXISTS collection_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            log_id TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS changes (
+            name TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            op TEXT,
+            record_id TEXT,
+            PRIMARY KEY (name, seq)
+        );
+    """
+
+    COLUMNS = {
+        'exercises': ('id', 'name', 'muscle_group', 'equipment', 'instructions'),
+        'splits': ('id', 'name', 'days_per_week', 'days', 'created_at'),
+        'sessions': ('id', 'split_id', 'day_number', 'completed_at'),
+    }
+
+    def __init__(self, path: Path, change_log_entries: int = 10000):
+        super().__init__()
+        self.path = path
+        self.change_log_entries = change_log_entries
+        self._local = threading.local()
+        conn = self._connection()
+        conn.executescript(self.SCHEMA)
+        self._seen = dict(conn.execute("SELECT name, version FROM collection_versions"))
+        self._seen_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+            self._local.depth = 0
+            self._local.changed = []
+        return conn
+
+    @staticmethod
+    def _table(file_path: Path) -> str:
+        if file_path.stem not in SQLiteDatabase.COLUMNS:
+            raise ValueError(f"No SQLite table for collection {file_path.name}")
+        return file_path.stem
+
+    @contextmanager
+    def locked(self, file_path: Path = None, exclusive: bool = True):
+        conn = self._connection()
+        local = self._local
+        if local.depth:
+            if exclusive and not local.exclusive:
+                raise RuntimeError("Cannot upgrade a read transaction to a write transaction")
+            local.depth += 1
+            try:
+                yield conn
+            finally:
+                local.depth -= 1
+            return
+        conn.execute('BEGIN IMMEDIATE' if exclusive else 'BEGIN')
+        local.depth = 1
+        local.exclusive = exclusive
+        try:
+            yield conn
+        except BaseException:
+            local.depth = 0
+            local.changed.clear()
+            conn.execute('ROLLBACK')
+            raise
+        local.depth = 0
+        conn.execute('COMMIT')
+        # Versions change once the writes are visible to other connections
+        for file_path, op, seq in local.changed:
+            if self._see(file_path, seq) is not True:
+                # Another connection wrote in between, which only a reload picks up
+                op = None
+            self._changed(file_path, op)
+        local.changed.clear()
+
+    def version(self, file_path: Path) -> str:
+        return f"s{self._seen.get(self._table(file_path), 0)}"
+
+    def _see(self, file_path: Path, seq: int) -> Optional[bool]:
+        """Take note of version ``seq``: True if it follows the newest one seen,
+        None if it skips some, False if it is not newer."""
+        table = self._table(file_path)
+        with self._seen_lock:
+            seen = self._seen.get(table, 0)
+            if seq <= seen:
+                return False
+            self._seen[table] = seq
+            return True if seq == seen + 1 else None
+
+    def poll(self, file_path: Path):
+        row = self._connection().execute(
+            "SELECT version FROM collection_versions WHERE name = ?", (self._table(file_path),)).fetchone()
+        if row is not None and self._see(file_path, row[0]) is not False:
+            self._changed(file_path)
+
+    def _record_change(self, conn: sqlite3.Connection, file_path: Path, op: Optional[dict] = None):
+        """Bump the version row and log the write in its own transaction, and queue the listeners.
+
+        The version doubles as the sequence number of the change log, which
+        keeps the newest ``change_log_entries`` rows.
+        """
+        table = self._table(file_path)
+        seq, = conn.execute("INSERT INTO collection_versions VALUES (?, 1, ?) "
+                            "ON CONFLICT (name) DO UPDATE SET version = version + 1 RETURNING version",
+                            (table, uuid.uuid4().hex[:8])).fetchone()
+        conn.execute("INSERT INTO changes VALUES (?, ?, ?, ?)",
+                     (table, seq, op and op['op'], op and op['id']))
+        conn.execute("DELETE FROM changes WHERE name = ? AND seq <= ?", (table, seq - self.change_log_entries))
+        self._local.changed.append((file_path, op, seq))
+
+    def changes(self, file_path: Path, since: Optional[int] = None) -> tuple:
+        table = self._table(file_path)
+        with self.locked(file_path, exclusive=False) as conn:
+            row = conn.execute("SELECT log_id, version FROM collection_versions WHERE name = ?",
+                               (table,)).fetchone()
+            log_id, seq = row if row else (None, 0)
+            if since is None or log_id is None or since > seq:
+                return log_id, seq, None
+            rows = conn.execute("SELECT seq, op, record_id FROM changes WHERE name = ? AND seq > ? ORDER BY seq",
+                                (table, since)).fetchall()
+        if len(rows) < seq - since:
+            return log_id, seq, None
+        return log_id, seq, [(number, {"op": op, "id": record_id} if op else None) for number, op, record_id in rows]
+
+    def _select(self, conn: sqlite3.Connection, table: str, where: str = '', params=(),
+                order: str = 'rowid', limit: Optional[int] = None) -> list:
+        columns = self.COLUMNS[table]
+        condition = f" WHERE {where}" if where else ''
+        condition += f" ORDER BY {order}" + (f" LIMIT {int(limit)}" if limit is not None else '')
+        rows = conn.execute(f"SELECT {', '.join(columns)} FROM {table}{condition}", params).fetchall()
+        records = [dict(zip(columns, row)) for row in rows]
+        if table == 'splits':
+            for record in records:
+                record['days'] = _json_loads(record['days'])
+        if table != 'sessions' or not records:
+            return records
+
+        # Reassemble the nested exercises and sets of the selected sessions
+        sessions = {}
+        for record in records:
+            record['exercises'] = []
+            # Same key order as WorkoutSession.dict()
+            record['completed_at'] = record.pop('completed_at')
+            sessions[record['id']] = record
+        selected = f"SELECT id FROM sessions{condition}"
+        for session_id, exercise_id, exercise_name, completed_count, target_completions, is_archived in conn.execute(
+                f"SELECT session_id, exercise_id, exercise_name, completed_count, target_completions, is_archived "
+                f"FROM session_exercises WHERE session_id IN ({selected}) ORDER BY session_id, position", params):
+            sessions[session_id]['exercises'].append({
+                "exercise_id": exercise_id,
+                "exercise_name": exercise_name,
+                "sets": [],
+                "completed_count": completed_count,
+                "target_completions": target_completions,
+                "is_archived": bool(is_archived),
+            })
+        for session_id, exercise_position, set_number, weight, reps in conn.execute(
+                f"SELECT session_id, exercise_position, set_number, weight, reps FROM sets "
+                f"WHERE session_id IN ({selected}) ORDER BY session_id, exercise_position, position", params):
+            sessions[session_id]['exercises'][exercise_position]['sets'].append(
+                {"set_number": set_number, "weight": weight, "reps": reps})
+        return records
+
+    def _row(self, table: str, record: dict) -> tuple:
+        if table == 'splits':
+            record = dict(record, days=_json_dumps(record.get('days', [])).decode('utf-8'))
+        return tuple(record.get(column) for column in self.COLUMNS[table])
+
+    def _insert(self, conn: sqlite3.Connection, table: str, record: dict):
+        columns = self.COLUMNS[table]
+        conn.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                     self._row(table, record))
+        if table == 'sessions':
+            self._insert_session_children(conn, record)
+
+    @staticmethod
+    def _insert_session_children(conn: sqlite3.Connection, record: dict):
+        exercises = record.get('exercises', [])
+        conn.executemany(
+            "INSERT INTO session_exercises VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(record['id'], position, exercise['exercise_id'], exercise.get('exercise_name'),
+              exercise.get('completed_count', 0), exercise.get('target_completions', 3),
+              int(exercise.get('is_archived', False)))
+             for position, exercise in enumerate(exercises)])
+        conn.executemany(
+            "INSERT INTO sets VALUES (?, ?, ?, ?, ?, ?)",
+            [(record['id'], exercise_position, position, s['set_number'], s['weight'], s['reps'])
+             for exercise_position, exercise in enumerate(exercises)
+             for position, s in enumerate(exercise.get('sets', []))])
+
+    def load_json(self, file_path: Path, default_data: list = None):
+        with self.locked(file_path, exclusive=False) as conn:
+            records = self._select(conn, self._table(file_path))
+        if not records and default_data is not None:
+            return default_data
+        return records
+
+    def save_json(self, file_path: Path, data: list):
+        table = self._table(file_path)
+        try:
+            with self.locked(file_path) as conn:
+                conn.execute(f"DELETE FROM {table}")
+                for record in _to_storable(data):
+                    self._insert(conn, table, record)
+                self._record_change(conn, file_path)
+        except sqlite3.Error as e:
+            logger.error(f"Error saving to {self.path} ({table}): {e}")
+            if self._local.depth:
+                # Inside an outer transaction, which must roll back rather than commit the rest
+                raise
+            return False
+        return True
+
+    def get(self, file_path: Path, item_id: str) -> Optional[dict]:
+        with self.locked(file_path, exclusive=False) as conn:
+            records = self._select(conn, self._table(file_path), 'id = ?', (item_id,))
+        return records[0] if records else None
+
+    def find(self, file_path: Path, **filters) -> list:
+        table = self._table(file_path)
+        filters = {field: value for field, value in filters.items() if value is not None}
+        columns = [field for field in filters if field in self.COLUMNS[table]]
+        where = ' AND '.join(f"{field} = ?" for field in columns)
+        with self.locked(file_path, exclusive=False) as conn:
+            records = self._select(conn, table, where, tuple(filters[field] for field in columns))
+        if len(columns) < len(filters):
+            records = self.filter_by(records, **filters)
+        return records
+
+    def page(self, file_path: Path, field: str, start=None, end=None, after: tuple = None,
+             limit: Optional[int] = None, descending: bool = True) -> list:
+        table = self._table(file_path)
+        if field not in self.COLUMNS[table]:
+            return super().page(file_path, field, start, end, after, limit, descending)
+        conditions, params = [], []
+        if start is not None:
+            conditions.append(f"{field} >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append(f"{field} < ?")
+            params.append(end)
+        if after is not None:
+            conditions.append(f"({field}, id) {'<' if descending else '>'} (?, ?)")
+            params.extend(after)
+        direction = 'DESC' if descending else 'ASC'
+        with self.locked(file_path, exclusive=False) as conn:
+            return self._select(conn, table, ' AND '.join(conditions), tuple(params),
+                                order=f"{field} {direction}, id {direction}", limit=limit)
+
+    def insert(self, file_path: Path, record: dict) -> bool:
+        table = self._table(file_path)
+        try:
+            record = _to_storable(record)
+            with self.locked(file_path) as conn:
+                self._insert(conn, table, record)
+                self._record_change(conn, file_path, {"op": "insert", "id": record['id'], "doc": record})
+        except sqlite3.Error as e:
+            logger.error(f"Error inserting into {self.path} ({table}): {e}")
+            if self._local.depth:
+                raise
+            return False
+        return True
+
+    def replace(self, file_path: Path, item_id: str, record: dict) -> bool:
+        table = self._table(file_path)
+        record = dict(_to_storable(record), id=item_id)
+        columns = self.COLUMNS[table]
+        with self.locked(file_path) as conn:
+            # UPDATE rather than INSERT OR REPLACE keeps the rowid, and so the order
+            cursor = conn.execute(
+                f"UPDATE {table} SET {', '.join(f'{column} = ?' for column in columns[1:])} WHERE id = ?",
+                self._row(table, record)[1:] + (item_id,))
+            if cursor.rowcount == 0:
+                return False
+            if table == 'sessions':
+                conn.execute("DELETE FROM session_exercises WHERE session_id = ?", (item_id,))
+                conn.execute("DELETE FROM sets WHERE session_id = ?", (item_id,))
+                self._insert_session_children(conn, record)
+            self._record_change(conn, file_path, {"op": "replace", "id": item_id, "doc": record})
+        return True
+
+    def delete(self, file_path: Path, item_id: str) -> bool:
+        table = self._table(file_path)
+        with self.locked(file_path) as conn:
+            if conn.execute(f"DELETE FROM {table} WHERE id = ?", (item_id,)).rowcount == 0:
+                return False
+            self._record_change(conn, file_path, {"op": "delete", "id": item_id})
+        return True
+
+    def update(self, file_path: Path, item_id: str, fn):
+        with self.locked(file_path):
+            record = self.get(file_path, item_id)
+            if record is None:
+                return None
+            record = _to_storable(fn(record))
+            self.replace(file_path, item_id, record)
+            return record
+
+    def stats(self) -> Dict[str, Any]:
+        return {"engine": "sqlite", "path": str(self.path)}
+
+
+def migrate_json_to_sqlite(source: JSONFileDatabase, target: SQLiteDatabase, file_paths) -> Dict[str, int]:
+    """Copy JSON collections into SQLite, skipping tables that already hold rows.
+
+    Returns the number of records copied per collection; running it again is
+    a no-op, so the server can simply call it on every start.
+    """
+    copied = {}
+    for file_path in file_paths:
+        with target.locked(file_path):
+            if target.load_json(file_path):
+                continue
+            data = source.load_json(file_path, [])
+            if data:
+                if not target.save_json(file_path, data):
+                    raise IOError(f"Could not copy {file_path.name} into {target.path}")
+                copied[file_path.stem] = len(data)
+    return copied
+
+def create_database() -> JSONDatabase:
+    if STORAGE_ENGINE == 'sqlite':
+        return SQLiteDatabase(SQLITE_PATH, change_log_entries=CHANGE_FEED_MAX_ENTRIES)
+    if STORAGE_ENGINE != 'json':
+        raise ValueError(f"Unknown STORAGE_ENGINE {STORAGE_ENGINE!r} (expected 'json' or 'sqlite')")
+    if SESSIONS_PARTITIONING not in ('none', 'month'):
+        raise ValueError(f"Unknown SESSIONS_PARTITIONING {SESSIONS_PARTITIONING!r} (expected 'none' or 'month')")
+    options = {} if SESSIONS_PARTITIONING == 'none' else {"partitioned_files": {SESSIONS_FILE: 'completed_at'}}
+    return (PartitionedJSONFileDatabase if options else JSONFileDatabase)(
+        journaled_files=[SESSIONS_FILE] if SESSIONS_STORAGE == 'journal' else [],
+        multiprocess=STORAGE_MULTIPROCESS,
+        indexes={
+            EXERCISES_FILE: ['muscle_group'],
+            SESSIONS_FILE: ['split_id', 'day_number'],
+        },
+        sorted_indexes={
+            SESSIONS_FILE: ['completed_at'],
+        },
+        storage_format=STORAGE_FORMAT,
+        packed_files=[SESSIONS_FILE] if SESSIONS_CACHE_FORMAT == 'packed' else [],
+        change_log_files=[EXERCISES_FILE, SPLITS_FILE, SESSIONS_FILE],
+        change_log_entries=CHANGE_FEED_MAX_ENTRIES,
+        **options,
+    )
+
+db = create_database()
+
+
+class AsyncJSONDatabase:
+    """Asyncio front end to a JSONDatabase.
+
+    File access and JSON (de)serialisation run in a bounded thread pool, so a
+    large save of one collection does not stall the event loop for requests
+    that only need another one. The pool is created on first use and torn
+    down by ``shutdown``.
+
+    Concurrency guarantee: writes to one collection are serialised by a
+    per-collection asyncio lock (so waiting writers do not tie up pool
+    threads) on top of the database's own lock. ``update`` performs its
+    read-modify-write entirely under that lock, so N concurrent updates of a
+    record always produce N applied changes; callers must use it instead of
+    a ``load_json`` followed by ``replace``. Reads never wait for writers and
+    see the state either before or after any single write.
+
+    With a ``group_commit_window`` (seconds), ``update`` calls are queued
+    per collection and applied in arrival order by one ``update_many`` once
+    the window after the first of them has passed or ``group_commit_max_ops``
+    are queued: one write and fsync for the whole group. Each call still
+    returns its own result, or raises its own ``fn``'s exception, after that
+    write; nothing of the group is visible to readers before it.
+    """
+
+    def __init__(self, database: JSONDatabase, max_workers: int,
+                 group_commit_window: float = 0.0, group_commit_max_ops: int = 64):
+        self.database = database
+        self.max_workers = max_workers
+        self.group_commit_window = group_commit_window
+        self.group_commit_max_ops = group_commit_max_ops
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._locks: Dict[Path, asyncio.Lock] = {}
+        # Updates waiting for the next group commit: (item id, fn, future)
+        self._pending: Dict[Path, list] = {}
+        self._group_full: Dict[Path, asyncio.Event] = {}
+        self._group_commits: set = set()
+        self.group_commit_stats = {"commits": 0, "updates": 0}
+
+    def lock(self, file_path: Path) -> asyncio.Lock:
+        return self._locks.setdefault(file_path, asyncio.Lock())
+
+    async def run(self, fn, *args, **kwargs):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix='storage')
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def load_json(self, file_path: Path, default_data: list = None):
+        return await self.run(self.database.load_json, file_path, default_data)
+
+    async def get(self, file_path: Path, item_id: str) -> Optional[dict]:
+        return await self.run(self.database.get, file_path, item_id)
+
+    async def find(self, file_path: Path, **filters) -> list:
+        return await self.run(self.database.find, file_path, **filters)
+
+    async def page(self, file_path: Path, field: str, **query) -> list:
+        return await self.run(self.database.page, file_path, field, **query)
+
+    async def iterate(self, file_path: Path, field: str, batch_size: int = 500, **query):
+        """Async generator over ``page`` order, fetching ``batch_size`` records at a time.
+
+        Only one batch is held in memory; each batch is a separate read, so
+        records written meanwhile may or may not show up.
+        """
+        after = None
+        while True:
+            batch = await self.page(file_path, field, after=after, limit=batch_size, **query)
+            for record in batch:
+                yield record
+            if len(batch) < batch_size:
+                return
+            last = batch[-1]
+            after = ('' if last.get(field) is None else last.get(field), last['id'])
+
+    async def save_json(self, file_path: Path, data: list):
+        async with self.lock(file_path):
+            return await self.run(self.database.save_json, file_path, data)
+
+    async def insert(self, file_path: Path, record: dict) -> bool:
+        async with self.lock(file_path):
+            return await self.run(self.database.insert, file_path, record)
+
+    async def replace(self, file_path: Path, item_id: str, record: dict) -> bool:
+        async with self.lock(file_path):
+            return await self.run(self.database.replace, file_path, item_id, record)
+
+    async def delete(self, file_path: Path, item_id: str) -> bool:
+        async with self.lock(file_path):
+            return await self.run(self.database.delete, file_path, item_id)
+
+    async def update(self, file_path: Path, item_id: str, fn):
+        if self.group_commit_window > 0:
+            return await self._update_in_group(file_path, item_id, fn)
+        async with self.lock(file_path):
+            return await self.run(self.database.update, file_path, item_id, fn)
+
+    async def _update_in_group(self, file_path: Path, item_id: str, fn):
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.setdefault(file_path, [])
+        pending.append((item_id, fn, future))
+        if len(pending) == 1:
+            full = self._group_full[file_path] = asyncio.Event()
+            task = asyncio.create_task(self._group_commit(file_path, full))
+            self._group_commits.add(task)
+            task.add_done_callback(self._group_commits.discard)
+        elif len(pending) >= self.group_commit_max_ops:
+            self._group_full[file_path].set()
+        return await future
+
+    async def _group_commit(self, file_path: Path, full: asyncio.Event):
+        try:
+            await asyncio.wait_for(full.wait(), self.group_commit_window)
+        except asyncio.TimeoutError:
+            pass
+        group = self._pending.pop(file_path)
+        del self._group_full[file_path]
+
+        # Each record gets one fn applying its queued updates in order; the
+        # outcome of every update is kept apart, so one failing leaves the
+        # others and the record as the earlier ones made it.
+        outcomes: list = [None] * len(group)
+        steps: Dict[str, list] = {}
+        for position, (item_id, fn, _) in enumerate(group):
+            steps.setdefault(item_id, []).append((position, fn))
+
+        def apply_steps(record_steps: list):
+            def apply(record: dict) -> dict:
+                for position, fn in record_steps:
+                    try:
+                        record = outcomes[position] = _to_storable(fn(record))
+                    except Exception as e:
+                        outcomes[position] = e
+                return record
+            return apply
+
+        try:
+            async with self.lock(file_path):
+                records = await self.run(self.database.update_many, file_path, {
+                    item_id: apply_steps(record_steps) for item_id, record_steps in steps.items()})
+        except Exception as e:
+            for _, _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.group_commit_stats["commits"] += 1
+        self.group_commit_stats["updates"] += len(group)
+        for position, (item_id, _, future) in enumerate(group):
+            if future.done():
+                continue
+            if records[item_id] is None:
+                future.set_result(None)
+            elif isinstance(outcomes[position], Exception):
+                future.set_exception(outcomes[position])
+            else:
+                future.set_result(outcomes[position])
+
+    async def flush(self):
+        """Wait for the group commits under way, starting queued ones right away."""
+        for full in self._group_full.values():
+            full.set()
+        while self._group_commits:
+            await asyncio.gather(*self._group_commits, return_exceptions=True)
+
+    async def update_many(self, file_path: Path, updates: Dict[str, Any]) -> Dict[str, Optional[dict]]:
+        async with self.lock(file_path):
+            return await self.run(self.database.update_many, file_path, updates)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        # asyncio locks belong to the loop that is going away
+        self._locks.clear()
+
+async_db = AsyncJSONDatabase(db, max_workers=STORAGE_IO_THREADS,
+                             group_commit_window=GROUP_COMMIT_WINDOW_MS / 1000,
+                             group_commit_max_ops=GROUP_COMMIT_MAX_OPS)
+
 
-# Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+class JournalCompactor:
+    """Background task that compacts the journal of one collection.
+
+    Every ``check_interval`` seconds the journal is compacted if it holds at
+    least ``max_records`` records or ``max_bytes`` bytes, or if it is non-empty
+    and has been idle for ``idle_seconds``. The compaction itself runs in a
+    worker thread, so requests keep being served while it writes.
+    """
+
+    def __init__(self, database: JSONFileDatabase, file_path: Path, max_records: int,
+                 max_bytes: int, idle_seconds: float, check_interval: float):
+        self.database = database
+        self.file_path = file_path
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.check_interval = check_interval
+        self.compactions = 0
+        self.last_reason: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def trigger(self, stats: Dict[str, Any]) -> Optional[str]:
+        if stats["records"] == 0:
+            return None
+        if stats["records"] >= self.max_records:
+            return "records"
+        if stats["bytes"] >= self.max_bytes:
+            return "bytes"
+        idle = stats["idle_seconds"]
+        if idle is None or idle >= self.idle_seconds:
+            return "idle"
+        return None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                stats = await asyncio.to_thread(self.database.journal_stats, self.file_path)
+                reason = self.trigger(stats)
+                if reason and await asyncio.to_thread(self.database.compact, self.file_path):
+                    self.compactions += 1
+                    self.last_reason = reason
+                    logger.info(f"Compacted {stats['records']} journal records of "
+                                f"{self.file_path.name} (trigger: {reason})")
+            except Exception as e:
+                logger.error(f"Compactor for {self.file_path.name} failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "compactions": self.compactions,
+            "last_reason": self.last_reason,
+        }
+
+session_compactor = JournalCompactor(
+    db, SESSIONS_FILE,
+    max_records=COMPACT_MAX_RECORDS,
+    max_bytes=COMPACT_MAX_BYTES,
+    idle_seconds=COMPACT_IDLE_SECONDS,
+    check_interval=COMPACT_CHECK_INTERVAL,
+)
+
+
+class StoragePoller:
+    """Background task that has the storage ``poll`` some collections.
+
+    Every ``check_interval`` seconds, in a worker thread, so versions follow
+    writes made behind the server's back while ``version`` itself, called on
+    the event loop for every conditional GET, never touches the disk.
+    """
+
+    def __init__(self, database: JSONDatabase, file_paths, check_interval: float):
+        self.database = database
+        self.file_paths = list(file_paths)
+        self.check_interval = check_interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def check(self):
+        for file_path in self.file_paths:
+            await asyncio.to_thread(self.database.poll, file_path)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Storage poller failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+storage_poller = StoragePoller(db, [EXERCISES_FILE, SPLITS_FILE, SESSIONS_FILE], STORAGE_POLL_INTERVAL)
+
+
+class ResponseCache:
+    """Serialized GET responses, least recently used first, bounded by ``max_bytes``.
+
+    An entry is stored under its request key (path and query) together with
+    the ETag it was rendered at and only served while that is still the
+    current one, so it goes stale with every change ``version`` tracks: the
+    writes of this process, and those of other processes or outside edits
+    once ``poll`` or a read has noticed them (in JSON multi-process mode only
+    the workers' writes, which move the shared generation right away).
+    ``invalidate`` drops the entries of a collection right away; it
+    is registered as a write listener so memory goes to live entries.
+    Entries bigger than a quarter of the budget are not kept.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._keys_by_file: Dict[Path, set] = {}
+        # Writes report from storage threads
+        self._lock = threading.Lock()
+
+    def get(self, key: str, etag: str) -> Optional[Response]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return Response(entry[1], media_type="application/json", headers=entry[2])
+
+    def put(self, key: str, etag: str, file_paths, body: bytes, headers: Dict[str, str]):
+        if len(body) * 4 > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (etag, body, headers, file_paths)
+            self.size += len(body)
+            for file_path in file_paths:
+                self._keys_by_file.setdefault(file_path, set()).add(key)
+            while self.size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, file_path: Path, op: Optional[dict] = None):
+        with self._lock:
+            for key in self._keys_by_file.pop(file_path, ()):
+                self._discard(key)
+
+    def _discard(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+            for file_path in entry[3]:
+                keys = self._keys_by_file.get(file_path)
+                if keys is not None:
+                    keys.discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else None,
+            "evictions": self.evictions,
+        }
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES)
+db.add_listener(response_cache.invalidate)
+
+
+class ChangeFeed:
+    """Recent writes of some collections, for clients keeping a local mirror.
+
+    Reads the change log storage keeps of each collection in ``file_paths``
+    (see ``JSONDatabase.changes``), so a cursor outlives restarts and is
+    good in every worker sharing the storage. A cursor holds the log id and
+    sequence number each of its collections was read up to. Where the feed
+    cannot tell what changed (a collection the cursor does not cover, a log
+    that is new or no longer reaches back to it, a collection saved as a
+    whole) the collection is reported as reset and has to be refetched.
+    """
+
+    def __init__(self, database: JSONDatabase, file_paths):
+        self.database = database
+        self.file_paths = list(file_paths)
 
-# JSON Database Helper Functions
-class JSONDatabase:
     @staticmethod
-    def load_json(file_path: Path, default_data: list = None):
-        if default_data is None:
-            default_data = []
+    def _decode(cursor: str) -> Dict[str, list]:
         try:
-            if file_path.exists():
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            positions = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        except (ValueError, TypeError):
+            raise ValueError(f"Invalid cursor {cursor!r}")
+        if not isinstance(positions, dict) or not all(
+                isinstance(position, list) and len(position) == 2 and type(position[1]) is int
+                for position in positions.values()):
+            raise ValueError(f"Invalid cursor {cursor!r}")
+        return positions
+
+    def since(self, cursor: Optional[str], file_paths) -> tuple:
+        """Writes to ``file_paths`` after ``cursor``: (changes, reset file paths, next cursor).
+
+        Only the latest op of each record is returned, per collection in log
+        order, as (seq, file path, op); inserts and replacements carry the
+        record as it is now, and a record gone since counts as deleted.
+        Blocks on storage. Raises ValueError for a malformed cursor.
+        """
+        positions = self._decode(cursor) if cursor is not None else {}
+        changes, reset = [], set()
+        for file_path in file_paths:
+            known = file_path.stem in positions
+            log_id, since = positions.get(file_path.stem, (None, None))
+            current_log, seq, entries = self.database.changes(file_path, since if known else None)
+            positions[file_path.stem] = [current_log, seq]
+            # A cursor made before the collection had a log is followed by all of it
+            if not known or log_id not in (None, current_log):
+                reset.add(file_path)
+                continue
+            if current_log is None:
+                continue
+            if entries is None or any(op is None for _, op in entries):
+                reset.add(file_path)
+                continue
+            latest = {}
+            for entry in reversed(entries):
+                latest.setdefault(entry[1]['id'], entry)
+            for number, op in sorted(latest.values(), key=lambda entry: entry[0]):
+                doc = self.database.get(file_path, op['id']) if op['op'] != 'delete' else None
+                if doc is None:
+                    op = {"op": "delete", "id": op['id']}
+                else:
+                    op = dict(op, doc=doc)
+                changes.append((number, file_path, op))
+        next_cursor = base64.urlsafe_b64encode(_json_dumps(positions)).decode('ascii')
+        return changes, reset, next_cursor
+
+    def stats(self) -> Dict[str, Any]:
+        """Log id and sequence number per collection; blocks on storage."""
+        logs = {}
+        for file_path in self.file_paths:
+            log_id, seq, _ = self.database.changes(file_path)
+            logs[file_path.stem] = {"log": log_id, "seq": seq}
+        return logs
+
+change_feed = ChangeFeed(db, [EXERCISES_FILE, SPLITS_FILE, SESSIONS_FILE])
+
+
+class MaterializedView:
+    """State derived from one collection and kept current by its writes.
+
+    ``refresh`` builds it from storage (``rebuild``); after that every write
+    reported to ``on_write`` is folded in by ``apply``, under ``lock``.
+    ``is_current`` tells whether the view reflects the collection's current
+    version. Writes it is not told about, e.g. by another process or a
+    whole-collection save, leave it stale until the next ``refresh``, and so
+    do writes ``apply`` cannot fold in incrementally (it returns False).
+    """
+
+    def __init__(self, database: JSONDatabase, file_path: Path):
+        self.database = database
+        self.file_path = file_path
+        self.version: Optional[str] = None
+        self.lock = threading.RLock()
+
+    def rebuild(self, records: list):
+        raise NotImplementedError
+
+    def apply(self, op: dict):
+        raise NotImplementedError
+
+    def refresh(self):
+        with self.database.locked(self.file_path, exclusive=False):
+            version = self.database.version(self.file_path)
+            records = self.database.load_json(self.file_path, [])
+        with self.lock:
+            self.rebuild(records)
+            self.version = version
+
+    def on_write(self, file_path: Path, op: Optional[dict]):
+        if file_path != self.file_path:
+            return
+        with self.lock:
+            if op is None or self.version is None or self.apply(op) is False:
+                self.version = None
+                return
+            self.version = self.database.version(file_path)
+
+    def is_current(self) -> bool:
+        version = self.version
+        return version is not None and version == self.database.version(self.file_path)
+
+    async def ensure_current(self, async_database: AsyncJSONDatabase):
+        if not self.is_current():
+            await async_database.run(self.refresh)
+
+class MuscleGroupView(MaterializedView):
+    """Rendered, sorted list of the muscle groups in the exercise catalog.
+
+    Keeps a count of exercises per group, so deletes and edits are applied
+    in place as well.
+    """
+
+    def __init__(self, database: JSONDatabase, file_path: Path):
+        super().__init__(database, file_path)
+        self.body = b'[]'
+        self._group_by_id: Dict[str, Any] = {}
+        self._counts: Dict[Any, int] = {}
+
+    def rebuild(self, exercises: list):
+        self._group_by_id = {exercise['id']: exercise.get('muscle_group') for exercise in exercises}
+        self._counts = {}
+        for group in self._group_by_id.values():
+            self._counts[group] = self._counts.get(group, 0) + 1
+        self._render()
+
+    def apply(self, op: dict):
+        groups = set(self._counts)
+        if op['id'] in self._group_by_id:
+            old_group = self._group_by_id.pop(op['id'])
+            self._counts[old_group] -= 1
+            if not self._counts[old_group]:
+                del self._counts[old_group]
+        if op['op'] != 'delete':
+            group = self._group_by_id[op['id']] = op['doc'].get('muscle_group')
+            self._counts[group] = self._counts.get(group, 0) + 1
+        if set(self._counts) != groups:
+            self._render()
+
+    def _render(self):
+        self.body = _json_dumps(sorted(self._counts))
+
+    def group_of(self, exercise_id: str):
+        return self._group_by_id.get(exercise_id)
+
+muscle_groups = MuscleGroupView(db, EXERCISES_FILE)
+db.add_listener(muscle_groups.on_write)
+
+
+class SetColumns(MaterializedView):
+    """Every stored ``Set`` of the session history as NumPy columns, one row per set.
+
+    ``columns`` are ``session`` and ``exercise`` (integer codes into
+    ``session_ids`` and ``exercise_ids``), ``completed_at`` (datetime64),
+    ``weight``, ``reps`` and ``set_number``. Writes are queued by ``apply``
+    and folded in by ``frame``: rows of replaced and deleted sessions are
+    masked out in one vectorised pass and those of new versions appended.
+    """
+
+    COLUMNS = {'session': np.int32, 'exercise': np.int32, 'completed_at': 'datetime64[us]',
+               'weight': np.float64, 'reps': np.int32, 'set_number': np.int32}
+
+    def __init__(self, database: JSONDatabase, file_path: Path):
+        super().__init__(database, file_path)
+        self.session_ids: List[str] = []
+        self.exercise_ids: List[str] = []
+        self.exercise_names: List[str] = []
+        self.columns = self._empty()
+        self._session_codes: Dict[str, int] = {}
+        self._exercise_codes: Dict[str, int] = {}
+        self._pending: List[dict] = []
+
+    def _empty(self) -> Dict[str, np.ndarray]:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+
+    def rebuild(self, sessions: list):
+        self.session_ids, self.exercise_ids, self.exercise_names = [], [], []
+        self._session_codes, self._exercise_codes = {}, {}
+        self.columns = self._empty()
+        self._pending = [{"op": "insert", "id": session['id'], "doc": session} for session in sessions]
+
+    def apply(self, op: dict):
+        self._pending.append(op)
+
+    def _code(self, codes: Dict[str, int], ids: List[str], key: str) -> int:
+        code = codes.get(key)
+        if code is None:
+            code = codes[key] = len(ids)
+            ids.append(key)
+        return code
+
+    def _flush(self):
+        removed, added = set(), {}
+        for op in self._pending:
+            if op['op'] != 'insert':
+                removed.add(op['id'])
+            if op['op'] == 'delete':
+                added.pop(op['id'], None)
             else:
-                return default_data
-        except (json.JSONDecodeError, FileNotFoundError):
-            return default_data
-    
-    @staticmethod
-    def save_json(file_path: Path, data: list):
-        try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False, default=str)
-            return True
-        except Exception as e:
-            logger.error(f"Error saving to {file_path}: {e}")
+                added[op['id']] = op['doc']
+        self._pending = []
+
+        columns = self.columns
+        removed_codes = [self._session_codes[session_id] for session_id in removed
+                         if session_id in self._session_codes]
+        if removed_codes:
+            keep = ~np.isin(columns['session'], removed_codes)
+            columns = {name: column[keep] for name, column in columns.items()}
+
+        rows = {name: [] for name in self.COLUMNS}
+        for session_id, session in added.items():
+            session_code = self._code(self._session_codes, self.session_ids, session_id)
+            for exercise in session.get('exercises') or []:
+                exercise_code = self._code(self._exercise_codes, self.exercise_ids, exercise.get('exercise_id'))
+                if exercise_code == len(self.exercise_names):
+                    self.exercise_names.append(exercise.get('exercise_name'))
+                else:
+                    self.exercise_names[exercise_code] = exercise.get('exercise_name')
+                for workout_set in exercise.get('sets') or []:
+                    rows['session'].append(session_code)
+                    rows['exercise'].append(exercise_code)
+                    rows['completed_at'].append(session.get('completed_at'))
+                    rows['weight'].append(workout_set.get('weight', 0.0))
+                    rows['reps'].append(workout_set.get('reps', 0))
+                    rows['set_number'].append(workout_set.get('set_number', 0))
+        if rows['session']:
+            columns = {name: np.concatenate([column, np.array(rows[name], dtype=self.COLUMNS[name])])
+                       for name, column in columns.items()}
+        self.columns = columns
+
+    def frame(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> pd.DataFrame:
+        """The set rows with ``start <= completed_at < end`` as a DataFrame."""
+        with self.lock:
+            if self._pending:
+                self._flush()
+            columns = self.columns
+        mask = np.ones(len(columns['session']), dtype=bool)
+        if start is not None:
+            mask &= columns['completed_at'] >= np.datetime64(start, 'us')
+        if end is not None:
+            mask &= columns['completed_at'] < np.datetime64(end, 'us')
+        frame = pd.DataFrame({name: column[mask] for name, column in columns.items()})
+        frame['volume'] = frame['weight'] * frame['reps']
+        return frame
+
+set_columns = SetColumns(db, SESSIONS_FILE)
+db.add_listener(set_columns.on_write)
+
+
+def epley_1rm(weight: float, reps: int) -> float:
+    return weight if reps == 1 else weight * (1 + reps / 30)
+
+def brzycki_1rm(weight: float, reps: int) -> Optional[float]:
+    # Undefined from 37 reps on
+    return weight * 36 / (37 - reps) if reps < 37 else None
+
+class PersonalRecordsView(MaterializedView):
+    """Personal records per exercise: best weight, best reps at each weight and best estimated 1RMs.
+
+    Every record names the set that achieved it first (weight, reps, session
+    and date). New sessions only ever improve records, so inserts are folded
+    in set by set. A replaced session that still contains the sets its
+    records came from is folded in the same way; if one of them is gone, or
+    the session is deleted, the view goes stale and the next read rebuilds
+    it from the whole history.
+    """
+
+    def __init__(self, database: JSONDatabase, file_path: Path):
+        super().__init__(database, file_path)
+        self.records: Dict[str, dict] = {}
+        # Sessions some record came from, and the exercises of those records
+        self._holders: Dict[str, set] = {}
+
+    def rebuild(self, sessions: list):
+        self.records, self._holders = {}, {}
+        for session in sorted(sessions, key=lambda session: session.get('completed_at') or ''):
+            self._fold(session)
+
+    def apply(self, op: dict):
+        if op['op'] != 'insert':
+            for exercise_id in self._holders.get(op['id'], ()):
+                if not self._still_achieved(exercise_id, op['id'], op.get('doc')):
+                    return False
+            if op['op'] == 'delete':
+                self._holders.pop(op['id'], None)
+        if op['op'] != 'delete':
+            self._fold(op['doc'])
+
+    def _still_achieved(self, exercise_id: str, session_id: str, session: Optional[dict]) -> bool:
+        if session is None:
             return False
-    
-    @staticmethod
-    def find_by_id(data: list, item_id: str):
-        return next((item for item in data if item.get('id') == item_id), None)
-    
+        record = self.records[exercise_id]
+        achieved_sets = {(workout_set.get('weight'), workout_set.get('reps'))
+                         for exercise in session.get('exercises') or [] if exercise.get('exercise_id') == exercise_id
+                         for workout_set in exercise.get('sets') or []}
+        entries = [record['best_weight'], record['e1rm_epley'], record['e1rm_brzycki'],
+                   *record['reps_at_weight'].values()]
+        return all((entry['weight'], entry['reps']) in achieved_sets
+                   and entry['achieved_at'] == session.get('completed_at')
+                   for entry in entries if entry is not None and entry['session_id'] == session_id)
+
+    def _fold(self, session: dict):
+        for exercise in session.get('exercises') or []:
+            exercise_id = exercise.get('exercise_id')
+            for workout_set in exercise.get('sets') or []:
+                weight, reps = workout_set.get('weight') or 0.0, workout_set.get('reps') or 0
+                if reps <= 0:
+                    continue
+                record = self.records.get(exercise_id)
+                if record is None:
+                    record = self.records[exercise_id] = {
+                        "exercise_id": exercise_id, "best_weight": None, "e1rm_epley": None,
+                        "e1rm_brzycki": None, "reps_at_weight": {}}
+                record["exercise_name"] = exercise.get('exercise_name')
+                entry = {"weight": weight, "reps": reps, "session_id": session['id'],
+                         "achieved_at": session.get('completed_at')}
+                improved = False
+                best = record["best_weight"]
+                if best is None or (weight, reps) > (best['weight'], best['reps']):
+                    record["best_weight"] = entry
+                    improved = True
+                at_weight = record["reps_at_weight"].get(weight)
+                if at_weight is None or reps > at_weight['reps']:
+                    record["reps_at_weight"][weight] = entry
+                    improved = True
+                for key, formula in (("e1rm_epley", epley_1rm), ("e1rm_brzycki", brzycki_1rm)):
+                    value = formula(weight, reps)
+                    if value is not None and (record[key] is None or value > record[key]['value']):
+                        record[key] = dict(entry, value=round(value, 2))
+                        improved = True
+                if improved:
+                    self._holders.setdefault(session['id'], set()).add(exercise_id)
+
+    def render(self, exercise_id: Optional[str] = None):
+        """The records of one exercise, or of all of them, in response form."""
+        def entry(value):
+            return None if value is None else dict(value, achieved_at=_response_timestamp(value['achieved_at']))
+
+        def exercise_records(record):
+            return {
+                "exercise_id": record["exercise_id"],
+                "exercise_name": record["exercise_name"],
+                "best_weight": entry(record["best_weight"]),
+                "e1rm_epley": entry(record["e1rm_epley"]),
+                "e1rm_brzycki": entry(record["e1rm_brzycki"]),
+                "reps_at_weight": [entry(value) for _, value in sorted(record["reps_at_weight"].items())],
+            }
+
+        with self.lock:
+            if exercise_id is not None:
+                record = self.records.get(exercise_id)
+                return None if record is None else exercise_records(record)
+            return [exercise_records(record) for record in self.records.values()]
+
+personal_records = PersonalRecordsView(db, SESSIONS_FILE)
+db.add_listener(personal_records.on_write)
+
+
+class TrainingHistoryIndex(MaterializedView):
+    """Session history indexed by split day and by (split, day, exercise).
+
+    For every exercise of a split day it keeps one summary per session, in
+    ``completed_at`` order: the top weight, the fewest reps done at it and
+    the number of sets. ``history`` returns the latest of them and
+    ``latest_session`` the most recent session of a day, both without
+    touching the sessions themselves.
+    """
+
+    def __init__(self, database: JSONDatabase, file_path: Path):
+        super().__init__(database, file_path)
+        self._by_exercise: Dict[tuple, list] = {}
+        self._by_day: Dict[tuple, list] = {}
+        # session id -> (split id, day number, completed_at, [(exercise id, name, summary)])
+        self._sessions: Dict[str, tuple] = {}
+        self.exercise_names: Dict[str, str] = {}
+
+    def rebuild(self, sessions: list):
+        self._by_exercise, self._by_day, self._sessions, self.exercise_names = {}, {}, {}, {}
+        # In index order, so every entry goes to the end of its lists
+        for session in sorted(sessions, key=lambda session: (session.get('completed_at') or '', session['id'])):
+            self._add(session, in_order=True)
+
+    def apply(self, op: dict):
+        self._remove(op['id'])
+        if op['op'] != 'delete':
+            self._add(op['doc'])
+
+    def _add(self, session: dict, in_order: bool = False):
+        insert = list.append if in_order else bisect.insort
+        day = (session.get('split_id'), session.get('day_number'))
+        completed_at = session.get('completed_at') or ''
+        exercises = []
+        for exercise in session.get('exercises') or []:
+            sets = exercise.get('sets') or []
+            top_weight = max((workout_set.get('weight') or 0.0 for workout_set in sets), default=None)
+            top_reps = min((workout_set.get('reps') or 0 for workout_set in sets
+                            if (workout_set.get('weight') or 0.0) == top_weight), default=None)
+            summary = (completed_at, session['id'], top_weight, top_reps, len(sets))
+            exercises.append((exercise.get('exercise_id'), exercise.get('exercise_name'), summary))
+            self.exercise_names[exercise.get('exercise_id')] = exercise.get('exercise_name')
+            if sets:
+                insert(self._by_exercise.setdefault(day + (exercise.get('exercise_id'),), []), summary)
+        insert(self._by_day.setdefault(day, []), (completed_at, session['id']))
+        self._sessions[session['id']] = (day, completed_at, exercises)
+
+    def _remove(self, session_id: str):
+        indexed = self._sessions.pop(session_id, None)
+        if indexed is None:
+            return
+        day, completed_at, exercises = indexed
+        for exercise_id, _, summary in exercises:
+            entries = self._by_exercise.get(day + (exercise_id,))
+            if entries and summary in entries:
+                entries.remove(summary)
+        self._by_day[day].remove((completed_at, session_id))
+
+    def history(self, split_id: str, day_number: int, exercise_id: str, count: int) -> list:
+        """The latest ``count`` summaries, newest first: (completed_at, session id, top weight, reps, sets)."""
+        with self.lock:
+            return self._by_exercise.get((split_id, day_number, exercise_id), [])[-count:][::-1]
+
+    def latest_session(self, split_id: str, day_number: int) -> Optional[tuple]:
+        """(session id, completed_at, [(exercise id, exercise name)]) of the day's latest session."""
+        with self.lock:
+            sessions = self._by_day.get((split_id, day_number))
+            if not sessions:
+                return None
+            completed_at, session_id = sessions[-1]
+            exercises = self._sessions[session_id][2]
+            return session_id, completed_at, [(exercise_id, name) for exercise_id, name, _ in exercises]
+
+    def latest_day(self, split_id: str, day_numbers: list) -> Optional[tuple]:
+        """(completed_at, session id, day number) of the latest session on any of ``day_numbers``."""
+        with self.lock:
+            latest = [self._by_day[(split_id, day_number)][-1] + (day_number,) for day_number in day_numbers
+                      if self._by_day.get((split_id, day_number))]
+            return max(latest, default=None)
+
+training_history = TrainingHistoryIndex(db, SESSIONS_FILE)
+db.add_listener(training_history.on_write)
+
+
+class _ProgressSubscriber:
+    __slots__ = ('session_id', 'queue', 'loop', 'dropped')
+
+    def __init__(self, session_id: str, queue_size: int):
+        self.session_id = session_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.loop = asyncio.get_running_loop()
+        self.dropped = False
+
+class SessionProgressHub:
+    """In-process pub/sub of the exercise progress of sessions, for live screens.
+
+    Registered as a write listener of the sessions, it publishes every write
+    changing the ``completed_count`` or ``is_archived`` of a session with
+    subscribers to all of them, as a ``progress`` event with the progress of
+    every exercise; deleting the session sends ``deleted``. Writes report
+    from storage threads, so events are handed to each subscriber's event
+    loop. A subscriber has a queue of ``queue_size`` events; one that falls
+    that far behind is dropped (its queue ends with None) instead of holding
+    up the others or growing without bound, and its client reconnects.
+    """
+
+    def __init__(self, file_path: Path, queue_size: int):
+        self.file_path = file_path
+        self.queue_size = queue_size
+        self.published = 0
+        self.dropped = 0
+        self._subscribers: Dict[str, set] = {}
+        # Progress last published per session with subscribers
+        self._progress: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
     @staticmethod
-    def filter_by(data: list, **filters):
-        result = data
-        for key, value in filters.items():
-            if value is not None:
-                result = [item for item in result if item.get(key) == value]
-        return result
+    def progress(session: dict) -> list:
+        return [{
+            "exercise_id": exercise.get('exercise_id'),
+            "completed_count": exercise.get('completed_count', 0),
+            "is_archived": exercise.get('is_archived', False),
+        } for exercise in session.get('exercises') or []]
+
+    def subscribe(self, session_id: str) -> _ProgressSubscriber:
+        subscriber = _ProgressSubscriber(session_id, self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(session_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: _ProgressSubscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.session_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.session_id]
+                self._progress.pop(subscriber.session_id, None)
+
+    def on_write(self, file_path: Path, op: Optional[dict]):
+        if file_path != self.file_path or op is None:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers.get(op['id'], ()))
+            if not subscribers:
+                return
+            if op['op'] == 'delete':
+                event = ("deleted", {"session_id": op['id']})
+            else:
+                progress = self.progress(op['doc'])
+                if self._progress.get(op['id']) == progress:
+                    return
+                self._progress[op['id']] = progress
+                event = ("progress", {"session_id": op['id'], "exercises": progress})
+            self.published += 1
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(self._deliver, subscriber, event)
+            except RuntimeError:  # its event loop is gone
+                self.unsubscribe(subscriber)
+
+    def _deliver(self, subscriber: _ProgressSubscriber, event: tuple):
+        if subscriber.dropped:
+            return
+        try:
+            subscriber.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            subscriber.dropped = True
+            self.dropped += 1
+            self.unsubscribe(subscriber)
+            while not subscriber.queue.empty():
+                subscriber.queue.get_nowait()
+            subscriber.queue.put_nowait(None)
+            logger.warning(f"Dropped a slow subscriber of session {subscriber.session_id}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            subscribers = sum(len(subscribers) for subscribers in self._subscribers.values())
+        return {"subscribers": subscribers, "published": self.published, "dropped": self.dropped}
 
-db = JSONDatabase()
+session_progress = SessionProgressHub(SESSIONS_FILE, SSE_QUEUE_SIZE)
+db.add_listener(session_progress.on_write)
 
 
 # Define Models
@@ -134,6 +3105,85 @@ class WorkoutSessionCreate(BaseModel):
     day_number: int
     exercises: List[WorkoutExercise]
 
+class SessionOperation(BaseModel):
+    session_id: str
+    exercise_id: str
+    action: Literal['complete', 'reset', 'sets']
+    # New sets of the exercise, for the 'sets' action
+    sets: Optional[List[Set]] = None
+
+class SessionBatch(BaseModel):
+    operations: List[SessionOperation]
+
+class WorkoutTemplate(BaseModel):
+    name: str
+    days_per_week: int
+    days: List[WorkoutDay]
+
+# Trusted reads: stored records were validated when they were written, so the
+# read routes render them straight from storage instead of building a model
+# per record and letting response_model validate it all over again.
+_MISSING = object()
+
+@functools.lru_cache(maxsize=None)
+def _trusted_plan(model) -> tuple:
+    """(name, default, default factory, nested model, kind) for each field of ``model``."""
+    plan = []
+    for name, field in model.model_fields.items():
+        annotation, many = field.annotation, False
+        if get_origin(annotation) is Union:
+            annotation = next(arg for arg in get_args(annotation) if arg is not type(None))
+        if get_origin(annotation) is list:
+            annotation, many = get_args(annotation)[0], True
+        nested = annotation if isinstance(annotation, type) and issubclass(annotation, BaseModel) else None
+        kind = ('models' if many else 'model') if nested else ('datetime' if annotation is datetime else None)
+        default = _MISSING if field.is_required() or field.default_factory else field.default
+        plan.append((name, default, field.default_factory, nested, kind))
+    return tuple(plan)
+
+def _response_timestamp(value):
+    """A stored ``str(datetime)`` timestamp in the ISO form pydantic responds with."""
+    if isinstance(value, datetime):
+        value = str(value)
+    if isinstance(value, str) and len(value) > 10 and value[10] == ' ':
+        value = f"{value[:10]}T{value[11:]}"
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+    return value
+
+def _trusted_dump(model, record: dict) -> dict:
+    """What ``model(**record).model_dump(mode='json')`` returns, without the validation.
+
+    Fills in defaults of fields added after the record was written, drops
+    unknown keys and renders timestamps like pydantic. A record lacking a
+    required field goes through the model after all, and fails there.
+    """
+    dumped = {}
+    for name, default, default_factory, nested, kind in _trusted_plan(model):
+        value = record.get(name, _MISSING)
+        if value is _MISSING:
+            if default_factory is not None:
+                value = default_factory()
+            elif default is _MISSING:
+                return model(**record).model_dump(mode='json')
+            else:
+                value = default
+        if value is not None:
+            if kind == 'models':
+                value = [_trusted_dump(nested, item) for item in value]
+            elif kind == 'model':
+                value = _trusted_dump(nested, value)
+            elif kind == 'datetime':
+                value = _response_timestamp(value)
+        dumped[name] = value
+    return dumped
+
+def _trusted_body(model, records) -> bytes:
+    """JSON of stored ``records`` (a list, or one record) rendered as ``model``."""
+    if isinstance(records, list):
+        return _json_dumps([_trusted_dump(model, record) for record in records])
+    return _json_dumps(_trusted_dump(model, records))
+
 # Predefined exercise data
 PREDEFINED_EXERCISES = [
     # Chest
@@ -191,196 +3241,507 @@ PREDEFINED_EXERCISES = [
     {"name": "Ab Wheel Rollouts", "muscle_group": "Core", "equipment": "Ab Wheel"}
 ]
 
+# Predefined split templates; TEMPLATES_FILE can add more or replace these
+PREDEFINED_TEMPLATES = {
+    "push_pull_legs": {
+        "name": "Push/Pull/Legs (3-Day)",
+        "days_per_week": 3,
+        "days": [
+            {
+                "day_number": 1,
+                "day_name": "Push Day",
+                "muscle_groups": ["Chest", "Shoulders", "Arms"],
+                "exercises": []
+            },
+            {
+                "day_number": 2,
+                "day_name": "Pull Day", 
+                "muscle_groups": ["Back", "Arms"],
+                "exercises": []
+            },
+            {
+                "day_number": 3,
+                "day_name": "Leg Day",
+                "muscle_groups": ["Legs", "Core"],
+                "exercises": []
+            }
+        ]
+    },
+    "upper_lower": {
+        "name": "Upper/Lower (4-Day)",
+        "days_per_week": 4,
+        "days": [
+            {
+                "day_number": 1,
+                "day_name": "Upper Body 1",
+                "muscle_groups": ["Chest", "Back", "Shoulders", "Arms"],
+                "exercises": []
+            },
+            {
+                "day_number": 2,
+                "day_name": "Lower Body 1",
+                "muscle_groups": ["Legs", "Core"],
+                "exercises": []
+            },
+            {
+                "day_number": 3,
+                "day_name": "Upper Body 2",
+                "muscle_groups": ["Chest", "Back", "Shoulders", "Arms"],
+                "exercises": []
+            },
+            {
+                "day_number": 4,
+                "day_name": "Lower Body 2",
+                "muscle_groups": ["Legs", "Core"],
+                "exercises": []
+            }
+        ]
+    },
+    "full_body": {
+        "name": "Full Body (3-Day)",
+        "days_per_week": 3,
+        "days": [
+            {
+                "day_number": 1,
+                "day_name": "Full Body 1",
+                "muscle_groups": ["Chest", "Back", "Legs"],
+                "exercises": []
+            },
+            {
+                "day_number": 2,
+                "day_name": "Full Body 2",
+                "muscle_groups": ["Shoulders", "Arms", "Core"],
+                "exercises": []
+            },
+            {
+                "day_number": 3,
+                "day_name": "Full Body 3",
+                "muscle_groups": ["Chest", "Back", "Legs"],
+                "exercises": []
+            }
+        ]
+    }
+}
+
+class TemplateRegistry:
+    """Split templates keyed by id, fixed at startup and rendered once.
+
+    ``load`` takes the predefined templates and adds (or replaces by id) the
+    ones in a JSON data file. ``tag`` is a digest of the rendered templates,
+    so every server process serving the same templates has the same ETag.
+    """
+
+    def __init__(self, templates: Dict[str, dict]):
+        self.templates = MappingProxyType(dict(templates))
+        self.body = _json_dumps(dict(templates))
+        self.tag = f"templates-{hashlib.sha256(self.body).hexdigest()[:16]}"
+
+    @classmethod
+    def load(cls, file_path: Path) -> 'TemplateRegistry':
+        templates = dict(PREDEFINED_TEMPLATES)
+        if file_path.exists():
+            try:
+                extra = _json_loads(file_path.read_bytes())
+                if not isinstance(extra, dict):
+                    raise ValueError("expected an object of templates keyed by id")
+                for template in extra.values():
+                    WorkoutTemplate(**template)
+                templates.update(extra)
+                logger.info(f"Loaded {len(extra)} split templates from {file_path}")
+            except (ValueError, TypeError) as e:
+                logger.error(f"Ignoring templates in {file_path}: {e}")
+        return cls(templates)
+
+template_registry = TemplateRegistry.load(TEMPLATES_FILE)
+
 # Initialize database with exercises
-@app.on_event("startup")
-async def startup_event():
-    # Check if exercises already exist
-    existing_exercises = db.load_json(EXERCISES_FILE, [])
-    if len(existing_exercises) == 0:
+def seed_exercises() -> int:
+    # Check and seed under the collection lock, so that parallel workers
+    # starting up at once seed the catalog only once
+    with db.locked(EXERCISES_FILE):
+        existing_exercises = db.load_json(EXERCISES_FILE, [])
+        if len(existing_exercises) > 0:
+            return 0
         # Insert predefined exercises
         exercises_to_insert = []
         for exercise_data in PREDEFINED_EXERCISES:
             exercise = Exercise(**exercise_data)
             exercises_to_insert.append(exercise.dict())
         db.save_json(EXERCISES_FILE, exercises_to_insert)
-        logger.info(f"Inserted {len(exercises_to_insert)} exercises into JSON database")
+        return len(exercises_to_insert)
+
+@app.on_event("startup")
+async def startup_event():
+    if isinstance(db, SQLiteDatabase):
+        source = (JSONFileDatabase() if SESSIONS_PARTITIONING == 'none'
+                  else PartitionedJSONFileDatabase({SESSIONS_FILE: 'completed_at'}))
+        copied = await async_db.run(migrate_json_to_sqlite, source, db,
+                                    [EXERCISES_FILE, SPLITS_FILE, SESSIONS_FILE])
+        for collection, count in copied.items():
+            logger.info(f"Migrated {count} {collection} from JSON files to {SQLITE_PATH}")
+
+    inserted = await async_db.run(seed_exercises)
+    if inserted:
+        logger.info(f"Inserted {inserted} exercises into {STORAGE_ENGINE} database")
+    await async_db.run(muscle_groups.refresh)
+
+    if isinstance(db, PartitionedJSONFileDatabase):
+        # Only the current month is read up front
+        await async_db.run(db.close_partitions, SESSIONS_FILE)
+        sessions = await async_db.page(SESSIONS_FILE, 'completed_at', start=db.current_month())
+        logger.info(f"Loaded {len(sessions)} workout sessions of this month ({SESSIONS_STORAGE} storage, "
+                    f"monthly partitions)")
+    elif isinstance(db, JSONFileDatabase):
+        # Rebuild the session state from the snapshot and its journal up front
+        sessions = await async_db.load_json(SESSIONS_FILE, [])
+        logger.info(f"Loaded {len(sessions)} workout sessions ({SESSIONS_STORAGE} storage)")
+    if isinstance(db, JSONFileDatabase) and SESSIONS_STORAGE == 'journal':
+        session_compactor.start()
+    storage_poller.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await storage_poller.stop()
+    await session_compactor.stop()
+    await async_db.flush()
+    async_db.shutdown()
+
+# Conditional GETs
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+class ConditionalGet:
+    """What ``_conditional_get`` hands a route: its ETag and a cached response, if any."""
+
+    def __init__(self, key: str, etag: str, file_paths, cache: bool = True):
+        self.key = key
+        self.etag = etag
+        self.file_paths = file_paths
+        # no-cache: browsers keep the response but revalidate it every time
+        self.headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        self.cached = response_cache.get(key, etag) if cache and response_cache.max_bytes else None
+
+    def respond(self, body: bytes, headers: Dict[str, str] = None) -> Response:
+        """JSON response with ``body``, also kept in the response cache."""
+        headers = dict(self.headers, **(headers or {}))
+        if response_cache.max_bytes:
+            response_cache.put(self.key, self.etag, self.file_paths, body, headers)
+        return Response(body, media_type="application/json", headers=headers)
+
+def _conditional_get(*file_paths: Path, tag: str = None, cache: bool = True):
+    """Dependency making a GET route over the collections ``file_paths`` conditional and cached.
+
+    The strong ETag is made from the collections' versions (or the fixed
+    ``tag``). If the client already holds it the route is cut short with a
+    304 before it reads anything. Otherwise the route gets a ConditionalGet;
+    it returns ``cached`` if that is set, and answers through ``respond``.
+    Routes with a precomputed answer pass ``cache=False`` and use ``headers``.
+    """
+    async def dependency(request: Request) -> ConditionalGet:
+        etag = '"' + (tag or '.'.join(f"{file_path.stem}-{db.version(file_path)}"
+                                      for file_path in file_paths)) + '"'
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            raise HTTPException(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        key = request.url.path
+        if request.query_params:
+            key += '?' + '&'.join(f"{name}={value}" for name, value in sorted(request.query_params.multi_items()))
+        return ConditionalGet(key, etag, file_paths, cache)
+    return Depends(dependency)
 
 # Exercise routes
 @api_router.get("/exercises", response_model=List[Exercise])
-async def get_exercises(muscle_group: Optional[str] = None):
-    exercises_data = db.load_json(EXERCISES_FILE, [])
+async def get_exercises(muscle_group: Optional[str] = None,
+                        conditional: ConditionalGet = _conditional_get(EXERCISES_FILE)):
+    if conditional.cached:
+        return conditional.cached
     if muscle_group:
-        exercises_data = db.filter_by(exercises_data, muscle_group=muscle_group)
-    return [Exercise(**exercise) for exercise in exercises_data]
+        exercises_data = await async_db.find(EXERCISES_FILE, muscle_group=muscle_group)
+    else:
+        exercises_data = await async_db.load_json(EXERCISES_FILE, [])
+    return conditional.respond(_trusted_body(Exercise, exercises_data))
 
 @api_router.post("/exercises", response_model=Exercise)
 async def create_exercise(exercise: ExerciseCreate):
     exercise_obj = Exercise(**exercise.dict())
-    exercises_data = db.load_json(EXERCISES_FILE, [])
-    exercises_data.append(exercise_obj.dict())
-    db.save_json(EXERCISES_FILE, exercises_data)
+    await async_db.insert(EXERCISES_FILE, exercise_obj.dict())
     return exercise_obj
 
 @api_router.get("/exercises/{exercise_id}", response_model=Exercise)
-async def get_exercise(exercise_id: str):
-    exercises_data = db.load_json(EXERCISES_FILE, [])
-    exercise = db.find_by_id(exercises_data, exercise_id)
+async def get_exercise(exercise_id: str, conditional: ConditionalGet = _conditional_get(EXERCISES_FILE)):
+    if conditional.cached:
+        return conditional.cached
+    exercise = await async_db.get(EXERCISES_FILE, exercise_id)
     if not exercise:
         raise HTTPException(status_code=404, detail="Exercise not found")
-    return Exercise(**exercise)
+    return conditional.respond(_trusted_body(Exercise, exercise))
 
-@api_router.get("/muscle-groups")
-async def get_muscle_groups():
-    exercises_data = db.load_json(EXERCISES_FILE, [])
-    muscle_groups = list(set(exercise.get('muscle_group') for exercise in exercises_data))
-    return sorted(muscle_groups)
+@api_router.get("/muscle-groups", response_model=List[str])
+async def get_muscle_groups(conditional: ConditionalGet = _conditional_get(EXERCISES_FILE, cache=False)):
+    await muscle_groups.ensure_current(async_db)
+    return Response(muscle_groups.body, media_type="application/json", headers=conditional.headers)
 
 # Workout Split routes
 @api_router.get("/splits", response_model=List[WorkoutSplit])
-async def get_workout_splits():
-    splits_data = db.load_json(SPLITS_FILE, [])
+async def get_workout_splits(conditional: ConditionalGet = _conditional_get(SPLITS_FILE)):
+    if conditional.cached:
+        return conditional.cached
+    splits_data = await async_db.load_json(SPLITS_FILE, [])
     # Sort by created_at descending
     splits_data.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-    return [WorkoutSplit(**split) for split in splits_data]
+    return conditional.respond(_trusted_body(WorkoutSplit, splits_data))
 
 @api_router.post("/splits", response_model=WorkoutSplit)
 async def create_workout_split(split: WorkoutSplitCreate):
     split_obj = WorkoutSplit(**split.dict())
-    splits_data = db.load_json(SPLITS_FILE, [])
-    splits_data.append(split_obj.dict())
-    db.save_json(SPLITS_FILE, splits_data)
+    await async_db.insert(SPLITS_FILE, split_obj.dict())
     return split_obj
 
 @api_router.get("/splits/{split_id}", response_model=WorkoutSplit)
-async def get_workout_split(split_id: str):
-    splits_data = db.load_json(SPLITS_FILE, [])
-    split = db.find_by_id(splits_data, split_id)
+async def get_workout_split(split_id: str, conditional: ConditionalGet = _conditional_get(SPLITS_FILE)):
+    if conditional.cached:
+        return conditional.cached
+    split = await async_db.get(SPLITS_FILE, split_id)
     if not split:
         raise HTTPException(status_code=404, detail="Workout split not found")
-    return WorkoutSplit(**split)
+    return conditional.respond(_trusted_body(WorkoutSplit, split))
 
 @api_router.put("/splits/{split_id}", response_model=WorkoutSplit)
 async def update_workout_split(split_id: str, split_update: WorkoutSplitCreate):
-    splits_data = db.load_json(SPLITS_FILE, [])
-    existing_split = db.find_by_id(splits_data, split_id)
-    if not existing_split:
-        raise HTTPException(status_code=404, detail="Workout split not found")
-    
     updated_split = WorkoutSplit(id=split_id, **split_update.dict())
-    # Replace the existing split
-    for i, split in enumerate(splits_data):
-        if split.get('id') == split_id:
-            splits_data[i] = updated_split.dict()
-            break
-    
-    db.save_json(SPLITS_FILE, splits_data)
+    if not await async_db.replace(SPLITS_FILE, split_id, updated_split.dict()):
+        raise HTTPException(status_code=404, detail="Workout split not found")
     return updated_split
 
 @api_router.delete("/splits/{split_id}")
 async def delete_workout_split(split_id: str):
-    splits_data = db.load_json(SPLITS_FILE, [])
-    original_length = len(splits_data)
-    splits_data = [split for split in splits_data if split.get('id') != split_id]
-    
-    if len(splits_data) == original_length:
+    if not await async_db.delete(SPLITS_FILE, split_id):
         raise HTTPException(status_code=404, detail="Workout split not found")
     
-    db.save_json(SPLITS_FILE, splits_data)
     return {"message": "Workout split deleted successfully"}
 
+# Session history pagination helpers
+def _timestamp_key(value: datetime) -> str:
+    """Format a datetime the way timestamps are stored (naive UTC, ``str()``)."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return str(value)
+
+def _encode_cursor(session: dict) -> str:
+    key = json.dumps([session.get('completed_at') or '', session['id']])
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        completed_at, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return (str(completed_at), str(session_id))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 # Workout Session routes
 @api_router.get("/sessions", response_model=List[WorkoutSession])
-async def get_workout_sessions():
-    sessions_data = db.load_json(SESSIONS_FILE, [])
-    # Sort by completed_at descending
-    sessions_data.sort(key=lambda x: x.get('completed_at', ''), reverse=True)
-    return [WorkoutSession(**session) for session in sessions_data]
+async def get_workout_sessions(
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    conditional: ConditionalGet = _conditional_get(SESSIONS_FILE),
+):
+    """Sessions newest first, optionally within ``from <= completed_at < to``.
+
+    With ``limit`` the result is one page; if there are more, the
+    ``X-Next-Cursor`` header holds the ``cursor`` that fetches the next one.
+    """
+    if conditional.cached:
+        return conditional.cached
+    sessions_data = await async_db.page(
+        SESSIONS_FILE, 'completed_at',
+        start=_timestamp_key(from_) if from_ else None,
+        end=_timestamp_key(to) if to else None,
+        after=_decode_cursor(cursor) if cursor else None,
+        # One extra record tells whether there is a next page
+        limit=limit + 1 if limit else None,
+    )
+    headers = {}
+    if limit and len(sessions_data) > limit:
+        sessions_data = sessions_data[:limit]
+        headers["X-Next-Cursor"] = _encode_cursor(sessions_data[-1])
+    return conditional.respond(_trusted_body(WorkoutSession, sessions_data), headers)
+
+EXPORT_BATCH_SIZE = 500
+SESSION_EXPORT_FIELDS = ['session_id', 'split_id', 'day_number', 'completed_at', 'exercise_count', 'set_count']
+SET_EXPORT_FIELDS = ['session_id', 'completed_at', 'exercise_id', 'exercise_name', 'set_number', 'weight', 'reps']
+
+def _export_rows(session: dict, sets: bool):
+    if not sets:
+        exercises = session.get('exercises') or []
+        yield {
+            'session_id': session['id'],
+            'split_id': session.get('split_id'),
+            'day_number': session.get('day_number'),
+            'completed_at': session.get('completed_at'),
+            'exercise_count': len(exercises),
+            'set_count': sum(len(exercise.get('sets') or []) for exercise in exercises),
+        }
+        return
+    for exercise in session.get('exercises') or []:
+        for workout_set in exercise.get('sets') or []:
+            yield {
+                'session_id': session['id'],
+                'completed_at': session.get('completed_at'),
+                'exercise_id': exercise.get('exercise_id'),
+                'exercise_name': exercise.get('exercise_name'),
+                'set_number': workout_set.get('set_number'),
+                'weight': workout_set.get('weight'),
+                'reps': workout_set.get('reps'),
+            }
+
+@api_router.get("/sessions/export")
+async def export_workout_sessions(
+    format: Literal['ndjson', 'csv'] = 'ndjson',
+    sets: bool = False,
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+):
+    """Stream the session history oldest first as NDJSON or CSV.
+
+    NDJSON exports whole sessions; CSV a summary row per session. With
+    ``sets=true`` both formats export one flattened row per set instead.
+    """
+    records = async_db.iterate(
+        SESSIONS_FILE, 'completed_at', batch_size=EXPORT_BATCH_SIZE, descending=False,
+        start=_timestamp_key(from_) if from_ else None,
+        end=_timestamp_key(to) if to else None,
+    )
+
+    async def ndjson():
+        async for session in records:
+            rows = _export_rows(session, sets) if sets else [_trusted_dump(WorkoutSession, session)]
+            yield b''.join(_json_dumps(row) + b'\n' for row in rows)
+
+    async def csv_lines():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=SET_EXPORT_FIELDS if sets else SESSION_EXPORT_FIELDS)
+        writer.writeheader()
+        async for session in records:
+            for row in _export_rows(session, sets):
+                writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    name = 'sets' if sets else 'sessions'
+    headers = {"Content-Disposition": f'attachment; filename="{name}.{format}"'}
+    if format == 'csv':
+        return StreamingResponse(csv_lines(), media_type="text/csv", headers=headers)
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson", headers=headers)
 
 @api_router.post("/sessions", response_model=WorkoutSession)
 async def create_workout_session(session: WorkoutSessionCreate):
     session_obj = WorkoutSession(**session.dict())
-    sessions_data = db.load_json(SESSIONS_FILE, [])
-    sessions_data.append(session_obj.dict())
-    db.save_json(SESSIONS_FILE, sessions_data)
+    await async_db.insert(SESSIONS_FILE, session_obj.dict())
     return session_obj
 
 @api_router.get("/sessions/{session_id}", response_model=WorkoutSession)
-async def get_workout_session(session_id: str):
-    sessions_data = db.load_json(SESSIONS_FILE, [])
-    session = db.find_by_id(sessions_data, session_id)
+async def get_workout_session(session_id: str, conditional: ConditionalGet = _conditional_get(SESSIONS_FILE)):
+    if conditional.cached:
+        return conditional.cached
+    session = await async_db.get(SESSIONS_FILE, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Workout session not found")
-    return WorkoutSession(**session)
+    return conditional.respond(_trusted_body(WorkoutSession, session))
 
-@api_router.patch("/sessions/{session_id}/exercises/{exercise_id}/complete")
-async def complete_exercise(session_id: str, exercise_id: str):
-    """Mark an exercise as completed and handle archiving logic"""
-    sessions_data = db.load_json(SESSIONS_FILE, [])
-    session = db.find_by_id(sessions_data, session_id)
+def _sse(event: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + _json_dumps(data) + b"\n\n"
+
+async def _session_progress_events(session: dict, subscriber: _ProgressSubscriber):
+    try:
+        yield _sse("progress", {"session_id": session['id'], "exercises": SessionProgressHub.progress(session)})
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if event is None:
+                return
+            yield _sse(*event)
+            if event[0] == "deleted":
+                return
+    finally:
+        session_progress.unsubscribe(subscriber)
+
+@api_router.get("/sessions/{session_id}/events")
+async def stream_session_progress(session_id: str):
+    """Server-sent events with the exercise progress of a session, as completions and resets apply.
+
+    Starts with a ``progress`` event holding the current progress, then one
+    per change; ``deleted`` ends the stream. A client that falls too far
+    behind is disconnected and gets a fresh snapshot when it reconnects.
+    """
+    # Subscribed before the snapshot is read, so no change falls in between
+    subscriber = session_progress.subscribe(session_id)
+    session = await async_db.get(SESSIONS_FILE, session_id)
     if not session:
+        session_progress.unsubscribe(subscriber)
         raise HTTPException(status_code=404, detail="Workout session not found")
-    
-    # Find the exercise in the session
-    session_obj = WorkoutSession(**session)
-    exercise_found = False
-    
+    return StreamingResponse(_session_progress_events(session, subscriber), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _find_session_exercise(session_obj: WorkoutSession, exercise_id: str) -> WorkoutExercise:
     for exercise in session_obj.exercises:
         if exercise.exercise_id == exercise_id:
-            exercise_found = True
-            exercise.completed_count += 1
-            
-            # Check if exercise should be archived
-            if exercise.completed_count >= exercise.target_completions:
-                exercise.is_archived = True
-            break
-    
-    if not exercise_found:
-        raise HTTPException(status_code=404, detail="Exercise not found in session")
-    
-    # Update the session in the data
-    for i, s in enumerate(sessions_data):
-        if s.get('id') == session_id:
-            sessions_data[i] = session_obj.dict()
-            break
+            return exercise
+    raise HTTPException(status_code=404, detail="Exercise not found in session")
+
+def _complete_session_exercise(exercise: WorkoutExercise):
+    exercise.completed_count += 1
+    # Check if exercise should be archived
+    if exercise.completed_count >= exercise.target_completions:
+        exercise.is_archived = True
+
+def _reset_session_exercise(exercise: WorkoutExercise):
+    exercise.completed_count = 0
+    exercise.is_archived = False
+
+@api_router.patch("/sessions/{session_id}/exercises/{exercise_id}/complete")
+async def complete_exercise(session_id: str, exercise_id: str):
+    """Mark an exercise as completed and handle archiving logic"""
+    def complete(session: dict) -> dict:
+        session_obj = WorkoutSession(**session)
+        _complete_session_exercise(_find_session_exercise(session_obj, exercise_id))
+        return session_obj.dict()
     
-    db.save_json(SESSIONS_FILE, sessions_data)
+    # The read-modify-write runs under the sessions lock, so parallel
+    # completions of the same exercise are all counted
+    session = await async_db.update(SESSIONS_FILE, session_id, complete)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Workout session not found")
+    exercise = next(e for e in session['exercises'] if e['exercise_id'] == exercise_id)
     
     return {
         "message": "Exercise completed successfully",
         "exercise_id": exercise_id,
-        "completed_count": exercise.completed_count,
-        "is_archived": exercise.is_archived
+        "completed_count": exercise['completed_count'],
+        "is_archived": exercise['is_archived']
     }
 
 @api_router.patch("/sessions/{session_id}/exercises/{exercise_id}/reset")
 async def reset_exercise_completion(session_id: str, exercise_id: str):
     """Reset exercise completion count (useful for testing or mistakes)"""
-    sessions_data = db.load_json(SESSIONS_FILE, [])
-    session = db.find_by_id(sessions_data, session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="Workout session not found")
-    
-    # Find the exercise in the session
-    session_obj = WorkoutSession(**session)
-    exercise_found = False
-    
-    for exercise in session_obj.exercises:
-        if exercise.exercise_id == exercise_id:
-            exercise_found = True
-            exercise.completed_count = 0
-            exercise.is_archived = False
-            break
+    def reset(session: dict) -> dict:
+        session_obj = WorkoutSession(**session)
+        _reset_session_exercise(_find_session_exercise(session_obj, exercise_id))
+        return session_obj.dict()
     
-    if not exercise_found:
-        raise HTTPException(status_code=404, detail="Exercise not found in session")
-    
-    # Update the session in the data
-    for i, s in enumerate(sessions_data):
-        if s.get('id') == session_id:
-            sessions_data[i] = session_obj.dict()
-            break
-    
-    db.save_json(SESSIONS_FILE, sessions_data)
+    session = await async_db.update(SESSIONS_FILE, session_id, reset)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Workout session not found")
     
     return {
         "message": "Exercise completion reset successfully",
@@ -389,90 +3750,353 @@ async def reset_exercise_completion(session_id: str, exercise_id: str):
         "is_archived": False
     }
 
+@api_router.post("/sessions/batch")
+async def batch_update_sessions(batch: SessionBatch):
+    """Apply many completions, resets and set edits with one write of the sessions.
+
+    Operations run in order, each on the session as the previous ones left
+    it. One that cannot apply gets an error status in its result and the
+    others still go through. Results come back in request order.
+    """
+    results: List[Optional[dict]] = [None] * len(batch.operations)
+    by_session: Dict[str, list] = {}
+    for index, operation in enumerate(batch.operations):
+        by_session.setdefault(operation.session_id, []).append((index, operation))
+
+    def apply_operations(operations: list):
+        def apply(session: dict) -> dict:
+            session_obj = WorkoutSession(**session)
+            for index, operation in operations:
+                try:
+                    exercise = _find_session_exercise(session_obj, operation.exercise_id)
+                except HTTPException as e:
+                    results[index] = {"status": e.status_code, "detail": e.detail}
+                    continue
+                if operation.action == 'complete':
+                    _complete_session_exercise(exercise)
+                elif operation.action == 'reset':
+                    _reset_session_exercise(exercise)
+                elif operation.sets is None:
+                    results[index] = {"status": 400, "detail": "sets are required to edit sets"}
+                    continue
+                else:
+                    exercise.sets = operation.sets
+                results[index] = {"status": 200, "completed_count": exercise.completed_count,
+                                  "is_archived": exercise.is_archived, "sets": len(exercise.sets)}
+            return session_obj.dict()
+        return apply
+
+    sessions = await async_db.update_many(SESSIONS_FILE, {
+        session_id: apply_operations(operations) for session_id, operations in by_session.items()})
+    for session_id, session in sessions.items():
+        if session is None:
+            for index, _ in by_session[session_id]:
+                results[index] = {"status": 404, "detail": "Workout session not found"}
+    return {"results": [
+        dict(session_id=operation.session_id, exercise_id=operation.exercise_id, action=operation.action, **result)
+        for operation, result in zip(batch.operations, results)
+    ]}
+
+# Analytics routes, computed over the columnar view of all sets
+def _analytics_summary(frame: pd.DataFrame) -> dict:
+    return {
+        "sessions": int(frame['session'].nunique()),
+        "exercises": int(frame['exercise'].nunique()),
+        "sets": len(frame),
+        "reps": int(frame['reps'].sum()),
+        "volume": round(float(frame['volume'].sum()), 2),
+        "first_session_at": frame['completed_at'].min().isoformat() if len(frame) else None,
+        "last_session_at": frame['completed_at'].max().isoformat() if len(frame) else None,
+    }
+
+def _analytics_exercises(frame: pd.DataFrame) -> list:
+    grouped = frame.groupby('exercise').agg(
+        sessions=('session', 'nunique'), sets=('reps', 'size'), reps=('reps', 'sum'),
+        volume=('volume', 'sum'), max_weight=('weight', 'max'),
+        first_at=('completed_at', 'min'), last_at=('completed_at', 'max'),
+    ).sort_values('volume', ascending=False)
+    return [{
+        "exercise_id": set_columns.exercise_ids[row.Index],
+        "exercise_name": set_columns.exercise_names[row.Index],
+        "sessions": int(row.sessions),
+        "sets": int(row.sets),
+        "reps": int(row.reps),
+        "volume": round(float(row.volume), 2),
+        "max_weight": float(row.max_weight),
+        "first_at": row.first_at.isoformat(),
+        "last_at": row.last_at.isoformat(),
+    } for row in grouped.itertuples()]
+
+def _analytics_volume(frame: pd.DataFrame, period: str) -> list:
+    days = frame['completed_at'].to_numpy().astype('datetime64[D]')
+    if period == 'week':
+        # Day 0 of the epoch was a Thursday; weeks start on Monday
+        starts = days - (days.astype(np.int64) + 3) % 7
+    else:
+        starts = days.astype('datetime64[M]').astype('datetime64[D]')
+    grouped = frame.assign(period_start=starts).groupby('period_start').agg(
+        sessions=('session', 'nunique'), sets=('reps', 'size'), reps=('reps', 'sum'), volume=('volume', 'sum'))
+    return [{
+        "period_start": row.Index.date().isoformat(),
+        "sessions": int(row.sessions),
+        "sets": int(row.sets),
+        "reps": int(row.reps),
+        "volume": round(float(row.volume), 2),
+    } for row in grouped.itertuples()]
+
+def _analytics_muscle_groups(frame: pd.DataFrame) -> list:
+    groups = np.array([muscle_groups.group_of(exercise_id) or "Other" for exercise_id in set_columns.exercise_ids],
+                      dtype=object)
+    grouped = frame.assign(muscle_group=groups[frame['exercise'].to_numpy()]).groupby('muscle_group').agg(
+        sets=('reps', 'size'), volume=('volume', 'sum')).sort_values('volume', ascending=False)
+    total = float(grouped['volume'].sum())
+    return [{
+        "muscle_group": row.Index,
+        "sets": int(row.sets),
+        "volume": round(float(row.volume), 2),
+        "volume_share": round(float(row.volume) / total, 4) if total else 0.0,
+    } for row in grouped.itertuples()]
+
+async def _analytics_response(conditional: ConditionalGet, compute, from_: Optional[datetime],
+                              to: Optional[datetime], *args) -> Response:
+    if conditional.cached:
+        return conditional.cached
+    await set_columns.ensure_current(async_db)
+    await muscle_groups.ensure_current(async_db)
+
+    def run():
+        frame = set_columns.frame(_timestamp_key(from_) if from_ else None, _timestamp_key(to) if to else None)
+        return _json_dumps(compute(frame, *args))
+    return conditional.respond(await async_db.run(run))
+
+@api_router.get("/analytics/summary")
+async def get_analytics_summary(
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    conditional: ConditionalGet = _conditional_get(SESSIONS_FILE),
+):
+    """Totals over the sets logged with ``from <= completed_at < to``."""
+    return await _analytics_response(conditional, _analytics_summary, from_, to)
+
+@api_router.get("/analytics/exercises")
+async def get_analytics_exercises(
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    conditional: ConditionalGet = _conditional_get(SESSIONS_FILE),
+):
+    """Sets, reps, volume (weight x reps) and best weight per exercise, by volume."""
+    return await _analytics_response(conditional, _analytics_exercises, from_, to)
+
+@api_router.get("/analytics/volume")
+async def get_analytics_volume(
+    period: Literal['week', 'month'] = 'week',
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    conditional: ConditionalGet = _conditional_get(SESSIONS_FILE),
+):
+    """Sessions, sets, reps and volume per week (from Monday) or calendar month."""
+    return await _analytics_response(conditional, _analytics_volume, from_, to, period)
+
+@api_router.get("/analytics/muscle-groups")
+async def get_analytics_muscle_groups(
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    conditional: ConditionalGet = _conditional_get(SESSIONS_FILE, EXERCISES_FILE),
+):
+    """Sets and share of the volume per muscle group of the exercise catalog."""
+    return await _analytics_response(conditional, _analytics_muscle_groups, from_, to)
+
+# Progressive overload recommendations
+RECOMMENDATION_BASES = np.array(['no_history', 'increase_weight', 'deload', 'add_rep', 'repeat'], dtype=object)
+
+def _round_weight(weights: np.ndarray) -> np.ndarray:
+    return np.round(weights / 2.5) * 2.5
+
+def recommend_progression(histories: List[list], low: int, high: int, sessions: int) -> List[dict]:
+    """Next weight and reps for several exercises at once (double progression).
+
+    ``histories`` holds each exercise's latest summaries, newest first (see
+    TrainingHistoryIndex.history). Once every set of the last session reached
+    ``high`` reps the weight goes up by about 5% (at least 2.5) and the reps
+    start again at ``low``; within the range the target is one more rep; if
+    all of the last ``sessions`` sessions fell short of ``low`` at the same
+    weight it drops by 10%; otherwise the last session is repeated.
+    """
+    weights = np.full((len(histories), sessions), np.nan)
+    reps = np.full((len(histories), sessions), np.nan)
+    set_counts = np.zeros(len(histories), dtype=np.int64)
+    for row, summaries in enumerate(histories):
+        for column, (_, _, top_weight, top_reps, set_count) in enumerate(summaries[:sessions]):
+            weights[row, column], reps[row, column] = top_weight, top_reps
+        if summaries:
+            set_counts[row] = summaries[0][4]
+
+    last_weight, last_reps = weights[:, 0], reps[:, 0]
+    has_history = ~np.isnan(last_weight)
+    reached_top = (last_reps >= high) & (last_weight > 0)
+    stalled = np.all((weights == last_weight[:, None]) & (reps < low), axis=1) & (last_weight > 0)
+    in_range = last_reps >= low
+    basis = np.select([~has_history, reached_top, stalled, in_range], [0, 1, 2, 3], 4)
+
+    increment = np.maximum(2.5, _round_weight(last_weight * 0.05))
+    weight = np.select([reached_top, stalled], [last_weight + increment, _round_weight(last_weight * 0.9)],
+                       last_weight)
+    target_reps = np.select([~has_history, reached_top | stalled, in_range],
+                            [(low + high) // 2, low, np.minimum(last_reps + 1, high)], low)
+    return [{
+        "weight": None if not has_history[row] else float(weight[row]),
+        "reps": int(target_reps[row]),
+        "sets": int(set_counts[row]) if has_history[row] else None,
+        "basis": RECOMMENDATION_BASES[basis[row]],
+    } for row in range(len(histories))]
+
+@api_router.get("/splits/{split_id}/next")
+async def get_next_workout_day(split_id: str, conditional: ConditionalGet = _conditional_get(SESSIONS_FILE, SPLITS_FILE)):
+    """The day of the split to train next and the latest session of that day.
+
+    The next day is the one after the day of the split's latest session,
+    wrapping around to the first, or the first day if nothing was logged.
+    """
+    if conditional.cached:
+        return conditional.cached
+    split = await async_db.get(SPLITS_FILE, split_id)
+    if not split:
+        raise HTTPException(status_code=404, detail="Workout split not found")
+    days = sorted(split.get('days') or [], key=lambda day: day['day_number'])
+    if not days:
+        raise HTTPException(status_code=404, detail="Workout day not found")
+    await training_history.ensure_current(async_db)
+
+    day_numbers = [day['day_number'] for day in days]
+    latest = training_history.latest_day(split_id, day_numbers)
+    next_day = days[(day_numbers.index(latest[2]) + 1) % len(days)] if latest else days[0]
+    last = training_history.latest_session(split_id, next_day['day_number'])
+    last_session = await async_db.get(SESSIONS_FILE, last[0]) if last else None
+    return conditional.respond(_json_dumps({
+        "split_id": split_id,
+        "day_number": next_day['day_number'],
+        "day_name": next_day.get('day_name'),
+        "previous_day_number": latest[2] if latest else None,
+        "last_session": _trusted_dump(WorkoutSession, last_session) if last_session else None,
+    }))
+
+@api_router.get("/splits/{split_id}/days/{day_number}/recommendations")
+async def get_day_recommendations(
+    split_id: str,
+    day_number: int,
+    rep_range: str = Query('8-12', pattern=r'^\d+-\d+$'),
+    sessions: int = Query(3, ge=1, le=20),
+    exercise_id: Optional[List[str]] = Query(None),
+    conditional: ConditionalGet = _conditional_get(SESSIONS_FILE, SPLITS_FILE),
+):
+    """Suggested weight and reps for each exercise of a split day, from its last ``sessions`` sessions.
+
+    The exercises are the ``exercise_id`` ones if given, else those of the
+    day in the split, else those of the day's latest session.
+    """
+    if conditional.cached:
+        return conditional.cached
+    low, high = (int(bound) for bound in rep_range.split('-'))
+    if low > high:
+        raise HTTPException(status_code=400, detail="Invalid rep range")
+    split = await async_db.get(SPLITS_FILE, split_id)
+    if not split:
+        raise HTTPException(status_code=404, detail="Workout split not found")
+    await training_history.ensure_current(async_db)
+
+    names = {}
+    if not exercise_id:
+        day = next((day for day in split.get('days', []) if day.get('day_number') == day_number), None)
+        if day is None:
+            raise HTTPException(status_code=404, detail="Workout day not found")
+        planned = [(exercise['exercise_id'], exercise.get('exercise_name')) for exercise in day.get('exercises') or []]
+        if not planned:
+            latest = training_history.latest_session(split_id, day_number)
+            planned = latest[2] if latest else []
+        exercise_id = [planned_id for planned_id, _ in planned]
+        names = dict(planned)
+
+    histories = [training_history.history(split_id, day_number, planned_id, sessions) for planned_id in exercise_id]
+    recommendations = recommend_progression(histories, low, high, sessions)
+    for planned_id, summaries, recommendation in zip(exercise_id, histories, recommendations):
+        recommendation["exercise_id"] = planned_id
+        recommendation["exercise_name"] = names.get(planned_id) or training_history.exercise_names.get(planned_id)
+        recommendation["last"] = None if not summaries else {
+            "weight": summaries[0][2], "reps": summaries[0][3],
+            "completed_at": _response_timestamp(summaries[0][0]),
+        }
+    return conditional.respond(_json_dumps(recommendations))
+
+# Personal record routes
+@api_router.get("/records")
+async def get_personal_records(conditional: ConditionalGet = _conditional_get(SESSIONS_FILE)):
+    """Best weight, best reps at each weight and best estimated 1RM (Epley and Brzycki) per exercise."""
+    if conditional.cached:
+        return conditional.cached
+    await personal_records.ensure_current(async_db)
+    return conditional.respond(_json_dumps(personal_records.render()))
+
+@api_router.get("/records/{exercise_id}")
+async def get_exercise_records(exercise_id: str, conditional: ConditionalGet = _conditional_get(SESSIONS_FILE)):
+    if conditional.cached:
+        return conditional.cached
+    await personal_records.ensure_current(async_db)
+    records = personal_records.render(exercise_id)
+    if records is None:
+        raise HTTPException(status_code=404, detail="No records for this exercise")
+    return conditional.respond(_json_dumps(records))
+
+@api_router.post("/records/rebuild")
+async def rebuild_personal_records():
+    """Recompute all records from the whole session history."""
+    await async_db.run(personal_records.refresh)
+    return {"message": "Personal records rebuilt", "exercises": len(personal_records.records)}
+
 # Template routes for common workout splits
 @api_router.get("/templates")
-async def get_workout_templates():
-    templates = {
-        "push_pull_legs": {
-            "name": "Push/Pull/Legs (3-Day)",
-            "days_per_week": 3,
-            "days": [
-                {
-                    "day_number": 1,
-                    "day_name": "Push Day",
-                    "muscle_groups": ["Chest", "Shoulders", "Arms"],
-                    "exercises": []
-                },
-                {
-                    "day_number": 2,
-                    "day_name": "Pull Day", 
-                    "muscle_groups": ["Back", "Arms"],
-                    "exercises": []
-                },
-                {
-                    "day_number": 3,
-                    "day_name": "Leg Day",
-                    "muscle_groups": ["Legs", "Core"],
-                    "exercises": []
-                }
-            ]
-        },
-        "upper_lower": {
-            "name": "Upper/Lower (4-Day)",
-            "days_per_week": 4,
-            "days": [
-                {
-                    "day_number": 1,
-                    "day_name": "Upper Body 1",
-                    "muscle_groups": ["Chest", "Back", "Shoulders", "Arms"],
-                    "exercises": []
-                },
-                {
-                    "day_number": 2,
-                    "day_name": "Lower Body 1",
-                    "muscle_groups": ["Legs", "Core"],
-                    "exercises": []
-                },
-                {
-                    "day_number": 3,
-                    "day_name": "Upper Body 2",
-                    "muscle_groups": ["Chest", "Back", "Shoulders", "Arms"],
-                    "exercises": []
-                },
-                {
-                    "day_number": 4,
-                    "day_name": "Lower Body 2",
-                    "muscle_groups": ["Legs", "Core"],
-                    "exercises": []
-                }
-            ]
-        },
-        "full_body": {
-            "name": "Full Body (3-Day)",
-            "days_per_week": 3,
-            "days": [
-                {
-                    "day_number": 1,
-                    "day_name": "Full Body 1",
-                    "muscle_groups": ["Chest", "Back", "Legs"],
-                    "exercises": []
-                },
-                {
-                    "day_number": 2,
-                    "day_name": "Full Body 2",
-                    "muscle_groups": ["Shoulders", "Arms", "Core"],
-                    "exercises": []
-                },
-                {
-                    "day_number": 3,
-                    "day_name": "Full Body 3",
-                    "muscle_groups": ["Chest", "Back", "Legs"],
-                    "exercises": []
-                }
-            ]
-        }
-    }
-    return templates
+async def get_workout_templates(conditional: ConditionalGet = _conditional_get(tag=template_registry.tag, cache=False)):
+    return Response(template_registry.body, media_type="application/json", headers=conditional.headers)
+
+# Change feed
+CHANGE_FEED_MODELS = {EXERCISES_FILE: Exercise, SPLITS_FILE: WorkoutSplit, SESSIONS_FILE: WorkoutSession}
+CHANGE_OPS = {"insert": "insert", "replace": "update", "delete": "delete"}
+
+@api_router.get("/changes")
+async def get_changes(since: Optional[str] = None, collection: Optional[List[str]] = Query(None)):
+    """Inserts, updates and deletes since the ``since`` cursor, for keeping a local copy current.
+
+    Start by calling it without ``since``: every collection comes back in
+    ``reset``, to be fetched in full, together with the ``next`` cursor to
+    pass on the following call. Changes are upserts by id, or tombstones
+    for ``delete``; applying one that is already reflected is harmless.
+    """
+    collections = {file_path.stem: file_path for file_path in change_feed.file_paths}
+    if collection and not set(collection) <= set(collections):
+        raise HTTPException(status_code=400, detail=f"Unknown collection (expected {', '.join(collections)})")
+    file_paths = [collections[name] for name in collection] if collection else list(collections.values())
+    try:
+        entries, reset, cursor = await async_db.run(change_feed.since, since, file_paths)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid since cursor")
+    changes = []
+    for seq, file_path, op in entries:
+        change = {"seq": seq, "collection": file_path.stem, "op": CHANGE_OPS[op['op']], "id": op['id']}
+        if op['op'] != 'delete':
+            change["doc"] = _trusted_dump(CHANGE_FEED_MODELS[file_path], op['doc'])
+        changes.append(change)
+    return {"next": cursor, "reset": sorted(file_path.stem for file_path in reset), "changes": changes}
+
+# Storage diagnostics
+@api_router.get("/storage/stats")
+async def get_storage_stats():
+    stats = await async_db.run(db.stats)
+    stats["compactor"] = session_compactor.stats()
+    stats["response_cache"] = response_cache.stats()
+    stats["change_feed"] = await async_db.run(change_feed.stats)
+    stats["session_progress"] = session_progress.stats()
+    stats["group_commit"] = dict(async_db.group_commit_stats, window_ms=GROUP_COMMIT_WINDOW_MS,
+                                 max_ops=GROUP_COMMIT_MAX_OPS)
+    return stats
 
 # Health check
 @api_router.get("/")
@@ -488,4 +4112,5 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
\ No newline at end of file
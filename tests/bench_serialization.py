@@ -0,0 +1,72 @@
+"""Compare the collection encodings on a synthetic session history.
+
+    python tests/bench_serialization.py [sessions]
+
+Prints encode/decode time and size for the pretty-printed ``json`` module
+output sessions.json used to be written as, and for each STORAGE_FORMAT.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp())
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import server  # noqa: E402
+
+
+def make_sessions(count):
+    start = datetime(2020, 1, 1)
+    return [{
+        "id": str(uuid.uuid4()),
+        "split_id": str(uuid.uuid4()),
+        "day_number": i % 4 + 1,
+        "exercises": [{
+            "exercise_id": str(uuid.uuid4()),
+            "exercise_name": f"Exercise {j}",
+            "sets": [{"set_number": k + 1, "weight": 60.0 + 2.5 * k, "reps": 8 - k} for k in range(4)],
+            "completed_count": 4,
+            "target_completions": 4,
+        } for j in range(5)],
+        "completed_at": str(start + timedelta(days=i, minutes=i % 90)),
+    } for i in range(count)]
+
+
+def timed(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    sessions = make_sessions(count)
+    codecs = [('json module, indent=2',
+               lambda: json.dumps(sessions, indent=2, ensure_ascii=False, default=str).encode('utf-8'),
+               lambda raw: json.loads(raw))]
+    for storage_format in server.STORAGE_FORMATS:
+        if storage_format == 'msgpack' and server.msgpack is None:
+            print("msgpack is not installed, skipping it")
+            continue
+        codecs.append((storage_format,
+                       lambda storage_format=storage_format: server._encode_collection(sessions, storage_format),
+                       server._decode_collection))
+
+    print(f"{count} sessions, orjson {'on' if server.orjson is not None else 'off'}")
+    print(f"{'format':<24}{'encode ms':>12}{'decode ms':>12}{'size KiB':>12}")
+    for name, encode, decode in codecs:
+        encode_time, raw = timed(encode)
+        decode_time, decoded = timed(lambda: decode(raw))
+        assert decoded == sessions
+        print(f"{name:<24}{encode_time * 1000:>12.1f}{decode_time * 1000:>12.1f}{len(raw) / 1024:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Keep the server's data files out of the working tree while testing
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='sculptor-test-'))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
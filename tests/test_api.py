@@ -0,0 +1,373 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(server.app) as client:
+        yield client
+
+
+def test_conditional_gets_answer_304_until_the_collection_changes(client):
+    first = client.get("/api/exercises")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and first.headers["Cache-Control"] == "no-cache"
+
+    repeat = client.get("/api/exercises", headers={"If-None-Match": etag})
+    assert repeat.status_code == 304 and repeat.content == b"" and repeat.headers["ETag"] == etag
+    templates_etag = client.get("/api/templates").headers["ETag"]
+    assert client.get("/api/templates", headers={"If-None-Match": f'"x", W/{templates_etag}'}).status_code == 304
+
+    # A write to another collection leaves the ETag alone, one to this collection changes it
+    client.post("/api/sessions", json={"split_id": "s", "day_number": 1, "exercises": []})
+    assert client.get("/api/exercises", headers={"If-None-Match": etag}).status_code == 304
+    client.post("/api/exercises", json={"name": "Neck Curl", "muscle_group": "Neck"})
+    changed = client.get("/api/exercises", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+    assert "Neck Curl" in [exercise["name"] for exercise in changed.json()]
+
+
+def test_response_cache_serves_rendered_bytes_until_a_write(client):
+    server.response_cache.invalidate(server.SPLITS_FILE)
+    hits = server.response_cache.hits
+    first = client.get("/api/splits")
+    assert client.get("/api/splits").content == first.content
+    assert server.response_cache.hits == hits + 1
+
+    days = [{"day_number": 1, "day_name": "Full Body", "muscle_groups": ["Chest"]}]
+    client.post("/api/splits", json={"name": "Cached", "days_per_week": 1, "days": days})
+    assert not any(key.startswith("/api/splits") for key in server.response_cache._entries)
+    assert [split["name"] for split in client.get("/api/splits").json()][0] == "Cached"
+
+
+def test_response_cache_evicts_least_recently_used_by_bytes():
+    cache = server.ResponseCache(max_bytes=40)
+    for key in ("a", "b", "c"):
+        cache.put(key, '"1"', [server.SPLITS_FILE], b"x" * 10, {})
+    assert cache.get("a", '"1"') is not None
+    assert cache.get("b", '"2"') is None
+    cache.put("d", '"1"', [server.SESSIONS_FILE], b"x" * 10, {})
+    cache.put("e", '"1"', [server.SESSIONS_FILE], b"x" * 10, {})
+    assert list(cache._entries) == ["c", "a", "d", "e"] and cache.size == 40
+    cache.put("huge", '"1"', [], b"x" * 11, {})
+    assert "huge" not in cache._entries
+    cache.invalidate(server.SESSIONS_FILE)
+    assert list(cache._entries) == ["c", "a"] and cache.size == 20
+
+
+def test_muscle_groups_view_follows_exercise_writes(client):
+    assert server.muscle_groups.is_current()
+    exercise = client.post("/api/exercises", json={"name": "Wrist Roller", "muscle_group": "Forearms"}).json()
+    # Kept current by the write itself, no reload needed
+    assert server.muscle_groups.is_current()
+    assert "Forearms" in client.get("/api/muscle-groups").json()
+    server.db.delete(server.EXERCISES_FILE, exercise["id"])
+    assert "Forearms" not in client.get("/api/muscle-groups").json()
+    # A write it is not told about is picked up by a reload
+    server.db.save_json(server.EXERCISES_FILE, server.db.load_json(server.EXERCISES_FILE) + [
+        {"id": "x", "name": "Hip Thrust", "muscle_group": "Glutes"}])
+    assert not server.muscle_groups.is_current()
+    assert "Glutes" in client.get("/api/muscle-groups").json()
+
+
+def test_outside_edits_change_etags_and_refresh_views(client):
+    response = client.get("/api/exercises")
+    etag = response.headers["ETag"]
+    client.get("/api/muscle-groups")
+    assert server.muscle_groups.is_current()
+
+    # Edited behind the server's back, as by hand or by another tool
+    exercises = response.json() + [{"id": "y", "name": "Tibialis Raise", "muscle_group": "Shins"}]
+    server.EXERCISES_FILE.write_bytes(server._json_dumps(exercises))
+    asyncio.run(server.storage_poller.check())
+    changed = client.get("/api/exercises", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+    assert "Tibialis Raise" in [exercise["name"] for exercise in changed.json()]
+    assert not server.muscle_groups.is_current()
+    assert "Shins" in client.get("/api/muscle-groups").json()
+
+
+def test_conditional_gets_do_not_wait_for_storage_locks(client):
+    etag = client.get("/api/exercises").headers["ETag"]
+    client.get("/api/muscle-groups")
+    held, release = threading.Event(), threading.Event()
+
+    def hold_lock():
+        with server.db.locked(server.EXERCISES_FILE):
+            held.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    held.wait(5)
+    try:
+        started = time.perf_counter()
+        assert client.get("/api/exercises", headers={"If-None-Match": etag}).status_code == 304
+        assert client.get("/api/muscle-groups").status_code == 200
+        assert time.perf_counter() - started < 1
+    finally:
+        release.set()
+        holder.join()
+
+
+def test_template_registry_adds_templates_from_data_file(tmp_path):
+    templates_file = tmp_path / "templates.json"
+    templates_file.write_text('{"bro_split": {"name": "Bro Split", "days_per_week": 1, "days": '
+                              '[{"day_number": 1, "day_name": "Chest", "muscle_groups": ["Chest"]}]}}')
+    registry = server.TemplateRegistry.load(templates_file)
+    assert set(registry.templates) == set(server.PREDEFINED_TEMPLATES) | {"bro_split"}
+    assert registry.tag != server.template_registry.tag
+
+    templates_file.write_text('{"broken": {"name": "No days"}}')
+    assert server.TemplateRegistry.load(templates_file).body == server.template_registry.body
+
+
+def test_batch_applies_every_operation_with_one_write(client):
+    exercises = [{"exercise_id": exercise_id, "exercise_name": exercise_id.title(), "target_completions": 2,
+                  "sets": [{"set_number": 1, "weight": 40.0, "reps": 10}]} for exercise_id in ("row", "curl")]
+    session = client.post("/api/sessions", json={"split_id": "batch", "day_number": 1, "exercises": exercises}).json()
+    writes = []
+    server.db.add_listener(lambda file_path, op: writes.append(op and op["id"]))
+
+    operations = [
+        {"session_id": session["id"], "exercise_id": "row", "action": "complete"},
+        {"session_id": session["id"], "exercise_id": "row", "action": "complete"},
+        {"session_id": session["id"], "exercise_id": "curl", "action": "sets",
+         "sets": [{"set_number": 1, "weight": 15.0, "reps": 12}]},
+        {"session_id": session["id"], "exercise_id": "squat", "action": "reset"},
+        {"session_id": session["id"], "exercise_id": "curl", "action": "sets"},
+        {"session_id": "missing", "exercise_id": "row", "action": "complete"},
+    ]
+    results = client.post("/api/sessions/batch", json={"operations": operations}).json()["results"]
+    assert [result["status"] for result in results] == [200, 200, 200, 404, 400, 404]
+    assert (results[1]["completed_count"], results[1]["is_archived"]) == (2, True)
+    assert writes == [session["id"]]
+    stored = {e["exercise_id"]: e for e in client.get(f"/api/sessions/{session['id']}").json()["exercises"]}
+    assert stored["row"]["completed_count"] == 2 and stored["curl"]["sets"][0]["weight"] == 15.0
+
+    reset = client.post("/api/sessions/batch", json={"operations": [
+        {"session_id": session["id"], "exercise_id": "row", "action": "reset"}]}).json()["results"]
+    assert (reset[0]["completed_count"], reset[0]["is_archived"]) == (0, False)
+
+
+def test_change_feed_replays_writes_since_a_cursor(client):
+    start = client.get("/api/changes", params={"collection": ["splits", "sessions"]}).json()
+    assert start["reset"] == ["sessions", "splits"] and start["changes"] == []
+
+    days = [{"day_number": 1, "day_name": "Full Body", "muscle_groups": ["Chest"]}]
+    kept = client.post("/api/splits", json={"name": "Kept", "days_per_week": 1, "days": days}).json()
+    dropped = client.post("/api/splits", json={"name": "Dropped", "days_per_week": 1, "days": days}).json()
+    client.put(f"/api/splits/{kept['id']}", json={"name": "Renamed", "days_per_week": 1, "days": days})
+    client.delete(f"/api/splits/{dropped['id']}")
+    client.post("/api/exercises", json={"name": "Pallof Press", "muscle_group": "Core"})
+
+    feed = client.get("/api/changes", params={"since": start["next"], "collection": "splits"}).json()
+    assert feed["reset"] == []
+    assert [(c["op"], c["id"]) for c in feed["changes"]] == [("update", kept["id"]), ("delete", dropped["id"])]
+    assert feed["changes"][0]["doc"] == client.get(f"/api/splits/{kept['id']}").json()
+    assert "doc" not in feed["changes"][1]
+    assert client.get("/api/changes", params={"since": feed["next"]}).json()["changes"] == []
+
+    # The log is kept with the data, so the cursor is good after a restart or in another worker
+    restarted = server.ChangeFeed(server.create_database(), server.change_feed.file_paths)
+    client.delete(f"/api/splits/{kept['id']}")
+    changes, reset, _ = restarted.since(feed["next"], [server.SPLITS_FILE])
+    assert reset == set() and [(op["op"], op["id"]) for _, _, op in changes] == [("delete", kept["id"])]
+
+    # A cursor of another log, or one not covering a collection, means starting over
+    other_log = base64.urlsafe_b64encode(json.dumps({"splits": ["0123abcd", 1]}).encode()).decode()
+    assert client.get("/api/changes", params={"since": other_log}).json()["reset"] == [
+        "exercises", "sessions", "splits"]
+    assert client.get("/api/changes", params={"since": "nonsense"}).status_code == 400
+    assert client.get("/api/changes", params={"collection": "templates"}).status_code == 400
+
+
+def test_session_progress_is_pushed_to_subscribers(client):
+    exercises = [{"exercise_id": "row", "exercise_name": "Row", "target_completions": 2}]
+    session = client.post("/api/sessions", json={"split_id": "live", "day_number": 1, "exercises": exercises}).json()
+    assert client.get("/api/sessions/missing/events").status_code == 404
+
+    def complete(session):
+        exercise = dict(session["exercises"][0], completed_count=session["exercises"][0]["completed_count"] + 1)
+        return dict(session, exercises=[exercise])
+
+    async def follow():
+        subscriber = server.session_progress.subscribe(session["id"])
+        events = server._session_progress_events(server.db.get(server.SESSIONS_FILE, session["id"]), subscriber)
+        received = [await events.__anext__()]
+        # Writes happen on storage threads
+        await asyncio.to_thread(server.db.update, server.SESSIONS_FILE, session["id"], complete)
+        received.append(await asyncio.wait_for(events.__anext__(), 5))
+        await asyncio.to_thread(server.db.delete, server.SESSIONS_FILE, session["id"])
+        received.append(await asyncio.wait_for(events.__anext__(), 5))
+        received += [event async for event in events]
+        return received
+
+    received = asyncio.run(follow())
+    assert received[0] == b'event: progress\ndata: {"session_id":"%s","exercises":[{"exercise_id":"row",' \
+                          b'"completed_count":0,"is_archived":false}]}\n\n' % session["id"].encode()
+    assert b'"completed_count":1' in received[1] and received[2].startswith(b"event: deleted")
+    assert len(received) == 3 and server.session_progress.stats()["subscribers"] == 0
+
+
+def test_slow_progress_subscribers_are_dropped():
+    hub = server.SessionProgressHub(server.SESSIONS_FILE, queue_size=2)
+
+    async def main():
+        subscriber = hub.subscribe("s1")
+        for count in range(3):
+            hub.on_write(server.SESSIONS_FILE, {"op": "replace", "id": "s1", "doc": {
+                "id": "s1", "exercises": [{"exercise_id": "row", "completed_count": count}]}})
+        await asyncio.sleep(0)
+        return subscriber.queue.get_nowait()
+
+    assert asyncio.run(main()) is None
+    assert hub.stats() == {"subscribers": 0, "published": 3, "dropped": 1}
+
+
+def test_analytics_match_a_plain_aggregation_of_the_history(client):
+    exercises = client.get("/api/exercises").json()[:3]
+    assert client.get("/api/analytics/summary").status_code == 200
+    session_ids = []
+    for i in range(4):
+        session_ids.append(client.post("/api/sessions", json={"split_id": "analytics", "day_number": 1, "exercises": [{
+            "exercise_id": exercise["id"], "exercise_name": exercise["name"],
+            "sets": [{"set_number": n, "weight": 20.0 + 5 * i + n, "reps": 10 - n} for n in range(1, 4)],
+        } for exercise in exercises[:i + 1]]}).json()["id"])
+    # Replaced and deleted sessions are folded into the columns
+    client.patch(f"/api/sessions/{session_ids[0]}/exercises/{exercises[0]['id']}/complete")
+    server.db.delete(server.SESSIONS_FILE, session_ids[1])
+
+    expected = {}
+    for session in client.get("/api/sessions").json():
+        for exercise in session["exercises"]:
+            totals = expected.setdefault(exercise["exercise_id"], {"sets": 0, "volume": 0.0})
+            totals["sets"] += len(exercise["sets"])
+            totals["volume"] += sum(s["weight"] * s["reps"] for s in exercise["sets"])
+    by_exercise = {row["exercise_id"]: row for row in client.get("/api/analytics/exercises").json()}
+    assert {key: {"sets": row["sets"], "volume": row["volume"]} for key, row in by_exercise.items()} == expected
+
+    summary = client.get("/api/analytics/summary").json()
+    assert summary["sets"] == sum(totals["sets"] for totals in expected.values())
+    weeks = client.get("/api/analytics/volume", params={"period": "month"}).json()
+    assert sum(week["volume"] for week in weeks) == summary["volume"]
+    shares = client.get("/api/analytics/muscle-groups").json()
+    assert round(sum(group["volume_share"] for group in shares), 2) == 1.0
+    assert client.get("/api/analytics/summary", params={"from": "2100-01-01"}).json()["sets"] == 0
+
+
+def test_personal_records_follow_new_and_changed_sessions(client):
+    exercise = client.post("/api/exercises", json={"name": "Zercher Squat", "muscle_group": "Legs"}).json()
+
+    def log(*sets):
+        return client.post("/api/sessions", json={"split_id": "records", "day_number": 1, "exercises": [{
+            "exercise_id": exercise["id"], "exercise_name": exercise["name"],
+            "sets": [{"set_number": n, "weight": weight, "reps": reps} for n, (weight, reps) in enumerate(sets, 1)],
+        }]}).json()
+
+    first = log((100.0, 5), (100.0, 3), (80.0, 10))
+    assert client.get(f"/api/records/{exercise['id']}").json()["best_weight"]["reps"] == 5
+    second = log((105.0, 2), (80.0, 8))
+    # Completing an exercise rewrites the session but keeps its records incremental
+    client.patch(f"/api/sessions/{second['id']}/exercises/{exercise['id']}/complete")
+    assert server.personal_records.is_current()
+
+    records = client.get(f"/api/records/{exercise['id']}").json()
+    assert (records["best_weight"]["weight"], records["best_weight"]["session_id"]) == (105.0, second["id"])
+    assert [(r["weight"], r["reps"]) for r in records["reps_at_weight"]] == [(80.0, 10), (100.0, 5), (105.0, 2)]
+    assert records["e1rm_epley"]["value"] == round(100.0 * (1 + 5 / 30), 2)
+    assert records["e1rm_brzycki"]["value"] == round(100.0 * 36 / 32, 2)
+    assert records["e1rm_epley"]["achieved_at"] == first["completed_at"]
+
+    # Losing the session a record came from means a rebuild
+    server.db.delete(server.SESSIONS_FILE, second["id"])
+    assert not server.personal_records.is_current()
+    assert client.get(f"/api/records/{exercise['id']}").json()["best_weight"]["weight"] == 100.0
+    assert client.post("/api/records/rebuild").status_code == 200
+
+
+def test_recommendations_progress_each_exercise_of_a_day(client):
+    days = [{"day_number": 1, "day_name": "Push", "muscle_groups": ["Chest"]}]
+    split = client.post("/api/splits", json={"name": "Overload", "days_per_week": 1, "days": days}).json()
+
+    def log(*exercises):
+        client.post("/api/sessions", json={"split_id": split["id"], "day_number": 1, "exercises": [{
+            "exercise_id": exercise_id, "exercise_name": exercise_id.title(),
+            "sets": [{"set_number": n, "weight": weight, "reps": reps} for n, reps in enumerate(set_reps, 1)],
+        } for exercise_id, weight, set_reps in exercises]})
+
+    for _ in range(3):
+        log(("bench", 100.0, [12, 12, 12]), ("fly", 20.0, [9, 8]), ("dip", 40.0, [5, 4]))
+    log(("bench", 100.0, [12, 12, 12]), ("fly", 20.0, [9, 9]), ("dip", 40.0, [5, 4]), ("press", 50.0, [10, 9]))
+
+    url = f"/api/splits/{split['id']}/days/1/recommendations"
+    recommendations = {r["exercise_id"]: r for r in client.get(url, params={"rep_range": "8-12"}).json()}
+    assert list(recommendations) == ["bench", "fly", "dip", "press"]
+    assert (recommendations["bench"]["weight"], recommendations["bench"]["reps"]) == (105.0, 8)
+    assert (recommendations["fly"]["weight"], recommendations["fly"]["reps"]) == (20.0, 10)
+    assert (recommendations["dip"]["weight"], recommendations["dip"]["basis"]) == (35.0, "deload")
+    assert recommendations["press"]["basis"] == "add_rep"
+
+    only = client.get(url, params=[("exercise_id", "dip"), ("exercise_id", "squat"), ("sessions", 5)]).json()
+    assert [(r["basis"], r["exercise_name"]) for r in only] == [("repeat", "Dip"), ("no_history", None)]
+    assert client.get(url, params={"rep_range": "12-8"}).status_code == 400
+
+
+def test_next_day_follows_the_latest_session_of_the_split(client):
+    days = [{"day_number": n, "day_name": name, "muscle_groups": ["Legs"]} for n, name in ((1, "Upper"), (2, "Lower"))]
+    split = client.post("/api/splits", json={"name": "Next", "days_per_week": 2, "days": days}).json()
+    url = f"/api/splits/{split['id']}/next"
+    first = client.get(url).json()
+    assert (first["day_number"], first["previous_day_number"], first["last_session"]) == (1, None, None)
+
+    def log(day_number, weight):
+        return client.post("/api/sessions", json={"split_id": split["id"], "day_number": day_number, "exercises": [{
+            "exercise_id": "squat", "exercise_name": "Squat", "sets": [{"set_number": 1, "weight": weight, "reps": 5}],
+        }]}).json()
+
+    upper = log(1, 60.0)
+    lower = log(2, 100.0)
+    after_lower = client.get(url).json()
+    assert (after_lower["day_number"], after_lower["day_name"], after_lower["previous_day_number"]) == (1, "Upper", 2)
+    assert after_lower["last_session"] == client.get(f"/api/sessions/{upper['id']}").json()
+
+    log(1, 62.5)
+    after_upper = client.get(url).json()
+    assert after_upper["day_number"] == 2 and after_upper["last_session"]["id"] == lower["id"]
+    assert client.get("/api/splits/missing/next").status_code == 404
+
+
+def test_ndjson_export_renders_sessions_like_the_api(client):
+    # As written before completed_count and friends existed, with a key the model does not know
+    server.db.insert(server.SESSIONS_FILE, {
+        "id": "legacy", "split_id": "export", "day_number": 1, "legacy_note": "dropped",
+        "exercises": [{"exercise_id": "e1", "exercise_name": "Squats",
+                       "sets": [{"set_number": 1, "weight": 60.0, "reps": 5}]}],
+        "completed_at": "2099-01-01 10:00:00"})
+    export = client.get("/api/sessions/export", params={"from": "2099-01-01T00:00:00"})
+    assert [json.loads(line) for line in export.text.splitlines()] == [client.get("/api/sessions/legacy").json()]
+
+
+def test_recommendations_for_a_day_stay_fast_at_100k_sessions():
+    index = server.TrainingHistoryIndex(server.db, server.SESSIONS_FILE)
+    index.rebuild([{
+        "id": f"s{i}", "split_id": "big", "day_number": i % 4 + 1, "completed_at": f"2020-01-01 00:00:{i:06d}",
+        "exercises": [{"exercise_id": f"e{i % 4}-{n}", "exercise_name": "E",
+                       "sets": [{"set_number": 1, "weight": 50.0 + i % 7, "reps": 8 + i % 5}]} for n in range(6)],
+    } for i in range(100000)])
+
+    timings = []
+    for _ in range(200):
+        started = time.perf_counter()
+        histories = [index.history("big", 2, f"e1-{n}", 3) for n in range(6)]
+        server.recommend_progression(histories, 8, 12, 3)
+        timings.append(time.perf_counter() - started)
+    assert sorted(timings)[int(len(timings) * 0.99)] < 0.010
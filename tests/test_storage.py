@@ -0,0 +1,497 @@
+import asyncio
+import os
+import sqlite3
+import tracemalloc
+import uuid
+
+import pytest
+
+import server
+from server import (AsyncJSONDatabase, JournalCompactor, JSONFileDatabase, PartitionedJSONFileDatabase,
+                    SQLiteDatabase, _decode_collection, _json_dumps, migrate_json_to_sqlite)
+
+
+def _session(session_id):
+    return {"id": session_id, "exercises": [{"exercise_id": "e1", "completed_count": 0}]}
+
+
+def _increment(session):
+    exercise = dict(session["exercises"][0], completed_count=session["exercises"][0]["completed_count"] + 1)
+    return dict(session, exercises=[exercise])
+
+
+def test_parallel_updates_lose_no_increments(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    database = JSONFileDatabase(journaled_files=[sessions_file])
+    async_db = AsyncJSONDatabase(database, max_workers=8)
+
+    async def main():
+        await async_db.insert(sessions_file, _session("s1"))
+        await asyncio.gather(*(async_db.update(sessions_file, "s1", _increment) for _ in range(50)))
+
+    asyncio.run(main())
+    async_db.shutdown()
+    assert database.load_json(sessions_file)[0]["exercises"][0]["completed_count"] == 50
+    # A fresh instance replays the journal to the same state
+    assert JSONFileDatabase().load_json(sessions_file)[0]["exercises"][0]["completed_count"] == 50
+
+
+def test_update_many_writes_all_records_at_once(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    for database in (JSONFileDatabase(journaled_files=[sessions_file]), JSONFileDatabase(),
+                     SQLiteDatabase(tmp_path / 'workouts.db')):
+        sessions_file.unlink(missing_ok=True)
+        JSONFileDatabase.journal_path(sessions_file).unlink(missing_ok=True)
+        for session_id in ("s1", "s2", "s3"):
+            database.insert(sessions_file, _session(session_id))
+        writes = []
+        database.add_listener(lambda file_path, op: writes.append(op["id"]))
+
+        updated = database.update_many(sessions_file, {"s1": _increment, "s3": _increment, "s9": _increment})
+        assert updated["s9"] is None and updated["s3"]["exercises"][0]["completed_count"] == 1
+        assert writes == ["s1", "s3"]
+
+        def fail(session):
+            raise ValueError("bad operation")
+
+        with pytest.raises(ValueError):
+            database.update_many(sessions_file, {"s2": _increment, "s3": fail})
+        counts = [s["exercises"][0]["completed_count"] for s in database.load_json(sessions_file)]
+        assert counts == [1, 0, 1]
+
+
+def test_group_commit_writes_a_burst_of_updates_once(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    database = JSONFileDatabase(journaled_files=[sessions_file])
+    async_db = AsyncJSONDatabase(database, max_workers=4, group_commit_window=0.05, group_commit_max_ops=30)
+    database.insert(sessions_file, _session("s1"))
+    database.insert(sessions_file, _session("s2"))
+
+    def fail(session):
+        raise ValueError("bad update")
+
+    async def main():
+        updates = [async_db.update(sessions_file, "s1", _increment) for _ in range(20)]
+        updates += [async_db.update(sessions_file, "s2", fail), async_db.update(sessions_file, "s2", _increment),
+                    async_db.update(sessions_file, "s9", _increment)]
+        return await asyncio.gather(*updates, return_exceptions=True)
+
+    results = asyncio.run(main())
+    async_db.shutdown()
+    # Every caller sees the record as its own update left it
+    assert [r["exercises"][0]["completed_count"] for r in results[:20]] == list(range(1, 21))
+    assert isinstance(results[20], ValueError) and results[21]["exercises"][0]["completed_count"] == 1
+    assert results[22] is None
+    assert async_db.group_commit_stats == {"commits": 1, "updates": 23}
+    # The two inserts, then one append with both changed sessions
+    assert database.journal_stats(sessions_file)["records"] == 4
+    assert [s["exercises"][0]["completed_count"] for s in JSONFileDatabase().load_json(sessions_file)] == [20, 1]
+
+
+def test_save_json_replaces_file_atomically(tmp_path):
+    exercises_file = tmp_path / 'exercises.json'
+    database = JSONFileDatabase()
+    assert database.save_json(exercises_file, [{"id": "a"}])
+    assert database.save_json(exercises_file, [{"id": "a"}, {"id": "b"}])
+    assert [path.name for path in tmp_path.iterdir()] == ['exercises.json']
+    assert len(JSONFileDatabase().load_json(exercises_file)) == 2
+
+
+def test_multiprocess_caches_see_each_others_writes(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    worker_a = JSONFileDatabase(journaled_files=[sessions_file], multiprocess=True)
+    worker_b = JSONFileDatabase(journaled_files=[sessions_file], multiprocess=True)
+
+    worker_a.insert(sessions_file, _session("s1"))
+    assert [s["id"] for s in worker_b.load_json(sessions_file)] == ["s1"]
+    worker_b.update(sessions_file, "s1", _increment)
+    worker_b.insert(sessions_file, _session("s2"))
+    worker_a.update(sessions_file, "s1", _increment)
+    assert worker_a.compact(sessions_file)
+    worker_a.insert(sessions_file, _session("s3"))
+
+    for worker in (worker_a, worker_b, JSONFileDatabase()):
+        sessions = worker.load_json(sessions_file)
+        assert [s["id"] for s in sessions] == ["s1", "s2", "s3"]
+        assert sessions[0]["exercises"][0]["completed_count"] == 2
+
+
+def test_compactor_triggers_on_records_bytes_and_idle_time(tmp_path):
+    compactor = JournalCompactor(JSONFileDatabase(), tmp_path / 'sessions.json', max_records=10,
+                                 max_bytes=1000, idle_seconds=60, check_interval=1)
+    assert compactor.trigger({"records": 0, "bytes": 5000, "idle_seconds": 600}) is None
+    assert compactor.trigger({"records": 10, "bytes": 100, "idle_seconds": 0}) == "records"
+    assert compactor.trigger({"records": 2, "bytes": 1000, "idle_seconds": 0}) == "bytes"
+    assert compactor.trigger({"records": 2, "bytes": 100, "idle_seconds": 60}) == "idle"
+    assert compactor.trigger({"records": 2, "bytes": 100, "idle_seconds": None}) == "idle"
+    assert compactor.trigger({"records": 2, "bytes": 100, "idle_seconds": 5}) is None
+
+
+def test_compactor_run_folds_the_journal_into_the_snapshot(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    database = JSONFileDatabase(journaled_files=[sessions_file])
+    for i in range(3):
+        database.insert(sessions_file, _session(f"s{i}"))
+    compactor = JournalCompactor(database, sessions_file, max_records=3, max_bytes=10 ** 9,
+                                 idle_seconds=3600, check_interval=0.01)
+
+    async def run_briefly():
+        compactor.start()
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if compactor.compactions:
+                break
+        await compactor.stop()
+
+    asyncio.run(run_briefly())
+    assert compactor.stats() == {"running": False, "compactions": 1, "last_reason": "records"}
+    assert not database.journal_path(sessions_file).exists()
+    assert [s["id"] for s in JSONFileDatabase().load_json(sessions_file)] == ["s0", "s1", "s2"]
+
+
+def test_compaction_carries_over_records_appended_while_it_writes(tmp_path, monkeypatch):
+    sessions_file = tmp_path / 'sessions.json'
+    database = JSONFileDatabase(journaled_files=[sessions_file])
+    database.insert(sessions_file, _session("s1"))
+    write_synced = server._write_synced
+
+    def write_snapshot_while_appending(file_path, content):
+        write_synced(file_path, content)
+        database.insert(sessions_file, _session("s2"))
+        database.update(sessions_file, "s1", _increment)
+
+    monkeypatch.setattr(server, '_write_synced', write_snapshot_while_appending)
+    assert database.compact(sessions_file)
+    monkeypatch.undo()
+
+    assert [s["id"] for s in _decode_collection(sessions_file.read_bytes())] == ["s1"]
+    assert database.journal_stats(sessions_file)["records"] == 2
+    for reader in (database, JSONFileDatabase(journaled_files=[sessions_file])):
+        sessions = reader.load_json(sessions_file)
+        assert [s["id"] for s in sessions] == ["s1", "s2"]
+        assert sessions[0]["exercises"][0]["completed_count"] == 1
+
+
+def test_cache_counts_hits_and_rereads_files_changed_behind_it(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    database = JSONFileDatabase()
+    database.save_json(sessions_file, [_session("s1")])
+    hits, misses = database.cache_hits, database.cache_misses
+    database.load_json(sessions_file)
+    database.get(sessions_file, "s1")
+    assert (database.cache_hits, database.cache_misses) == (hits + 2, misses)
+
+    # A different size is a change, even where the mtime is the same
+    stat = sessions_file.stat()
+    sessions_file.write_bytes(_json_dumps([_session("s1"), _session("s2")]))
+    os.utime(sessions_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert [s["id"] for s in database.load_json(sessions_file)] == ["s1", "s2"]
+    assert (database.cache_hits, database.cache_misses) == (hits + 2, misses + 1)
+
+    # So is a different mtime, even where the size is the same
+    sessions_file.write_bytes(_json_dumps([_session("s1"), _session("s3")]))
+    os.utime(sessions_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert [s["id"] for s in database.load_json(sessions_file)] == ["s1", "s3"]
+    assert (database.cache_hits, database.cache_misses) == (hits + 2, misses + 2)
+
+
+def test_torn_journal_tail_is_ignored_and_cut_off_by_the_next_append(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    JSONFileDatabase(journaled_files=[sessions_file]).insert(sessions_file, _session("s1"))
+    journal_path = JSONFileDatabase.journal_path(sessions_file)
+    intact = journal_path.read_bytes()
+    with open(journal_path, 'ab') as f:
+        f.write(_json_dumps({"op": "insert", "id": "s2", "doc": _session("s2")})[:20])
+
+    database = JSONFileDatabase(journaled_files=[sessions_file])
+    assert [s["id"] for s in database.load_json(sessions_file)] == ["s1"]
+    database.insert(sessions_file, _session("s3"))
+    assert journal_path.read_bytes().startswith(intact + b'{"op":"insert","id":"s3"')
+    assert [s["id"] for s in JSONFileDatabase().load_json(sessions_file)] == ["s1", "s3"]
+
+
+def test_failed_sqlite_migration_copies_nothing_and_is_retried(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    json_db = JSONFileDatabase()
+    # A duplicate id breaks the copy half-way through
+    json_db.save_json(sessions_file, [_session("s1"), _session("s2"), _session("s1")])
+    sqlite_db = SQLiteDatabase(tmp_path / 'sculptor.db')
+    with pytest.raises(sqlite3.IntegrityError):
+        migrate_json_to_sqlite(json_db, sqlite_db, [sessions_file])
+    assert sqlite_db.load_json(sessions_file) == []
+
+    json_db.save_json(sessions_file, [_session("s1"), _session("s2")])
+    assert migrate_json_to_sqlite(json_db, sqlite_db, [sessions_file]) == {"sessions": 2}
+
+
+def test_sqlite_versions_are_shared_between_connections(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    worker_a = SQLiteDatabase(tmp_path / 'sculptor.db')
+    worker_b = SQLiteDatabase(tmp_path / 'sculptor.db')
+    assert worker_a.version(sessions_file) == worker_b.version(sessions_file)
+
+    before = worker_b.version(sessions_file)
+    worker_a.insert(sessions_file, _session("s1"))
+    # Reading the version does not touch the database; polling does
+    assert worker_b.version(sessions_file) == before
+    worker_b.poll(sessions_file)
+    assert worker_b.version(sessions_file) != before
+    assert worker_b.version(sessions_file) == worker_a.version(sessions_file)
+
+
+def test_change_logs_number_writes_across_instances(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    for open_database in (
+            lambda: JSONFileDatabase(journaled_files=[sessions_file], multiprocess=True,
+                                     change_log_files=[sessions_file], change_log_entries=3),
+            lambda: SQLiteDatabase(tmp_path / 'sculptor.db', change_log_entries=3)):
+        database = open_database()
+        assert database.changes(sessions_file) == (None, 0, None)
+        database.insert(sessions_file, _session("s1"))
+        database.update(sessions_file, "s1", _increment)
+        log_id, seq, entries = database.changes(sessions_file, 0)
+        assert seq == 2 and entries == [(1, {"op": "insert", "id": "s1"}), (2, {"op": "replace", "id": "s1"})]
+
+        # Another process, or the same one after a restart, continues the same log
+        reopened = open_database()
+        reopened.delete(sessions_file, "s1")
+        assert database.changes(sessions_file, 2) == (log_id, 3, [(3, {"op": "delete", "id": "s1"})])
+        for n in range(2, 7):
+            reopened.insert(sessions_file, _session(f"s{n}"))
+        assert database.changes(sessions_file, 2) == (log_id, 8, None)
+        assert [seq for seq, _ in database.changes(sessions_file, 5)[2]] == [6, 7, 8]
+        database.save_json(sessions_file, [])
+        assert reopened.changes(sessions_file, 8)[2] == [(9, None)]
+
+    # Outside edits of the files, or log lines lost in a crash, start a new log
+    database = JSONFileDatabase(change_log_files=[sessions_file])
+    log_id, seq, _ = database.changes(sessions_file)
+    JSONFileDatabase().save_json(sessions_file, [_session("s9")])
+    outside_id, _, _ = database.changes(sessions_file, seq)
+    assert outside_id != log_id
+    database.insert(sessions_file, _session("s10"))
+    log_path = database._change_log(sessions_file).path
+    log_path.write_bytes(log_path.read_bytes().rsplit(b'\n', 2)[0] + b'\n')
+    database.delete(sessions_file, "s10")
+    assert database.changes(sessions_file)[0] not in (log_id, outside_id)
+
+
+def test_change_log_adds_no_fsync_to_journal_writes(tmp_path, monkeypatch):
+    sessions_file = tmp_path / 'sessions.json'
+    database = JSONFileDatabase(journaled_files=[sessions_file], change_log_files=[sessions_file])
+    database.insert(sessions_file, _session("s1"))
+    fsyncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: fsyncs.append(fd) or real_fsync(fd))
+    database.update_many(sessions_file, {"s1": _increment})
+    database.insert(sessions_file, _session("s2"))
+    assert len(fsyncs) == 2
+    assert [op for _, op in database.changes(sessions_file, 1)[2]] == [
+        {"op": "replace", "id": "s1"}, {"op": "insert", "id": "s2"}]
+
+
+def test_indexes_follow_writes(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    database = JSONFileDatabase(journaled_files=[sessions_file], indexes={sessions_file: ['split_id', 'day_number']})
+    for i in range(6):
+        database.insert(sessions_file, {"id": f"s{i}", "split_id": f"split{i % 2}", "day_number": i % 3})
+
+    assert [s["id"] for s in database.find(sessions_file, split_id="split0")] == ["s0", "s2", "s4"]
+    assert [s["id"] for s in database.find(sessions_file, split_id="split1", day_number=1)] == ["s1"]
+    assert database.find(sessions_file, split_id="nope") == []
+
+    database.replace(sessions_file, "s2", {"id": "s2", "split_id": "split1", "day_number": 2})
+    database.delete(sessions_file, "s0")
+    assert [s["id"] for s in database.find(sessions_file, split_id="split0")] == ["s4"]
+    assert [s["id"] for s in database.find(sessions_file, split_id="split1", day_number=2)] == ["s2", "s5"]
+    assert database.get(sessions_file, "s3")["day_number"] == 0
+    assert database.get(sessions_file, "s0") is None
+    assert database.update(sessions_file, "s5", lambda s: dict(s, day_number=0))["day_number"] == 0
+    assert [s["id"] for s in database.find(sessions_file, day_number=0)] == ["s3", "s5"]
+
+
+def test_sqlite_engine_matches_json_engine(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    json_db = JSONFileDatabase(journaled_files=[sessions_file])
+    session = {
+        "id": "s1", "split_id": "split1", "day_number": 2,
+        "exercises": [{"exercise_id": "e1", "exercise_name": "Squats",
+                       "sets": [{"set_number": 1, "weight": 100.0, "reps": 5}],
+                       "completed_count": 0, "target_completions": 3, "is_archived": False}],
+        "completed_at": "2024-05-01 10:00:00",
+    }
+    json_db.insert(sessions_file, session)
+    json_db.insert(sessions_file, dict(session, id="s2", day_number=3))
+
+    sqlite_db = SQLiteDatabase(tmp_path / 'sculptor.db')
+    assert migrate_json_to_sqlite(json_db, sqlite_db, [sessions_file]) == {"sessions": 2}
+    assert migrate_json_to_sqlite(json_db, sqlite_db, [sessions_file]) == {}
+    assert sqlite_db.load_json(sessions_file) == json_db.load_json(sessions_file)
+    assert [s["id"] for s in sqlite_db.find(sessions_file, split_id="split1", day_number=3)] == ["s2"]
+
+    async_db = AsyncJSONDatabase(sqlite_db, max_workers=8)
+
+    async def main():
+        await asyncio.gather(*(async_db.update(sessions_file, "s1", _increment) for _ in range(20)))
+
+    asyncio.run(main())
+    async_db.shutdown()
+    assert sqlite_db.get(sessions_file, "s1")["exercises"][0]["completed_count"] == 20
+    assert sqlite_db.delete(sessions_file, "s1")
+    assert [s["id"] for s in sqlite_db.load_json(sessions_file)] == ["s2"]
+
+
+def test_page_walks_sorted_index_with_keyset_cursor(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    database = JSONFileDatabase(journaled_files=[sessions_file], sorted_indexes={sessions_file: ['completed_at']})
+    for i in range(10):
+        database.insert(sessions_file, {"id": f"s{i}", "completed_at": f"2024-01-{i % 5 + 1:02d}"})
+    database.replace(sessions_file, "s0", {"id": "s0", "completed_at": "2024-02-01"})
+    database.delete(sessions_file, "s9")
+
+    first = database.page(sessions_file, 'completed_at', limit=3)
+    assert [s["id"] for s in first] == ["s0", "s4", "s8"]
+    after = (first[-1]["completed_at"], first[-1]["id"])
+    assert [s["id"] for s in database.page(sessions_file, 'completed_at', after=after, limit=3)] == ["s3", "s7", "s2"]
+    in_range = database.page(sessions_file, 'completed_at', start="2024-01-02", end="2024-01-04", descending=False)
+    assert [s["id"] for s in in_range] == ["s1", "s6", "s2", "s7"]
+    # The unindexed fallback orders the same way
+    assert JSONFileDatabase().page(sessions_file, 'completed_at', after=after, limit=3) == \
+        database.page(sessions_file, 'completed_at', after=after, limit=3)
+
+
+def test_iterate_streams_every_record_in_batches(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    database = JSONFileDatabase(sorted_indexes={sessions_file: ['completed_at']})
+    for i in range(7):
+        database.insert(sessions_file, {"id": f"s{i}", "completed_at": None if i == 3 else f"2024-01-{i % 3 + 1:02d}"})
+    async_db = AsyncJSONDatabase(database, max_workers=2)
+
+    async def collect():
+        return [s["id"] async for s in async_db.iterate(sessions_file, 'completed_at', batch_size=2, descending=False)]
+
+    assert asyncio.run(collect()) == [s["id"] for s in database.page(sessions_file, 'completed_at', descending=False)]
+    async_db.shutdown()
+
+
+def test_storage_formats_read_each_other(tmp_path):
+    splits_file = tmp_path / 'splits.json'
+    records = [{"id": "a", "name": "Push ü", "days": [{"day_number": 1}]}, {"id": "b", "weight": 62.5}]
+    for storage_format in ('msgpack', 'compact-json', 'json'):
+        assert JSONFileDatabase(storage_format=storage_format).save_json(splits_file, records)
+        for reader_format in ('json', 'msgpack'):
+            assert JSONFileDatabase(storage_format=reader_format).load_json(splits_file) == records
+
+
+def test_packed_session_cache_is_several_times_smaller(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    catalogue = [(str(uuid.uuid4()), f"Exercise {n}") for n in range(30)]
+    splits = [str(uuid.uuid4()) for _ in range(3)]
+    sessions = [{
+        "id": str(uuid.uuid4()), "split_id": splits[i % 3], "day_number": i % 4 + 1,
+        "exercises": [{
+            "exercise_id": catalogue[(i + j) % 30][0], "exercise_name": catalogue[(i + j) % 30][1],
+            "sets": [{"set_number": k + 1, "weight": 60.0 + 2.5 * k, "reps": 8 - k} for k in range(4)],
+            "completed_count": 1, "target_completions": 3, "is_archived": False,
+        } for j in range(5)],
+        "completed_at": f"2024-01-01 10:00:00.{i:06d}",
+    } for i in range(5000)]
+    # Records it cannot hold exactly stay as they are
+    sessions[1]["exercises"][0]["sets"][0]["weight"] = 60
+    sessions[2]["exercises"][0]["sets"][0]["reps"] = 70000
+    JSONFileDatabase().save_json(sessions_file, sessions)
+
+    def cache_size(**options):
+        tracemalloc.start()
+        database = JSONFileDatabase(**options)
+        database.get(sessions_file, sessions[0]["id"])
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size, database
+
+    dicts_size, _ = cache_size()
+    packed_size, packed = cache_size(journaled_files=[sessions_file], packed_files=[sessions_file],
+                                     sorted_indexes={sessions_file: ['completed_at']})
+    print(f"\ncached sessions: dicts {dicts_size // 1024} KiB, packed {packed_size // 1024} KiB")
+    assert packed_size * 3 < dicts_size
+    assert _json_dumps(packed.load_json(sessions_file)) == _json_dumps(sessions)
+
+    packed.update(sessions_file, sessions[3]["id"], lambda session: dict(session, day_number=9))
+    assert packed.get(sessions_file, sessions[3]["id"])["day_number"] == 9
+    assert packed.page(sessions_file, 'completed_at', limit=1)[0] == sessions[-1]
+    assert packed.compact(sessions_file)
+    assert JSONFileDatabase().get(sessions_file, sessions[2]["id"]) == sessions[2]
+
+
+def test_monthly_partitions_read_past_months_only_when_needed(tmp_path):
+    sessions_file = tmp_path / 'sessions.json'
+    current = PartitionedJSONFileDatabase.current_month()
+    months = ["2024-01", "2024-02", "2024-03", current]
+    sessions = [{"id": f"{month}-{n}", "completed_at": f"{month}-0{n + 1} 10:00:00", "exercises": []}
+                for month in months for n in range(3)]
+    single = JSONFileDatabase(journaled_files=[sessions_file])
+    single.save_json(sessions_file, sessions[:6])
+    for session in sessions[6:]:
+        single.insert(sessions_file, session)
+
+    def open_database():
+        return PartitionedJSONFileDatabase({sessions_file: 'completed_at'}, journaled_files=[sessions_file],
+                                           sorted_indexes={sessions_file: ['completed_at']},
+                                           packed_files=[sessions_file])
+
+    database = open_database()
+    assert database.load_json(sessions_file) == sessions
+    assert not sessions_file.exists() and not JSONFileDatabase.journal_path(sessions_file).exists()
+    assert database.close_partitions(sessions_file) == 3
+    partitions = tmp_path / 'sessions'
+    assert sorted(path.name for path in partitions.iterdir()) == [
+        "2024-01.json.gz", "2024-02.json.gz", "2024-03.json.gz", f"{current}.json"]
+
+    # Recent history comes from the current month alone
+    database = open_database()
+    assert [s["id"] for s in database.page(sessions_file, 'completed_at', limit=2)] == [f"{current}-2", f"{current}-1"]
+    assert database.get(sessions_file, f"{current}-0")["completed_at"].startswith(current)
+    assert database.cache_stats()["cached_files"] == [f"{current}.json"]
+    february = database.page(sessions_file, 'completed_at', start="2024-02", end="2024-03", descending=False)
+    assert [s["id"] for s in february] == ["2024-02-0", "2024-02-1", "2024-02-2"]
+    assert "2024-01.json.gz" not in database.cache_stats()["cached_files"]
+
+    # A past session can still change, and moves with its timestamp
+    writes = []
+    database.add_listener(lambda file_path, op: writes.append((file_path, op and op["op"])))
+    database.update(sessions_file, "2024-01-1", lambda session: dict(session, exercises=[{"exercise_id": "e1"}]))
+    database.replace(sessions_file, "2024-02-0", dict(sessions[3], completed_at=f"{current}-09 10:00:00"))
+    assert writes == [(sessions_file, "replace"), (sessions_file, "delete"), (sessions_file, "insert")]
+    assert [s["id"] for s in database.page(sessions_file, 'completed_at', start="2024-02", end="2024-03")] == [
+        "2024-02-2", "2024-02-1"]
+    assert database.compact(sessions_file)
+    assert sorted(path.name for path in partitions.iterdir()) == [
+        "2024-01.json.gz", "2024-02.json.gz", "2024-03.json.gz", f"{current}.json"]
+    reopened = open_database()
+    assert reopened.get(sessions_file, "2024-01-1")["exercises"] == [{"exercise_id": "e1"}]
+    assert len(reopened.find(sessions_file)) == 12
+
+    # Full scans and lookups leave closed months out of the cache, and their ids spare re-reads
+    cold = open_database()
+    assert len(cold.load_json(sessions_file)) == 12 and len(cold.find(sessions_file, exercises=[])) == 11
+    assert cold.get(sessions_file, "2024-02-1")["id"] == "2024-02-1"
+    assert cold.get(sessions_file, "missing") is None
+    assert cold.cache_stats()["cached_files"] == [f"{current}.json"]
+    reads = []
+    read = cold._read
+    cold._read = lambda path, signature: reads.append(path.name) or read(path, signature)
+    assert cold.get(sessions_file, "missing") is None and reads == []
+
+    # A single file turning up next to the partitions is merged into them
+    JSONFileDatabase().save_json(sessions_file, [
+        dict(sessions[0], exercises=[{"exercise_id": "e2"}]),
+        dict(sessions[6], completed_at=f"{current}-10 10:00:00"),
+        {"id": "new", "completed_at": f"{current}-11 10:00:00", "exercises": []}])
+    merged = open_database()
+    assert len(merged.find(sessions_file)) == 13
+    assert merged.get(sessions_file, "2024-01-0")["exercises"] == [{"exercise_id": "e2"}]
+    assert merged.get(sessions_file, "2024-01-1")["exercises"] == [{"exercise_id": "e1"}]
+    assert merged.get(sessions_file, "2024-03-0")["completed_at"].startswith(current)
+    assert [s["id"] for s in merged.page(sessions_file, 'completed_at', limit=2)] == ["new", "2024-03-0"]
+    assert sorted(path.name for path in partitions.iterdir()) == [
+        "2024-01.json.gz", "2024-02.json.gz", "2024-03.json.gz", f"{current}.json"]